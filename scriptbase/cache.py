@@ -0,0 +1,162 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Result cache for idempotent external commands.
+
+Results are addressed by a hash of everything that can affect them, i.e. the
+command arguments, working directory, selected environment variables, input
+data, and the modification times and sizes of selected files. Changing any of
+those produces a different key, so stale entries are simply never found again.
+
+An in-process LRU is always used, and an optional directory allows results to
+be shared between runs.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def file_stamp(path):
+    """Return (mtime_ns, size) for a path, or None if it doesn't exist."""
+    try:
+        stat = os.stat(path)
+    except (IOError, OSError):
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class ResultCache(object):
+    """LRU cache of command results with optional time-to-live and disk storage."""
+
+    class Entry(object):
+        """Cached return code and output lines with creation time."""
+
+        def __init__(self, return_code, output_lines, timestamp):
+            """Construct with return code, output lines and time.time() timestamp."""
+            self.return_code = return_code
+            self.output_lines = output_lines
+            self.timestamp = timestamp
+
+        def is_expired(self, ttl):
+            """Return True if older than ttl seconds (never if ttl is None)."""
+            return ttl is not None and time.time() - self.timestamp > ttl
+
+    def __init__(self, max_entries=256, directory=None):
+        """
+        Construct cache.
+
+        Keyword arguments:
+            max_entries  maximum in-process entries (default=256)
+            directory    optional directory for persistent entries (default=None)
+        """
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def make_key(cls, args, cwd=None, env=None, input_digest=None, files=None):   #pylint: disable=too-many-arguments
+        """
+        Build a key from everything that can affect a command result.
+
+        Keyword arguments:
+            cwd           working directory
+            env           dictionary of relevant environment variables
+            input_digest  hash of standard input data
+            files         paths whose modification stamps invalidate the result
+        """
+        key_data = [
+            [str(arg) for arg in args],
+            cwd,
+            sorted((env or {}).items()),
+            input_digest,
+            [[path, file_stamp(path)] for path in (files or [])],
+        ]
+        return hashlib.sha256(json.dumps(key_data).encode('utf8')).hexdigest()
+
+    def get(self, key, ttl=None):
+        """Return an unexpired Entry or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key)
+            if entry is not None:
+                self._remember(key, entry)
+        with self._lock:
+            if entry is None or entry.is_expired(ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry
+
+    def put(self, key, return_code, output_lines):
+        """Save a command result."""
+        entry = ResultCache.Entry(return_code, list(output_lines), time.time())
+        self._remember(key, entry)
+        self._save(key, entry)
+
+    def clear(self):
+        """Discard all in-process entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, '%s.json' % key)
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._get_path(key)) as file_handle:
+                data = json.load(file_handle)
+            return ResultCache.Entry(data['return_code'], data['output_lines'], data['timestamp'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save(self, key, entry):
+        if not self.directory:
+            return
+        # Write to a temporary file and rename so readers never see partial data.
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(file_descriptor, 'w') as file_handle:
+                json.dump(dict(return_code=entry.return_code,
+                               output_lines=entry.output_lines,
+                               timestamp=entry.timestamp), file_handle)
+            os.replace(temporary_path, self._get_path(key))
+        except (IOError, OSError):
+            pass
+
+
+# Shared cache used by Command objects with the "cache" option set to True.
+RESULT_CACHE = ResultCache()
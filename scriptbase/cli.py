@@ -112,6 +112,9 @@ except ImportError:
 from . import command
 from . import utility
 from . import console
+from . import trace
+from . import plan
+from . import instrument
 from .configuration import Config
 
 
@@ -465,6 +468,7 @@ class Main(object):     #pylint: disable=too-many-instance-attributes
                  support_pause=False,
                  support_discovery=False,
                  support_plugins=False,
+                 support_trace=False,
                  runner_type=command.Runner,
                  program_name=None,
                  program_directory=None,
@@ -478,6 +482,7 @@ class Main(object):     #pylint: disable=too-many-instance-attributes
         self.runner_type = runner_type
         self.support_discovery = support_discovery
         self.support_plugins = support_plugins
+        self.support_trace = support_trace
         self.program_name = program_name
         self.program_directory = program_directory
         self.function = None
@@ -500,8 +505,16 @@ def _get_arg_specs():
         arg_specs.append(Boolean('VERBOSE', "display verbose messages", '-v', '--verbose'))
     if Main.instance.support_dry_run:
         arg_specs.append(Boolean('DRY_RUN', "display commands without executing them", '--dry-run'))
+        arg_specs.append(String('PLAN', "with --dry-run save the command plan as JSON to FILE",
+                                '--plan', metavar='FILE'))
+        arg_specs.append(String('HISTORY', "command timing history FILE, appended to by real"
+                                           " runs and used for --plan estimates",
+                                '--history', metavar='FILE'))
     if Main.instance.support_pause:
         arg_specs.append(Boolean('PAUSE', "pause before executing each command", '--pause'))
+    if Main.instance.support_trace:
+        arg_specs.append(String('TRACE', "save Chrome trace-event timeline to FILE", '--trace',
+                                metavar='FILE'))
     return arg_specs
 
 def _preparse_args(args, arg_specs):
@@ -512,6 +525,28 @@ def _preparse_args(args, arg_specs):
     tmp_args, _ = preparser.parse_known_args(args=args)
     if Main.instance.support_verbose:
         console.set_verbose(tmp_args.VERBOSE)
+    # Start tracing early enough to include discovery.
+    if Main.instance.support_trace and tmp_args.TRACE:
+        trace.start()
+    if Main.instance.support_dry_run:
+        if tmp_args.DRY_RUN and tmp_args.PLAN:
+            plan.start()
+        elif not tmp_args.DRY_RUN and tmp_args.HISTORY:
+            instrument.enable()
+    return tmp_args
+
+def _save_results(tmp_args):
+    # Save the trace, plan or history files requested by pre-parsed options.
+    if Main.instance.support_trace and tmp_args.TRACE:
+        trace.save(tmp_args.TRACE)
+    if Main.instance.support_dry_run:
+        if tmp_args.DRY_RUN and tmp_args.PLAN:
+            history = None
+            if tmp_args.HISTORY and os.path.exists(tmp_args.HISTORY):
+                history = plan.TimingHistory.load(tmp_args.HISTORY)
+            plan.save(tmp_args.PLAN, history=history)
+        elif not tmp_args.DRY_RUN and tmp_args.HISTORY:
+            instrument.save_records(tmp_args.HISTORY)
 
 def _parse_args(args, arg_specs):
     parser = Verb.get_parser(Main.instance.description, arg_specs)
@@ -523,7 +558,8 @@ def _parse_args(args, arg_specs):
 def _load_cli_module(path):
     console.verbose_info('CLI import: %s' % path)
     try:
-        utility.import_module_path(path)
+        with trace.span('import %s' % path, category='discovery'):
+            utility.import_module_path(path)
     except Exception as exc:
         console.error('Exception while executing CLI source file: %s' % path, exc)
         raise
@@ -601,14 +637,15 @@ def _prepare_configuration(runner):
 
 def _invoke(runner, name, func):
     try:
-        func(runner)
+        with trace.span(name, category='invoke'):
+            func(runner)
     except KeyboardInterrupt:
         console.abort('%s interrupted by user.' % name)
     except command.Batch.Error as exc:
         console.abort(exc)
     except command.Batch.Failure as exc:
-        console.abort('%s command batch failed.' % name,
-                      ['return code: %d' % exc.return_code, 'command: %s' % exc.command])
+        messages = ['return code: %d' % exc.return_code, 'command: %s' % exc.command]
+        console.abort('%s command batch %s.' % (name, exc.reason or 'failed'), messages)
     except Exception:    #pylint: disable=broad-except
         console.error('%s traceback (most recent call last)' % name)
         (exc_type, exc_value, exc_tb) = sys.exc_info()
@@ -645,12 +682,20 @@ def main(program_name=None,
     arg_specs = _get_arg_specs()
 
     # Pre-parse arguments so that discovery can be verbose if the option is set.
-    _preparse_args(command_line[1:], arg_specs)
+    preparsed_args = _preparse_args(command_line[1:], arg_specs)
+    try:
+        with trace.span('main %s' % program_name):
+            return _main(program_name, program_directory, command_line, arg_specs)
+    finally:
+        _save_results(preparsed_args)
+
 
+def _main(program_name, program_directory, command_line, arg_specs):
     # Discover commands from discoverable cli directories.
     # Look elsewhere, e.g. under home, /usr/share, etc.?
     command_dirs = [os.path.join(program_directory, 'plugins')]
-    _discover_commands(command_dirs)
+    with trace.span('discover commands', category='discovery'):
+        _discover_commands(command_dirs)
 
     # Use program overrides provided by the @Main decorator.
     if Main.instance.program_name:
@@ -662,10 +707,12 @@ def main(program_name=None,
     command_args = _parse_args(command_line[1:], arg_specs)
 
     # Discover plugin modules, if supported and present.
-    plugins = _discover_plugins(program_name)
+    with trace.span('discover plugins', category='discovery'):
+        plugins = _discover_plugins(program_name)
 
     # Run the command by invoking the @Main() and the corresponding @Command() functions.
-    runner = _prepare_runner(program_name, program_directory, command_args, plugins)
+    with trace.span('prepare runner'):
+        runner = _prepare_runner(program_name, program_directory, command_args, plugins)
 
     # Invoke @Main function (frequently does little or nothing).
     _invoke(runner, '@Main', Main.instance.function)
@@ -81,18 +81,43 @@ with Command('grep', 'abc').pipe_in(open('/path/to/file')) as grepcmd:
     for line in grepcmd:
         print line
 print('grep returned %d' % grepcmd.rc)
+
+# Chain any number of commands with OS pipes (data never passes through Python).
+with Pipeline(['find', '.', '-name', '*.py'], ['xargs', 'wc', '-l'], ['sort', '-n']) as pipeline:
+    for line in pipeline:
+        print line
+print('pipeline returned %d' % pipeline.return_code)
+for stage in pipeline.stages:
+    print('%s: rc=%d elapsed=%.3f' % (stage.args[0], stage.return_code, stage.elapsed))
+
+# Parse NUL-delimited output into records.
+spec = RecordSpec(['mode', 'type', 'sha', 'path'], pattern=r'(\S+) (\S+) (\S+)\t(.*)', delimiter='\0')
+with Command('git', 'ls-tree', '-z', 'HEAD') as lstree:
+    for record in lstree.records(spec):
+        print(record.path)
 """
 
 import sys
 import os
+import re
+import copy
 import shutil
 import subprocess
 import tempfile
+import hashlib
+import concurrent.futures
+import threading
+import time
 from contextlib import contextmanager
 
 from . import utility
 from . import shell
 from . import console
+from . import cache
+from . import instrument
+from . import process
+from . import template
+from . import plan
 
 
 class ExternalCommandError(Exception):
@@ -110,8 +135,18 @@ class ExternalCommandHandler(object):
 
     Used by the Command, Runner, and Batch classes in this module. Not
     generally useful externally.
+
+    Invocations are recorded by the instrument module when it is active.
+    Sub-classes should start processes with popen() or call() so that spawn
+    time and resource usage are included. Asynchronous sub-classes, i.e. ones
+    with processes that outlive on_invoke_command(), must finish the record
+    themselves.
     """
 
+    # Record kind for instrumentation, or None for handlers that don't run processes.
+    kind = 'command'
+    asynchronous = False
+
     def __init__(self, **options):
         """
         External command handler constructor.
@@ -120,6 +155,7 @@ class ExternalCommandHandler(object):
         be validated by set_options().
         """
         self.options = options
+        self._local = threading.local()
 
     def set_options(self, **options):
         """Apply option changes."""
@@ -148,11 +184,13 @@ class ExternalCommandHandler(object):
                 return options[key]
             return self.options.get(key, False)
         def _command_text():
-            return self.on_get_command_text(self, *args)
+            return self.on_get_command_text(*args)
         if _get_option('dry_run'):
             sys.stdout.write('>>> ')
             sys.stdout.write(_command_text())
             sys.stdout.write(os.linesep)
+            plan.add_step(self.kind or 'builtin', _command_text(),
+                          cwd=self.on_get_command_directory(*args))
             return 0
         if _get_option('verbose'):
             console.display_messages(_command_text(), tag='TRACE')
@@ -162,10 +200,70 @@ class ExternalCommandHandler(object):
             sys.stdout.write(os.linesep)
             sys.stdout.write('[Press Enter to continue] ')
             sys.stdin.readline()
+        record = None
+        if self.kind and instrument.RECORDER.is_active():
+            record = instrument.RECORDER.start(self.kind, _command_text())
+        self._local.record = record
+        finished = not self.asynchronous
         try:
             return self.on_invoke_command(*args)
         except ExternalCommandError as exc:
             self.error('External command error:', [_command_text(), exc])
+        except:
+            finished = True
+            raise
+        finally:
+            self._local.record = None
+            if finished:
+                instrument.RECORDER.finish(record)
+
+    def on_get_command_directory(self, *args):     #pylint: disable=unused-argument
+        """Return the command working directory for dry-run plans (default="cwd" option)."""
+        return self.options.get('cwd')
+
+    def current_record(self):
+        """Return the instrumentation record for the command being invoked on this thread."""
+        return getattr(self._local, 'record', None)
+
+    def popen(self, *args, **kwargs):
+        """Start a process with subprocess.Popen() arguments and record the spawn time."""
+        return instrument.popen(self.current_record(), *args, **kwargs)
+
+    def call(self, *args, **kwargs):
+        """
+        Run a process like subprocess.call(), record resource usage, and return the return code.
+
+        Additional keyword arguments:
+            timeout  seconds before the process group is stopped (default=None)
+            cancel   process.CancellationToken that stops the process group (default=None)
+
+        Raises process.Expired if the process was stopped.
+        """
+        timeout = kwargs.pop('timeout', None)
+        cancel = kwargs.pop('cancel', None)
+        watchdog = None
+        if process.Watchdog.is_needed(timeout, cancel):
+            kwargs['start_new_session'] = True
+        child = self.popen(*args, **kwargs)
+        if kwargs.get('start_new_session'):
+            watchdog = process.Watchdog(child, timeout=timeout, cancel=cancel).start()
+        try:
+            return_code = instrument.wait_process(child, self.current_record())
+        except:
+            if watchdog:
+                watchdog.kill('interrupted')
+            else:
+                child.kill()
+            child.wait()
+            raise
+        finally:
+            if watchdog:
+                watchdog.stop()
+        if watchdog and watchdog.reason:
+            if self.current_record() is not None:
+                self.current_record().expired = watchdog.reason
+            raise process.Expired(watchdog.reason, return_code)
+        return return_code
 
     def error(self, *args, **kwargs):
         """Display error and optionally abort."""
@@ -182,6 +280,126 @@ class ExternalCommandHandler(object):
         return ' '.join([str(arg) for arg in args])
 
 
+class Record(object):
+    """
+    Base class for lightweight parsed output records.
+
+    RecordSpec generates sub-classes with __slots__ for the field names.
+    """
+
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, *values):
+        """Construct with one value per field."""
+        for name, value in zip(self.fields, values):
+            setattr(self, name, value)
+
+    def __iter__(self):
+        """Iterate field values."""
+        return (getattr(self, name) for name in self.fields)
+
+    def __eq__(self, other):
+        """Compare type and field values."""
+        return type(self) is type(other) and tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        """Compare type and field values."""
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        """Display field values."""
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(['%s=%r' % (name, getattr(self, name))
+                                      for name in self.fields]))
+
+    def as_dict(self):
+        """Return a field dictionary."""
+        return dict(zip(self.fields, self))
+
+
+class RecordSpec(object):
+    """
+    Compiled specification for parsing command output into Record objects.
+
+    Output is split into items by a delimiter, e.g. '\\0' for the "-z" output
+    of git and find commands. Items are parsed either by a regular
+    expression, with one group per field, or by splitting around a field
+    separator. Unmatched items are skipped.
+    """
+
+    def __init__(self,      #pylint: disable=too-many-arguments
+                 fields,
+                 pattern=None,
+                 separator=None,
+                 delimiter='\n',
+                 converters=None,
+                 name='Record'):
+        """
+        Construct and compile the specification.
+
+        Positional arguments:
+            1) field name sequence
+
+        Keyword arguments:
+            pattern     regular expression string or object with field groups (default=None)
+            separator   field separator, or None for whitespace, if there's no pattern
+            delimiter   item delimiter, e.g. '\\n' (default) or '\\0'
+            converters  dictionary mapping field names to conversion functions
+            name        generated Record sub-class name (default='Record')
+
+        The last field receives the remainder when splitting, and missing
+        fields are None.
+        """
+        self.fields = tuple(fields)
+        self.delimiter = delimiter.encode('utf8')
+        self.record_class = type(name, (Record,), dict(__slots__=self.fields,
+                                                       fields=self.fields))
+        self.parse = self._compile(pattern, separator, converters or {})
+
+    def _compile(self, pattern, separator, converters):
+        # Return a function that converts text to a Record or None.
+        record_class = self.record_class
+        field_count = len(self.fields)
+        if pattern is not None:
+            regex = re.compile(pattern) if utility.is_string(pattern) else pattern
+            if regex.groupindex:
+                get_values = lambda matched: [matched.group(name) for name in self.fields]
+            else:
+                get_values = lambda matched: matched.groups()[:field_count]
+            def _parse_values(text):
+                matched = regex.match(text)
+                return get_values(matched) if matched else None
+        else:
+            def _parse_values(text):
+                values = text.split(separator, field_count - 1)
+                if not values:
+                    return None
+                values.extend([None] * (field_count - len(values)))
+                return values
+        if not converters:
+            def _parse(text):
+                values = _parse_values(text)
+                return record_class(*values) if values is not None else None
+        else:
+            field_converters = [converters.get(name) for name in self.fields]
+            def _parse(text):
+                values = _parse_values(text)
+                if values is None:
+                    return None
+                return record_class(*[converter(value) if converter and value is not None
+                                      else value
+                                      for converter, value in zip(field_converters, values)])
+        return _parse
+
+    def parse_batch(self, items):
+        """Parse a sequence of text items and return a Record list, without unmatched items."""
+        parse = self.parse
+        return [record for record in map(parse, items) if record is not None]
+
+
 class Command(object):
     """
     Run a single command with various methods for accessing results.
@@ -219,18 +437,31 @@ class Command(object):
 
     class _Handler(ExternalCommandHandler):
 
+        # The Command finishes the instrumentation record after the process ends.
+        asynchronous = True
+
         def __init__(self, args):
             ExternalCommandHandler.__init__(
                 self,
                 bufsize=1,
                 input_source=None,
                 capture_on_exit=True,
+                cwd=None,
+                env=None,
+                cache=False,
+                ttl=None,
+                cache_env=(),
+                cache_files=(),
+                timeout=None,
+                cancel=None,
                 dry_run=False,
                 verbose=False,
                 pause=False,
             )
             self.args = args
             self.process = None
+            self.record = None
+            self.watchdog = None
 
         def on_invoke_command(self):        #pylint: disable=arguments-differ
             """
@@ -239,15 +470,29 @@ class Command(object):
             The arguments were supplied to the constructor, so no args or
             kwargs are expected.
             """
-            input_stream = self.get_option('input_source')
-            self.process = subprocess.Popen(
+            input_source = self.get_option('input_source')
+            feeder = input_source if isinstance(input_source, _InputFeeder) else None
+            input_stream = subprocess.PIPE if feeder else input_source
+            self.record = self.current_record()
+            needs_watchdog = process.Watchdog.is_needed(self.get_option('timeout'),
+                                                        self.get_option('cancel'))
+            self.process = self.popen(
                 self.args,
                 bufsize=self.get_option('bufsize'),
                 stdin=input_stream,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT
+                stderr=subprocess.STDOUT,
+                cwd=self.get_option('cwd'),
+                env=self.get_option('env'),
+                start_new_session=needs_watchdog,
             )
-            if input_stream and hasattr(input_stream, 'fileno'):
+            if needs_watchdog:
+                self.watchdog = process.Watchdog(self.process,
+                                                 timeout=self.get_option('timeout'),
+                                                 cancel=self.get_option('cancel')).start()
+            if feeder:
+                feeder.start(self.process.stdin)
+            elif input_stream and hasattr(input_stream, 'fileno'):
                 input_stream.close()
 
         def on_get_command_text(self):      #pylint: disable=arguments-differ
@@ -268,7 +513,11 @@ class Command(object):
         self.output_lines = []
         self.in_with_block = False
         self.return_code = None
+        self.expired = None
         self._handler = Command._Handler(args)
+        self._cached = None
+        self._cache_key = None
+        self._cache_lines = None
 
     def options(self, **kwargs):
         """
@@ -277,11 +526,29 @@ class Command(object):
         Returns self so that a chained call provides the "with" statement object.
 
         bufsize          buffer size, see subprocess.Popen() for more information (default=1)
-        input_source     string, stream, or Command to pipe to standard input (default=None)
+        input_source     stream to pipe to standard input, normally set by pipe_in()
+        cwd              working directory for the child process (default=None)
+        env              complete environment dictionary for the child process (default=None)
+        cache            True or a cache.ResultCache to reuse results of identical commands
+        ttl              maximum cached result age in seconds (default=None, i.e. no limit)
+        cache_env        environment variable names that affect cached results
+        cache_files      paths whose modification invalidates cached results, e.g. .git/HEAD
+        timeout          seconds before the command's process group is stopped (default=None)
+        cancel           process.CancellationToken that stops the command (default=None)
         dry_run          don't execute if True
         verbose          display verbose messages if True
         pause            pause before executing the command if True
         capture_on_exit  captures remaining output to "output_lines" member if True (default=True)
+
+        Caching is only for idempotent commands. Results are keyed on the
+        arguments, working directory, "cache_env" variables, string input and
+        "cache_files" modification stamps. Completely read output is cached
+        along with the return code. Stream and Command input is not cached.
+
+        A command stopped due to a timeout or cancellation has a negative
+        (signal) return code and the reason text in the "expired" member. A
+        command with a timeout or cancellation token is also stopped if an
+        exception leaves the "with" block.
         """
         self._check_not_running()
         self._handler.set_options(**kwargs)
@@ -290,16 +557,73 @@ class Command(object):
     def __enter__(self):
         """Open sub-process at the start of a with block."""
         self.in_with_block = True
-        self._handler.run_command()
-        self.process = self._handler.process
+        if not self._check_cache():
+            self._handler.run_command()
+            self.process = self._handler.process
         return self
 
     def __exit__(self, exit_type, exit_value, exit_traceback):
         """Close sub-process and capture results at the end of a with block."""
-        if self.process is not None:
+        if self._cached is not None:
             if self._handler.get_option('capture_on_exit'):
                 self.output_lines.extend([line for line in self.__iter__()])
-            self.return_code = self.process.wait()
+            self.return_code = self._cached.return_code
+        elif self.process is not None:
+            watchdog = self._handler.watchdog
+            try:
+                if exit_type is not None and watchdog:
+                    watchdog.kill('interrupted')
+                if self._handler.get_option('capture_on_exit'):
+                    self.output_lines.extend([line for line in self.__iter__()])
+                self.return_code = instrument.wait_process(self.process, self._handler.record)
+            except:
+                if watchdog:
+                    watchdog.kill('interrupted')
+                raise
+            finally:
+                if watchdog:
+                    self.expired = watchdog.stop()
+            if self.expired and self._handler.record is not None:
+                self._handler.record.expired = self.expired
+            instrument.RECORDER.finish(self._handler.record)
+            input_source = self._handler.get_option('input_source')
+            if isinstance(input_source, _InputFeeder):
+                input_source.join()
+                if input_source.exception is not None and exit_type is None:
+                    raise input_source.exception
+            # Only cache complete output.
+            if self._cache_lines is not None and self.done:
+                self._get_cache().put(self._cache_key, self.return_code, self._cache_lines)
+
+    def _get_cache(self):
+        cache_option = self._handler.get_option('cache')
+        return cache.RESULT_CACHE if cache_option is True else cache_option
+
+    def _check_cache(self):
+        # Return True if a cached result is available, or prepare to cache one.
+        if not self._handler.get_option('cache') or self._handler.get_option('dry_run'):
+            return False
+        input_source = self._handler.get_option('input_source')
+        input_digest = None
+        if input_source is not None:
+            if not isinstance(input_source, tempfile.SpooledTemporaryFile):
+                return False
+            input_digest = hashlib.sha256(input_source.read()).hexdigest()
+            input_source.seek(0)
+        environment = self._handler.get_option('env') or os.environ
+        self._cache_key = cache.ResultCache.make_key(
+            self._handler.args,
+            cwd=os.path.abspath(self._handler.get_option('cwd') or os.getcwd()),
+            env={name: environment.get(name) for name in self._handler.get_option('cache_env')},
+            input_digest=input_digest,
+            files=self._handler.get_option('cache_files'))
+        self._cached = self._get_cache().get(self._cache_key, ttl=self._handler.get_option('ttl'))
+        if self._cached is not None:
+            if input_source is not None:
+                input_source.close()
+            return True
+        self._cache_lines = []
+        return False
 
     def _check_in_with_block(self):
         if not self.in_with_block:
@@ -311,14 +635,78 @@ class Command(object):
 
     def __iter__(self):
         """Iteration yields an output line at a time."""
-        if not self._handler.get_option('dry_run'):
+        if self._cached is not None:
+            self._check_in_with_block()
+            self._handler.set_options(capture_on_exit=False)
+            for line in self._cached.output_lines:
+                yield line
+        elif not self._handler.get_option('dry_run'):
             self._check_in_with_block()
             self._handler.set_options(capture_on_exit=False)
             # Work around a Python 2 readline issue (https://bugs.python.org/issue3907).
             if not self.process.stdout.closed:
                 with self.process.stdout:
                     for line in iter(self.process.stdout.readline, b''):
-                        yield line.decode('utf8').rstrip()
+                        if self._handler.record is not None:
+                            self._handler.record.add_bytes_read(len(line))
+                        line = line.decode('utf8').rstrip()
+                        if self._cache_lines is not None:
+                            self._cache_lines.append(line)
+                        yield line
+                    self.done = True
+
+    def record_batches(self, spec, chunk_size=65536):
+        """
+        Parse output with a RecordSpec, yielding Record lists.
+
+        Output is read in chunks of up to chunk_size bytes, and each batch has
+        the records completed by one chunk. Trailing whitespace is removed
+        from newline-delimited items, as for line iteration. Results are not
+        cached, but a cached result is parsed if available.
+        """
+        if self._cached is not None:
+            self._check_in_with_block()
+            self._handler.set_options(capture_on_exit=False)
+            text = '\n'.join(self._cached.output_lines)
+            yield spec.parse_batch(self._split_items(text.encode('utf8'), spec.delimiter, True))
+        elif not self._handler.get_option('dry_run'):
+            self._check_in_with_block()
+            self._handler.set_options(capture_on_exit=False)
+            # Parsed output is not in the line format that is cached.
+            self._cache_lines = None
+            if not self.process.stdout.closed:
+                with self.process.stdout:
+                    remainder = b''
+                    read = getattr(self.process.stdout, 'read1', self.process.stdout.read)
+                    for chunk in iter(lambda: read(chunk_size), b''):
+                        if self._handler.record is not None:
+                            self._handler.record.add_bytes_read(len(chunk))
+                        items = (remainder + chunk).split(spec.delimiter)
+                        remainder = items.pop()
+                        if items:
+                            yield spec.parse_batch(self._decode_items(items, spec.delimiter))
+                    if remainder:
+                        yield spec.parse_batch(self._decode_items([remainder], spec.delimiter))
+                    self.done = True
+
+    def records(self, spec, chunk_size=65536):
+        """Parse output with a RecordSpec, yielding Record objects (see record_batches())."""
+        for batch in self.record_batches(spec, chunk_size=chunk_size):
+            for record in batch:
+                yield record
+
+    @classmethod
+    def _split_items(cls, data, delimiter, final):
+        items = data.split(delimiter)
+        if final and items and not items[-1]:
+            items.pop()
+        return cls._decode_items(items, delimiter)
+
+    @classmethod
+    def _decode_items(cls, items, delimiter):
+        if delimiter == b'\n':
+            return [item.decode('utf8', 'replace').rstrip() for item in items]
+        return [item.decode('utf8', 'replace') for item in items]
 
     def run(self):
         """Run the command with output going to the console (stdout)."""
@@ -333,20 +721,28 @@ class Command(object):
 
     def pipe_in(self, input_obj):
         """
-        Set up an input stream pipe from a string, stream, or Command object.
+        Set up an input stream pipe from a string, iterable, stream, or Command object.
+
+        Note that list, tuple and other iterable items represent lines, and
+        line separators are added automatically.
 
-        Note that a string list represents multiple lines, and line separators
-        are added automatically.
+        Strings, lists and tuples are spooled through a temporary file. Other
+        iterables, e.g. generators, are fed to the child process on a writer
+        thread as it reads them, so that producing and consuming overlap.
+        Feeding blocks while the pipe is full. Output should be read before
+        the end of the "with" block, which happens by default.
 
         Arguments:
-            input_obj  string, string list, stream, or Command pipe input
+            input_obj  string, iterable, stream, or Command pipe input
         """
         if isinstance(input_obj, Command):
             input_source = self._input_source_from_command(input_obj)
         elif utility.is_string(input_obj):
             input_source = self._input_source_from_strings(False, input_obj)
-        elif utility.is_iterable(input_obj):
+        elif isinstance(input_obj, (list, tuple)):
             input_source = self._input_source_from_strings(True, *input_obj)
+        elif utility.is_iterable(input_obj) and not hasattr(input_obj, 'fileno'):
+            input_source = _InputFeeder(input_obj, True)
         else:
             # Assume everything else is a proper file stream.
             input_source = input_obj
@@ -356,16 +752,21 @@ class Command(object):
         """
         Create a Command object to use in a "with" block with piped input.
 
-        The stdout of self is attached to the stdin of the new Command.
+        The stdout of self is attached to the stdin of the new Command. Cached
+        output is fed from the cache.
 
         Arguments:
             args  variable length command argument list
         """
-        return Command(*args).pipe_in(self.process.stdout)
+        return Command(*args).pipe_in(self)
 
     @classmethod
     def _input_source_from_command(cls, command_obj):
         command_obj._check_in_with_block()  #pylint: disable=protected-access
+        cached = command_obj._cached        #pylint: disable=protected-access
+        if cached is not None:
+            command_obj._handler.set_options(capture_on_exit=False)  #pylint: disable=protected-access
+            return cls._input_source_from_strings(True, *cached.output_lines)
         return command_obj.process.stdout
 
     @classmethod
@@ -383,6 +784,293 @@ class Command(object):
         return input_source
 
 
+class _InputFeeder(object):
+    """
+    Feed strings or bytes from an iterable to a child process on a writer thread.
+
+    Writes block when the pipe is full, so a slow consumer throttles the
+    producer, and nothing is materialized in memory or on disk first.
+    """
+
+    def __init__(self, items, add_line_separators):
+        """Construct with an iterable and whether or not to append line separators."""
+        self.items = items
+        self.add_line_separators = add_line_separators
+        self.exception = None
+        self._thread = None
+
+    def start(self, stream):
+        """Start writing to an output stream, which is closed when done."""
+        self._thread = threading.Thread(target=self._feed, args=(stream,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        """Wait for the writer thread to finish."""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _feed(self, stream):
+        line_separator = str.encode(os.linesep)
+        try:
+            for item in self.items:
+                stream.write(item if isinstance(item, bytes) else str.encode(item))
+                if self.add_line_separators:
+                    stream.write(line_separator)
+        except (IOError, OSError):
+            # The reader went away early, e.g. "head", which is not an error.
+            pass
+        except Exception as exc:    #pylint: disable=broad-except
+            self.exception = exc
+        finally:
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+
+
+class Pipeline(object):
+    """
+    Run a chain of commands connected directly by OS pipes.
+
+    Stages are argument sequences or (unstarted) Command objects. Like
+    Command, a Pipeline must be used in a "with" block, it supports iteration,
+    run() and read_lines(), and it captures remaining output on exit.
+
+    Only the final stage's stdout (merged with its stderr) is read by Python,
+    and only if no "output" option redirects it to a stream or file
+    descriptor. Intermediate stages' stderr goes to the console.
+
+    Input may be a string, an iterable of strings or bytes (e.g. a generator),
+    or a stream. Strings and iterables are fed to the first stage on a writer
+    thread.
+
+    After the "with" block each Stage in the "stages" member has its return
+    code and timing, and the pipeline return code is that of the rightmost
+    failed stage or zero, like "set -o pipefail".
+    """
+
+    #=== Pipeline nested classes.
+
+    class Stage(object):
+        """Pipeline stage process, return code and timing."""
+
+        def __init__(self, args):
+            """Construct with a command argument list."""
+            self.args = args
+            self.process = None
+            self.return_code = None
+            self.start_time = None
+            self.end_time = None
+
+        @property
+        def elapsed(self):
+            """Elapsed seconds or None if the stage has not finished."""
+            if self.start_time is None or self.end_time is None:
+                return None
+            return self.end_time - self.start_time
+
+        def wait(self, record=None):
+            """Wait for the process and record the return code and end time."""
+            self.return_code = instrument.wait_process(self.process, record)
+            self.end_time = time.time()
+
+    class _Handler(ExternalCommandHandler):
+
+        kind = 'pipeline'
+        # The Pipeline finishes the instrumentation record after the processes end.
+        asynchronous = True
+
+        def __init__(self, stages):
+            ExternalCommandHandler.__init__(
+                self,
+                bufsize=-1,
+                input_source=None,
+                output=None,
+                capture_on_exit=True,
+                dry_run=False,
+                verbose=False,
+                pause=False,
+            )
+            self.stages = stages
+            self.waiters = []
+            self.record = None
+
+        def on_invoke_command(self):        #pylint: disable=arguments-differ
+            """Start all the stage processes connected by pipes."""
+            self.record = self.current_record()
+            input_source = self.get_option('input_source')
+            output = self.get_option('output')
+            stdin = subprocess.PIPE if isinstance(input_source, _InputFeeder) else input_source
+            try:
+                for stage_index, stage in enumerate(self.stages):
+                    is_last = stage_index == len(self.stages) - 1
+                    if not is_last:
+                        stdout, stderr = subprocess.PIPE, None
+                    elif output is None:
+                        stdout, stderr = subprocess.PIPE, subprocess.STDOUT
+                    else:
+                        stdout, stderr = output, None
+                    stage.start_time = time.time()
+                    stage.process = self.popen(
+                        stage.args,
+                        bufsize=self.get_option('bufsize'),
+                        stdin=stdin,
+                        stdout=stdout,
+                        stderr=stderr,
+                    )
+                    if stage_index == 0:
+                        if isinstance(input_source, _InputFeeder):
+                            input_source.start(stage.process.stdin)
+                        elif input_source and hasattr(input_source, 'fileno'):
+                            input_source.close()
+                    else:
+                        # Only the child may hold the read end so that SIGPIPE works.
+                        stdin.close()
+                    stdin = stage.process.stdout
+                    waiter = threading.Thread(target=stage.wait, args=(self.record,))
+                    waiter.daemon = True
+                    waiter.start()
+                    self.waiters.append(waiter)
+            except:
+                # __exit__() won't run, so don't orphan the stages that started.
+                self._stop_started_stages()
+                raise
+
+        def _stop_started_stages(self):
+            # Kill, reap and close the pipes of stages started before a launch failure.
+            for stage in self.stages:
+                if stage.process is not None:
+                    try:
+                        stage.process.kill()
+                    except OSError:
+                        pass
+                    # The input feeder closes stdin when writing fails.
+                    stdout = stage.process.stdout
+                    if stdout is not None and not stdout.closed:
+                        stdout.close()
+            for waiter in self.waiters:
+                waiter.join()
+            input_source = self.get_option('input_source')
+            if isinstance(input_source, _InputFeeder):
+                input_source.join()
+
+        def on_get_command_text(self):      #pylint: disable=arguments-differ
+            """Pipeline display text."""
+            return ' | '.join([shell.quote_arguments(*stage.args) for stage in self.stages])
+
+    #=== Pipeline methods.
+
+    def __init__(self, *stages):
+        """Construct with stage argument sequences or Command objects."""
+        if not stages:
+            raise ValueError('Pipeline requires at least one stage.')
+        self.stages = [
+            Pipeline.Stage(stage._handler.args if isinstance(stage, Command)  #pylint: disable=protected-access
+                           else list(stage))
+            for stage in stages]
+        self.done = False
+        self.output_lines = []
+        self.in_with_block = False
+        self.return_code = None
+        self._handler = Pipeline._Handler(self.stages)
+
+    def options(self, **kwargs):
+        """
+        Set options immediately after construction.
+
+        Returns self so that a chained call provides the "with" statement object.
+
+        bufsize          buffer size, see subprocess.Popen() for more information (default=-1)
+        input_source     string, iterable, or stream to pipe to standard input (default=None)
+        output           stream or file descriptor receiving final output (default=None)
+        dry_run          don't execute if True
+        verbose          display verbose messages if True
+        pause            pause before executing the command if True
+        capture_on_exit  captures remaining output to "output_lines" member if True (default=True)
+        """
+        if self.stages[0].process is not None:
+            raise Command.AlreadyRunning()
+        if 'input_source' in kwargs:
+            kwargs['input_source'] = self._prepare_input_source(kwargs['input_source'])
+        self._handler.set_options(**kwargs)
+        return self
+
+    def pipe_in(self, input_obj):
+        """
+        Set up input from a string, iterable (including generators), or stream.
+
+        Note that iterable items represent lines, and line separators are added
+        automatically.
+        """
+        return self.options(input_source=input_obj)
+
+    @property
+    def return_codes(self):
+        """Return code list for all stages."""
+        return [stage.return_code for stage in self.stages]
+
+    def __enter__(self):
+        """Start the stage processes at the start of a with block."""
+        self.in_with_block = True
+        self._handler.run_command()
+        return self
+
+    def __exit__(self, exit_type, exit_value, exit_traceback):
+        """Wait for all stages and capture results at the end of a with block."""
+        if self.stages[-1].process is None:
+            return
+        if self._handler.get_option('capture_on_exit'):
+            self.output_lines.extend([line for line in self.__iter__()])
+        elif self.stages[-1].process.stdout and not self.stages[-1].process.stdout.closed:
+            self.stages[-1].process.stdout.close()
+        for waiter in self._handler.waiters:
+            waiter.join()
+        self.return_code = 0
+        for stage in self.stages:
+            if stage.return_code != 0:
+                self.return_code = stage.return_code
+        instrument.RECORDER.finish(self._handler.record, return_code=self.return_code)
+        input_source = self._handler.get_option('input_source')
+        if isinstance(input_source, _InputFeeder):
+            input_source.join()
+            if input_source.exception is not None and exit_type is None:
+                raise input_source.exception
+
+    def __iter__(self):
+        """Iteration yields a final stage output line at a time."""
+        if not self._handler.get_option('dry_run'):
+            if not self.in_with_block:
+                raise Command.NotInWithBlock()
+            self._handler.set_options(capture_on_exit=False)
+            stdout = self.stages[-1].process.stdout
+            if stdout is not None and not stdout.closed:
+                with stdout:
+                    for line in iter(stdout.readline, b''):
+                        if self._handler.record is not None:
+                            self._handler.record.add_bytes_read(len(line))
+                        yield line.decode('utf8').rstrip()
+
+    def run(self):
+        """Run the pipeline with output going to the console (stdout)."""
+        for line in self.__iter__():
+            sys.stdout.write('%s' % line)
+            sys.stdout.write(os.linesep)
+
+    def read_lines(self):
+        """Run the pipeline and return a list of output lines."""
+        return [line for line in self.__iter__()]
+
+    @classmethod
+    def _prepare_input_source(cls, input_obj):
+        if utility.is_string(input_obj):
+            return _InputFeeder([input_obj], False)
+        if utility.is_iterable(input_obj) and not hasattr(input_obj, 'fileno'):
+            return _InputFeeder(input_obj, True)
+        return input_obj
+
+
 class CommandContext(utility.DictObject):
     """Local data with console methods enhanced with automatic formatting."""
 
@@ -448,37 +1136,183 @@ class Runner(object):
         #pylint: disable=unnecessary-pass
         pass
 
+    class MapResult(object):
+        """Result for one item of a map() or map_iter() call."""
+
+        def __init__(self,      #pylint: disable=too-many-arguments
+                     item,
+                     command,
+                     return_code,
+                     output_lines,
+                     elapsed,
+                     expired=None):
+            """Construct with item, command line, return code, output, elapsed seconds and expiration."""
+            self.item = item
+            self.command = command
+            self.return_code = return_code
+            self.output_lines = output_lines
+            self.elapsed = elapsed
+            self.expired = expired
+
+        @property
+        def failed(self):
+            """Return True if the command failed or expired."""
+            return self.return_code != 0 or self.expired is not None
+
+        def describe_failure(self):
+            """Return failure description text."""
+            if self.expired:
+                return '%s: %s' % (self.item, self.expired)
+            return '%s: return code %d' % (self.item, self.return_code)
+
+    class _MapCommandHandler(ExternalCommandHandler):
+
+        kind = 'map'
+
+        def __init__(self, runner, **options):
+            """Map command handler constructor."""
+            ExternalCommandHandler.__init__(self, **options)
+            self.runner = runner
+
+        def on_invoke_command(self, cmd_line, timeout=None):        #pylint: disable=arguments-differ
+            """Run a shell command with captured output."""
+            needs_watchdog = process.Watchdog.is_needed(timeout, self.runner.cancel)
+            child = self.popen(cmd_line,
+                               shell=True,
+                               stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               cwd=self.runner.cwd,
+                               env=self.runner.get_environment(),
+                               start_new_session=needs_watchdog)
+            watchdog = None
+            if needs_watchdog:
+                watchdog = process.Watchdog(child, timeout=timeout, cancel=self.runner.cancel)
+                watchdog.start()
+            record = self.current_record()
+            try:
+                with child.stdout:
+                    output = child.stdout.read()
+                return_code = instrument.wait_process(child, record)
+            finally:
+                if watchdog:
+                    watchdog.stop()
+            if record is not None:
+                record.add_bytes_read(len(output))
+                record.expired = watchdog.reason if watchdog else None
+            return (return_code,
+                    output.decode('utf8', 'replace').splitlines(),
+                    watchdog.reason if watchdog else None)
+
+        def on_get_command_text(self, cmd_line, timeout=None):      #pylint: disable=arguments-differ
+            """Map command display text."""
+            return cmd_line
+
+        def on_get_command_directory(self, *args):         #pylint: disable=unused-argument
+            """Runner working directory for dry-run plans."""
+            return self.runner.getcwd()
+
     class _ShellCommandHandler(ExternalCommandHandler):
 
-        def on_invoke_command(self, cmd_line):                      #pylint: disable=arguments-differ
+        kind = 'shell'
+
+        def __init__(self, runner, **options):
+            """Shell command handler constructor."""
+            ExternalCommandHandler.__init__(self, **options)
+            self.runner = runner
+            self.session = None
+
+        def on_invoke_command(self, cmd_line, timeout=None):        #pylint: disable=arguments-differ
             """Shell command invocation."""
-            ret_code = os.system(cmd_line)
+            if self.session:
+                if not self.session.is_running():
+                    # A new or replacement shell starts with the runner's current state.
+                    self.session.directory = self.runner.getcwd()
+                    self.session.env = self.runner.get_environment()
+                result = self.session.run(cmd_line,
+                                          output_handler=self._write_line,
+                                          timeout=timeout,
+                                          cancel=self.runner.cancel)
+                if result.expired:
+                    raise ExternalCommandError('Shell command %s' % result.expired)
+                ret_code = result.return_code
+                if self.current_record() is not None:
+                    self.current_record().return_code = ret_code
+            else:
+                try:
+                    ret_code = self.call(cmd_line,
+                                         shell=True,
+                                         cwd=self.runner.cwd,
+                                         env=self.runner.get_environment(),
+                                         timeout=timeout,
+                                         cancel=self.runner.cancel)
+                except process.Expired as exc:
+                    raise ExternalCommandError('Shell command %s' % exc.reason)
             if ret_code != 0:
                 raise ExternalCommandError('Shell command failed with return code %d' % ret_code)
             return ret_code
 
-        def on_get_command_text(self, cmd_line):                    #pylint: disable=arguments-differ
+        def on_get_command_text(self, cmd_line, timeout=None):      #pylint: disable=arguments-differ
             """Shell command display text."""
             return cmd_line
 
+        def on_get_command_directory(self, *args):         #pylint: disable=unused-argument
+            """Runner working directory for dry-run plans."""
+            return self.runner.getcwd()
+
+        @classmethod
+        def _write_line(cls, line):
+            sys.stdout.write(line)
+            sys.stdout.write(os.linesep)
+
     class _ChangeDirectoryCommandHandler(ExternalCommandHandler):
 
+        kind = None
+
+        def __init__(self, runner, **options):
+            """Change directory handler constructor."""
+            ExternalCommandHandler.__init__(self, **options)
+            self.runner = runner
+            self.session = None
+
         def on_invoke_command(self, directory):                     #pylint: disable=arguments-differ
             """Change directory invocation."""
-            try:
-                os.chdir(directory)
-            except (IOError, OSError) as exc:
-                raise ExternalCommandError('Directory change error "%s"' % str(exc))
+            if self.runner.cwd is None:
+                try:
+                    os.chdir(directory)
+                except (IOError, OSError) as exc:
+                    raise ExternalCommandError('Directory change error "%s"' % str(exc))
+            else:
+                # Isolated runners only change their own working directory.
+                directory = self.runner.resolve_path(directory)
+                if not os.path.isdir(directory):
+                    raise ExternalCommandError('Directory change error "%s" is not a directory'
+                                               % directory)
+                self.runner.cwd = directory
+            # Keep a persistent shell session in sync.
+            if self.session and self.session.is_running():
+                self.session.run('cd %s' % shell.quote_argument(self.runner.getcwd()))
 
         def on_get_command_text(self, directory):                   #pylint: disable=arguments-differ
             """Change directory display text."""
             return 'cd %s' % shell.quote_argument(directory)
 
+        def on_get_command_directory(self, *args):         #pylint: disable=unused-argument
+            """Runner working directory for dry-run plans."""
+            return self.runner.getcwd()
+
     class _CheckDirectoryCommandHandler(ExternalCommandHandler):
 
+        kind = None
+
+        def __init__(self, runner, **options):
+            """Check directory handler constructor."""
+            ExternalCommandHandler.__init__(self, **options)
+            self.runner = runner
+
         def on_invoke_command(self, path, exists):                  #pylint: disable=arguments-differ
             """Check directory invocation."""
-            actual_exists = os.path.exists(path)
+            actual_exists = os.path.exists(self.runner.resolve_path(path))
             if exists and not actual_exists:
                 return 'Directory "%s" does not exist' % path
             if not exists and actual_exists:
@@ -488,13 +1322,20 @@ class Runner(object):
             """Check directory display text."""
             return 'test -d %s %s exit 1' % (shell.quote_argument(path), '||' if exists else '&&')
 
+        def on_get_command_directory(self, *args):         #pylint: disable=unused-argument
+            """Runner working directory for dry-run plans."""
+            return self.runner.getcwd()
+
     #=== Runner methods.
 
     def __init__(self,      #pylint: disable=too-many-arguments
                  command_args,
                  program_name=None,
                  program_directory=None,
-                 var=None):
+                 var=None,
+                 cwd=None,
+                 env=None,
+                 cancel=None):
         """
         Construct runner.
 
@@ -505,8 +1346,23 @@ class Runner(object):
             program_name       program name override
             program_directory  program directory override
             var                symbol dictionary for string expansion
+            cwd                private working directory (see below)
+            env                environment variable overrides (see below)
+            cancel             process.CancellationToken shared with commands and clones
+
+        By default chdir() changes the process working directory. If cwd is
+        specified the runner is isolated, i.e. chdir() only changes the cwd
+        member, which is passed to child processes along with the environment
+        from get_environment(). Isolated runners never change global process
+        state, so they can run commands on separate threads. See clone().
+
+        Environment overrides in env (or added by setenv()) are applied on top
+        of os.environ for child processes. A None value removes a variable.
         """
         self.arg = command_args
+        self.cwd = os.path.abspath(cwd) if cwd is not None else None
+        self.env = dict(env) if env is not None else None
+        self.cancel = cancel
         # Default program name and directory are based on the command line arguments.
         if not program_name:
             program_name = os.path.basename(sys.argv[0])
@@ -526,20 +1382,25 @@ class Runner(object):
         )
         # Command handlers for various external actions.
         self._handlers = utility.DictObject(
-            shell_command=Runner._ShellCommandHandler(**self.options),
-            change_directory=Runner._ChangeDirectoryCommandHandler(**self.options),
-            check_directory=Runner._CheckDirectoryCommandHandler(**self.options),
+            shell_command=Runner._ShellCommandHandler(self, **self.options),
+            change_directory=Runner._ChangeDirectoryCommandHandler(self, **self.options),
+            check_directory=Runner._CheckDirectoryCommandHandler(self, **self.options),
         )
         # Stack of context data for message formatting, etc..
         self._context_stack = []
 
-    def shell(self, cmd_line, abort=True):
-        """Run a shell command from a single string or split arguments."""
+    def shell(self, cmd_line, abort=True, timeout=None):
+        """
+        Run a shell command from a single string or split arguments.
+
+        The command's process group is stopped after timeout seconds, if
+        specified, or if the runner's "cancel" token is cancelled.
+        """
         if utility.is_non_string_sequence(cmd_line):
             cmd_line_expanded = self.expand(shell.quote_arguments(*cmd_line))
         else:
             cmd_line_expanded = self.expand(cmd_line)
-        return self._handlers.shell_command.run_command(cmd_line_expanded, abort=abort)
+        return self._handlers.shell_command.run_command(cmd_line_expanded, timeout, abort=abort)
 
     def chdir(self, directory):
         """Change working directory with path expansion."""
@@ -549,11 +1410,86 @@ class Runner(object):
     @contextmanager
     def chdir_context(self, directory):
         """Change and restore working directory in a "with" block."""
-        save_directory = os.getcwd()
+        save_directory = self.getcwd()
         self.chdir(directory)
         yield
         self.chdir(save_directory)
 
+    def getcwd(self):
+        """Return the private working directory, if isolated, or the process one."""
+        return self.cwd if self.cwd is not None else os.getcwd()
+
+    def resolve_path(self, path):
+        """Return a path made absolute relative to the runner working directory."""
+        if self.cwd is None:
+            return path
+        return os.path.normpath(os.path.join(self.cwd, os.path.expanduser(path)))
+
+    def setenv(self, name, value):
+        """Set (or remove, if value is None) a child process environment variable."""
+        if self.env is None:
+            self.env = {}
+        self.env[name] = value
+
+    def get_environment(self):
+        """Return the complete child environment or None if there are no overrides."""
+        if self.env is None:
+            return None
+        environment = dict(os.environ)
+        for name, value in self.env.items():
+            if value is None:
+                environment.pop(name, None)
+            else:
+                environment[name] = str(value)
+        return environment
+
+    def clone(self, cwd=None, env=None):
+        """
+        Create an isolated copy of this runner, e.g. for use on another thread.
+
+        The copy starts in cwd, if specified, or the current working directory.
+        Environment overrides in env are added to a copy of the current ones.
+        Variables are copied, and other data is shared.
+        """
+        clone_env = dict(self.env) if self.env else {}
+        if env:
+            clone_env.update(env)
+        runner = self.__class__(self.arg,
+                                cwd=self.resolve_path(cwd) if cwd else self.getcwd(),
+                                env=clone_env,
+                                cancel=self.cancel)
+        runner.var = copy.copy(self.var)
+        for key, value in self.__dict__.items():
+            if key not in runner.__dict__:
+                setattr(runner, key, value)
+        return runner
+
+    @contextmanager
+    def shell_session(self, program='bash'):
+        """
+        Run shell() commands in one persistent shell process in a "with" block.
+
+        Avoids a fork and shell start-up per command. Working directory
+        changes and exported variables persist between commands. Commands get
+        /dev/null for stdin, so this is not suitable for interactive commands.
+
+        If the shell dies, the next shell() command starts a replacement in the
+        runner's current working directory and environment.
+
+        See shell.ShellSession for more information.
+        """
+        session = shell.ShellSession(program=program,
+                                     directory=self.getcwd(),
+                                     env=self.get_environment())
+        self._handlers.shell_command.session = session
+        self._handlers.change_directory.session = session
+        try:
+            yield session
+        finally:
+            self._handlers.shell_command.session = None
+            self._handlers.change_directory.session = None
+            session.stop()
+
     def check_directory(self, path, exists):
         """Validate a directory with path expansion."""
         return self._handlers.check_directory.run_command(self.expand(path), exists)
@@ -566,7 +1502,10 @@ class Runner(object):
 
         See the Command class for more information.
         """
-        return Command(*args).options(**self.options)
+        return Command(*args).options(cwd=self.cwd,
+                                      env=self.get_environment(),
+                                      cancel=self.cancel,
+                                      **self.options)
 
     def batch(self):
         """
@@ -576,9 +1515,87 @@ class Runner(object):
 
         See the Batch class for more information.
         """
-        return Batch(**self.options)
+        return Batch(cwd=self.cwd, env=self.get_environment(), cancel=self.cancel, **self.options)
 
-    def expand(self, str_in, expand_user=False, expand_env=False):
+    def map(self, template, items, jobs=None, abort=True, timeout=None):   #pylint: disable=redefined-builtin,too-many-arguments
+        """
+        Run a shell command template for each item with bounded parallelism.
+
+        See map_iter() for details. Waits for all commands to finish and
+        returns a MapResult list in input order. Failures are reported
+        together at the end, and abort the program if abort is True.
+        """
+        results = list(self.map_iter(template, items, jobs=jobs, timeout=timeout))
+        failures = [result for result in results if result.failed]
+        if failures:
+            error_function = console.abort if abort else console.error
+            error_function('%d of %d mapped %s failed.'
+                           % (len(failures), len(results),
+                              utility.pluralize('command', len(results))),
+                           [result.describe_failure() for result in failures])
+        return results
+
+    def map_iter(self, template, items, jobs=None, ordered=True, timeout=None):  #pylint: disable=too-many-arguments
+        """
+        Run a shell command template for each item, yielding MapResult objects.
+
+        The template is a string or argument sequence, as for shell(), and is
+        expanded with an "item" symbol added to "var". Dictionary items also
+        provide their keys as symbols.
+
+        Up to "jobs" commands (default=CPU count) run at once. Their output is
+        captured, not displayed. Results are yielded in input order if ordered
+        is True or as they complete if it is False.
+
+        Dry run and verbose options are obeyed. A pause option forces serial
+        execution.
+
+        Each command is stopped after timeout seconds, if specified. Commands
+        are stopped, and unstarted ones skipped, if the runner's "cancel"
+        token is cancelled. Unstarted commands are also skipped if the caller
+        stops iterating, e.g. at the first failure, once the generator is
+        closed.
+        """
+        if utility.is_non_string_sequence(template):
+            template = shell.quote_arguments(*template)
+        handler = Runner._MapCommandHandler(self, **self.options)
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if self.options.get('pause'):
+            jobs = 1
+        def _run(item, cmd_line):
+            if self.cancel is not None and self.cancel.is_cancelled():
+                return Runner.MapResult(item, cmd_line, None, [], 0.0, expired='cancelled')
+            start_time = time.time()
+            return_code, output_lines, expired = (handler.run_command(cmd_line, timeout)
+                                                  or (0, [], None))
+            return Runner.MapResult(item, cmd_line, return_code, output_lines,
+                                    time.time() - start_time, expired=expired)
+        # Expand everything up front, because expansion errors abort.
+        cmd_lines = [(item, self.expand(template, var=self._get_item_var(item)))
+                     for item in items]
+        # Dry runs display and plan commands in order.
+        workers = 1 if self.options.get('dry_run') else max(jobs, 1)
+        with plan.parallel(jobs):
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [executor.submit(_run, item, cmd_line) for item, cmd_line in cmd_lines]
+                if not ordered:
+                    futures = concurrent.futures.as_completed(futures)
+                for future in futures:
+                    yield future.result()
+            finally:
+                # Skip queued commands if the caller stops iterating early.
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def _get_item_var(self, item):
+        item_var = Runner.VarNamespace(self.var)
+        if isinstance(item, dict):
+            item_var.update(item)
+        item_var.item = item
+        return item_var
+
+    def expand(self, str_in, expand_user=False, expand_env=False, var=None):
         """
         Expand string or path using internal symbols.
 
@@ -586,22 +1603,32 @@ class Runner(object):
 
         if expand_env is True expand environment variables. (default=False)
 
+        If var is specified it replaces the "var" member symbols. (default=None)
+
+        Templates are compiled once and cached (see the template module).
+
         Return the expanded string.
         """
+        if var is None:
+            var = self.var
         str_out = str_in
         if str_out:
+            compiled_template = None
             try:
                 if expand_env:
                     str_out = os.path.expandvars(str_out)
                 if expand_user:
                     str_out = os.path.expanduser(str_out)
-                # Expand using both format() and '%' operator.
-                str_out = str_out.format(**self.var) % self.var
-            except (ValueError, KeyError) as exc:
-                console.abort('Runner.expand() error.', [
-                    '  input: %s' % str_in,
-                    'symbols: %s' % str(self.var),
-                    exc])
+                # Expand both format() fields and '%' directives.
+                compiled_template = template.compile_template(str_out)
+                str_out = compiled_template.render(var)
+            except (ValueError, KeyError, TypeError, AttributeError, IndexError) as exc:
+                messages = ['  input: %s' % str_in]
+                if compiled_template is not None and compiled_template.get_missing_symbols(var):
+                    messages.append('unknown: %s' % ' '.join(
+                        compiled_template.get_missing_symbols(var)))
+                messages.extend(['symbols: %s' % str(var), exc])
+                console.abort('Runner.expand() error.', messages)
         return str_out
 
     @contextmanager
@@ -630,28 +1657,44 @@ class Batch(object):
     class Failure(Exception):
         """Exception for batch errors during execution."""
 
-        def __init__(self, command, return_code):
-            """Constructor adds a hard-coded string and saves the command and return code."""
-            Exception.__init__(self, 'Command batch failed')
+        def __init__(self, command, return_code, reason=None):
+            """Constructor adds a hard-coded string and saves the command, return code and reason."""
+            Exception.__init__(self, 'Command batch %s' % (reason or 'failed'))
             self.command = command
             self.return_code = return_code
+            self.reason = reason
 
     class _CommandHandler(ExternalCommandHandler):
 
+        kind = 'batch'
+
         def __init__(self, **options):
             """Batch command handler constructor."""
+            options.setdefault('cwd', None)
+            options.setdefault('env', None)
+            options.setdefault('timeout', None)
+            options.setdefault('cancel', None)
             ExternalCommandHandler.__init__(self, **options)
             self.temporary_paths = []
 
-        def on_invoke_command(self, cmd_line):  # pylint: disable=arguments-differ
+        def on_invoke_command(self, cmd_line, timeout=None):  # pylint: disable=arguments-differ
             """Shell command invocation."""
-            ret_code = os.system(cmd_line)
+            try:
+                ret_code = self.call(cmd_line,
+                                     shell=True,
+                                     cwd=self.get_option('cwd'),
+                                     env=self.get_option('env'),
+                                     timeout=timeout,
+                                     cancel=self.get_option('cancel'))
+            except process.Expired as exc:
+                self.delete_temporary_files()
+                raise Batch.Failure(cmd_line, exc.return_code, reason=exc.reason)
             if ret_code != 0:
                 self.delete_temporary_files()
                 raise Batch.Failure(cmd_line, ret_code)
             return ret_code
 
-        def on_get_command_text(self, cmd_line):  # pylint: disable=arguments-differ
+        def on_get_command_text(self, cmd_line, timeout=None):  # pylint: disable=arguments-differ
             """Batch command display text."""
             return cmd_line
 
@@ -706,11 +1749,30 @@ class Batch(object):
         """Add a path to clean up when an error occurs."""
         self._handler.add_temporary_path(path)
 
-    def run(self):
-        """Run the batch."""
+    def run(self, timeout=None):
+        """
+        Run the batch.
+
+        The optional timeout limits the whole batch, in seconds, in addition
+        to any per-command "timeout" option.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
         for quoted_command_args in self.quoted_command_args_batch:
             command_string = ' '.join(quoted_command_args)
-            self._handler.run_command(command_string)
+            command_timeout = self._handler.get_option('timeout')
+            batch_limited = False
+            if deadline is not None:
+                remaining = max(deadline - time.time(), 0.0)
+                if command_timeout is None or remaining < command_timeout:
+                    command_timeout = remaining
+                    batch_limited = True
+            try:
+                self._handler.run_command(command_string, command_timeout)
+            except Batch.Failure as exc:
+                if batch_limited and exc.reason and exc.reason.startswith('timed out'):
+                    raise Batch.Failure(exc.command, exc.return_code,
+                                        reason='timed out after %g seconds' % timeout)
+                raise
 
     def handle_failure_cleanup(self):
         """
@@ -19,6 +19,7 @@ import shutil
 import copy
 from . import console
 from . import flatten
+from . import trace
 from . import utility
 
 
@@ -288,8 +289,9 @@ class Config(object):
     def load(self):
         """Load a configuration file."""
         loaded = False
-        for location in self.locations:
-            loaded = loaded or self._load_directory_config(location)
+        with trace.span('Config.load', category='config'):
+            for location in self.locations:
+                loaded = loaded or self._load_directory_config(location)
         if console.is_verbose():
             self.dump()
         return loaded
@@ -307,8 +309,9 @@ class Config(object):
                     path if os.path.isdir(path) else os.path.dirname(path))
                 if config_dir not in config_dirs:
                     config_dirs.append(config_dir)
-        for config_dir in config_dirs:
-            self._load_directory_config(config_dir)
+        with trace.span('Config.load', category='config'):
+            for config_dir in config_dirs:
+                self._load_directory_config(config_dir)
         if console.is_verbose():
             self.dump()
 
@@ -327,6 +330,10 @@ class Config(object):
         path = os.path.expanduser(os.path.expandvars(os.path.join(directory, self.file_name)))
         if not os.path.isfile(path):
             return False
+        with trace.span('load %s' % path, category='config'):
+            return self._load_file(path)
+
+    def _load_file(self, path):
         try:
             console.verbose_info('Reading configuration file: %s' % path)
             with open(path) as file_handle:
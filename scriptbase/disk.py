@@ -23,9 +23,21 @@ Some are only implemented for MacOS for now.
 import sys
 import os
 import re
+import bz2
+import gzip
+import lzma
+import mmap
+import stat
+import time
+import zlib
+import errno
+import struct
 import subprocess
+import collections
 from glob import glob
 from decimal import Decimal
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from . import command
 from . import console
@@ -34,15 +46,15 @@ from . import utility
 
 
 RE_MOUNT = re.compile('^(/[a-z0-9_/]+) on (/[a-z0-9_/ ]+)( [(][^)]*[)])?', re.IGNORECASE)
+MOUNT_SPEC = command.RecordSpec(['device', 'mountpoint', 'options'],
+                                pattern=RE_MOUNT, name='Mount')
 
 
 def iter_mounted_volumes():
     """Iterate mounted volume paths."""
     with command.Command('mount') as cmd:
-        for line in cmd:
-            matched = RE_MOUNT.match(line)
-            if matched:
-                yield matched.group(2), matched.group(1)
+        for mount in cmd.records(MOUNT_SPEC):
+            yield mount.mountpoint, mount.device
 
 
 def mounts_check(*mountpoints):
@@ -143,7 +155,7 @@ class DiskVolume(utility.DumpableObject):
                     return '{}{} {}'.format(value_str, zeros, cls.unit_labels[i])
                 if value_places > places:
                     return '{} {}'.format(value_str[:(places - value_places)], cls.unit_labels[i])
-                return (value_str, cls.unit_labels[i])
+                return '{} {}'.format(value_str, cls.unit_labels[i])
             threshold //= 1000
         return '{} {}'.format(size, cls.unit_labels[0])
 
@@ -237,8 +249,42 @@ def volume_for_identifier(identifier):
     return volumes[0]
 
 
+# Uncompressed bytes per independently-compressed block.
+COMPRESS_BLOCK_SIZE = 8 * 1024 * 1024
+
+# Largest member expanded in memory. Images with larger members, e.g. one
+# stream written by another tool, are expanded sequentially.
+MAX_PARALLEL_MEMBER_SIZE = 2 * COMPRESS_BLOCK_SIZE
+
+# Gzip member header with an "SB" extra subfield holding the member size.
+_GZIP_HEADER = struct.Struct('<BBBBIBBH2sHI')
+_GZIP_TRAILER = struct.Struct('<II')
+_GZIP_SUBFIELD = b'SB'
+
+_XZ_HEADER_MAGIC = b'\xfd7zXZ\x00'
+_XZ_FOOTER_MAGIC = b'YZ'
+
+
+def _read_varint(view, position):
+    # Read an xz multibyte integer and return it with the next position.
+    value = 0
+    for shift in range(0, 63, 7):
+        byte = view[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+    raise ValueError('Bad xz integer.')
+
+
 class Compressor:
-    """Compressor data."""
+    """
+    Compressor data.
+
+    Subclasses compress in-process with a thread pool. Input is split into
+    fixed-size blocks that become independent members of a standard
+    compressed file, so that any decompressor can read the result.
+    """
 
     def __init__(self, name, uncompress_cmd, *compress_cmds):
         self.name = name
@@ -267,13 +313,190 @@ class Compressor:
             console.abort('Unable to find {} expansion program: {}'.format(self.name, prog))
         return self.uncompress_cmd
 
+    def get_writer(self, target, jobs=None, block_size=COMPRESS_BLOCK_SIZE, level=None):
+        """Return a ParallelCompressor writing to a file descriptor or object."""
+        return ParallelCompressor(target, self, jobs=jobs, block_size=block_size, level=level)
+
+    def get_reader(self, source, jobs=None):
+        """Return a ParallelExpander reading from a file descriptor."""
+        return ParallelExpander(source, self, jobs=jobs)
+
+    def compress_block(self, data, level=None):
+        """Return data compressed as one complete member."""
+        raise NotImplementedError
+
+    def split_members(self, view):   #pylint: disable=unused-argument,no-self-use
+        """
+        Split compressed data into members that can be expanded independently.
+
+        Return (member view, uncompressed size) pairs, or None if the data
+        has to be expanded sequentially.
+        """
+        return None
+
+    def expand_block(self, member):
+        """Return the uncompressed data for one member from split_members()."""
+        raise NotImplementedError
+
+    def open_stream(self, file_object):
+        """Return a sequential file object that expands any number of members."""
+        raise NotImplementedError
+
+
+class GzipCompressor(Compressor):
+    """
+    Gzip compressor.
+
+    Each member records its own size in a gzip header extra subfield, which
+    other gzip readers ignore, so that members can be expanded in parallel.
+    """
+
+    def __init__(self):
+        Compressor.__init__(self, 'gzip', 'gzcat', 'pigz -c -f -', 'gzip -c -f -')
+
+    def compress_block(self, data, level=None):
+        """Return data compressed as one gzip member."""
+        compressor = zlib.compressobj(6 if level is None else level,
+                                      zlib.DEFLATED, -zlib.MAX_WBITS)
+        body = compressor.compress(data) + compressor.flush()
+        size = _GZIP_HEADER.size + len(body) + _GZIP_TRAILER.size
+        # Flags: FEXTRA. Extra: 8 bytes holding one 4 byte subfield. OS: unknown.
+        header = _GZIP_HEADER.pack(0x1f, 0x8b, 8, 4, 0, 0, 255, 8, _GZIP_SUBFIELD, 4, size)
+        trailer = _GZIP_TRAILER.pack(zlib.crc32(data), len(data) & 0xffffffff)
+        return b''.join([header, body, trailer])
+
+    def split_members(self, view):
+        """Split members that have size subfields, or return None."""
+        members = []
+        offset = 0
+        while offset < len(view):
+            size = self._get_member_size(view, offset)
+            if size is None:
+                return None
+            member = view[offset:offset + size]
+            members.append((member, _GZIP_TRAILER.unpack_from(member, size - 8)[1]))
+            offset += size
+        return members
+
+    @classmethod
+    def _get_member_size(cls, view, offset):
+        if len(view) - offset < _GZIP_HEADER.size + _GZIP_TRAILER.size:
+            return None
+        if bytes(view[offset:offset + 3]) != b'\x1f\x8b\x08' or not view[offset + 3] & 4:
+            return None
+        position = offset + 12
+        extra_end = position + struct.unpack_from('<H', view, offset + 10)[0]
+        while position + 4 <= extra_end:
+            subfield_id = bytes(view[position:position + 2])
+            length = struct.unpack_from('<H', view, position + 2)[0]
+            if subfield_id == _GZIP_SUBFIELD and length == 4:
+                size = struct.unpack_from('<I', view, position + 4)[0]
+                if size < _GZIP_HEADER.size or offset + size > len(view):
+                    return None
+                return size
+            position += 4 + length
+        return None
+
+    def expand_block(self, member):
+        """Return the uncompressed data for one gzip member."""
+        return zlib.decompress(member, zlib.MAX_WBITS | 16)
+
+    def open_stream(self, file_object):
+        """Return a sequential reader for any gzip file."""
+        return gzip.GzipFile(fileobj=file_object, mode='rb')
+
+
+class XzCompressor(Compressor):
+    """
+    Xz compressor.
+
+    Each block is a complete xz stream. Concatenated streams are standard
+    and are found by walking the stream footers and indexes from the end.
+    """
+
+    def __init__(self):
+        Compressor.__init__(self, 'xz', 'xzcat', 'xz -c -T0 -f -')
+
+    def compress_block(self, data, level=None):
+        """Return data compressed as one xz stream."""
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+    def split_members(self, view):
+        """Split into streams using their indexes, or return None."""
+        try:
+            return self._split_streams(view)
+        except (IndexError, ValueError, struct.error):
+            return None
+
+    @classmethod
+    def _split_streams(cls, view):
+        members = []
+        end = len(view)
+        while end > 0:
+            # Skip stream padding.
+            while end >= 4 and bytes(view[end - 4:end]) == b'\0\0\0\0':
+                end -= 4
+            if end == 0:
+                break
+            if end < 32 or bytes(view[end - 2:end]) != _XZ_FOOTER_MAGIC:
+                return None
+            index_size = (struct.unpack_from('<I', view, end - 8)[0] + 1) * 4
+            index_start = end - 12 - index_size
+            if index_start < 12 or view[index_start] != 0:
+                return None
+            record_count, position = _read_varint(view, index_start + 1)
+            blocks_size = 0
+            uncompressed_size = 0
+            for _record_idx in range(record_count):
+                unpadded_size, position = _read_varint(view, position)
+                record_size, position = _read_varint(view, position)
+                if position > end:
+                    return None
+                blocks_size += (unpadded_size + 3) & ~3
+                uncompressed_size += record_size
+            start = index_start - blocks_size - 12
+            if start < 0 or bytes(view[start:start + 6]) != _XZ_HEADER_MAGIC:
+                return None
+            members.append((view[start:end], uncompressed_size))
+            end = start
+        members.reverse()
+        return members
+
+    def expand_block(self, member):
+        """Return the uncompressed data for one xz stream."""
+        return lzma.decompress(member, format=lzma.FORMAT_XZ)
+
+    def open_stream(self, file_object):
+        """Return a sequential reader for any xz file."""
+        return lzma.LZMAFile(file_object, mode='rb')
+
+
+class Bzip2Compressor(Compressor):
+    """
+    Bzip2 compressor.
+
+    Bzip2 streams don't record their size, so expansion is sequential.
+    """
+
+    def __init__(self):
+        Compressor.__init__(self, 'bzip2', 'bzcat', 'pbzip2 -c -f -', 'bzip2 -c -f -')
+
+    def compress_block(self, data, level=None):
+        """Return data compressed as one bzip2 stream."""
+        return bz2.compress(data, 9 if level is None else level)
+
+    def open_stream(self, file_object):
+        """Return a sequential reader for any bzip2 file."""
+        return bz2.BZ2File(file_object, mode='rb')
+
 
 class Compressors:
-    """Access compression/expansion commands."""
+    """Access compressors and their compression/expansion commands."""
 
     compressors = [
-        Compressor('gzip', 'gzcat', 'pigz -c -f -', 'gzip -c -f -'),
-        Compressor('xz', 'xzcat', 'xz -c -T0 -f -'),
+        GzipCompressor(),
+        XzCompressor(),
+        Bzip2Compressor(),
     ]
 
     @classmethod
@@ -301,38 +524,493 @@ class Compressors:
         return compressor.get_expand_command()
 
 
-def backup_device(device_path, output_path, compression=None):  #pylint: disable=unused-argument
-    """Copy input device to gzip-compressed output file."""
-    ctx = utility.DictObject(**locals())
-    if compression:
-        ctx.compress_cmd = Compressors.get_compress_command(compression)
-        ctx.compress_prog = ctx.compress_cmd.split()[0]
-        cmd = 'sudo dd if={device_path} bs=1M | {compress_cmd} > "{output_path}"'
-        msg = 'Reading device with dd and writing image with {compress_prog}.'
+def _write_all(target, data):
+    if isinstance(target, int):
+        with memoryview(data) as view:
+            position = 0
+            while position < len(view):
+                position += os.write(target, view[position:])
     else:
-        cmd = 'sudo dd if={device_path} of="{output_path}" bs=1M'
-        msg = 'Reading device and writing image with dd.'
-    console.info([ctx.format(msg), 'Press CTRL-T for status.'])
-    cmd = ctx.format(cmd)
-    console.info(cmd)
-    ctx.retcode = os.system(cmd)
-    if ctx.retcode != 0:
-        console.abort(ctx.format('Image restore command failed with return code {retcode}.'))
-
-
-def restore_device(device_path, input_path, compression=None):  #pylint: disable=unused-argument
-    """Uncompress input file and copy to output device."""
-    ctx = utility.DictObject(**locals())
-    if compression:
-        ctx.expand_cmd = Compressors.get_expand_command(compression)
-        msg = ('Uncompressing image file with {} and writing to device with dd.'
-               .format(ctx.expand_cmd))
-        cmd = ctx.format('{expand_cmd} "{input_path}" | sudo dd of={device_path} bs=64K')
+        target.write(data)
+
+
+class ParallelCompressor(object):
+    """
+    File-like writer that compresses fixed-size blocks on a thread pool.
+
+    Compressed blocks are written in order. The number of blocks in flight
+    is limited to bound memory use. Closing writes the last partial block.
+    """
+
+    def __init__(self, target, compressor, jobs=None, block_size=COMPRESS_BLOCK_SIZE,
+                 level=None):
+        """
+        Start the thread pool.
+
+        Keyword arguments:
+          target      file descriptor or object with write()
+          compressor  Compressor providing compress_block()
+          jobs        thread count (default: CPU count)
+          block_size  uncompressed bytes per block
+          level       compression level (default: compressor default)
+        """
+        self.target = target
+        self.compressor = compressor
+        self.jobs = jobs or os.cpu_count() or 1
+        self.block_size = block_size
+        self.level = level
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._shutdown()
+
+    #=== ParallelCompressor methods.
+
+    def write(self, data):
+        """Buffer data and submit full blocks for compression."""
+        self._buffer += data
+        self.bytes_in += len(data)
+        while len(self._buffer) >= self.block_size:
+            with memoryview(self._buffer) as view:
+                block = bytes(view[:self.block_size])
+            del self._buffer[:self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        """Compress the remaining data and write everything still pending."""
+        if self._executor is None:
+            return
+        try:
+            # Empty input still produces a valid compressed file.
+            if self._buffer or self.bytes_in == 0:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._shutdown()
+
+    def _submit(self, block):
+        self._pending.append(
+            self._executor.submit(self.compressor.compress_block, block, self.level))
+        while len(self._pending) > self.jobs * 2:
+            self._write_next()
+
+    def _write_next(self):
+        data = self._pending.popleft().result()
+        _write_all(self.target, data)
+        self.bytes_out += len(data)
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._pending.clear()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
+class ParallelExpander(object):
+    """
+    File-like reader that expands compressed data, in parallel when possible.
+
+    Regular files are memory-mapped and split into independent members that
+    are expanded on a thread pool. Pipes, files without member sizes and
+    files with members larger than MAX_PARALLEL_MEMBER_SIZE are expanded
+    sequentially. The size attribute is the total uncompressed size,
+    if known.
+    """
+
+    def __init__(self, source, compressor, jobs=None):
+        """
+        Inspect the input.
+
+        Keyword arguments:
+          source      file descriptor positioned at the start of the data
+          compressor  Compressor providing split_members() and expand_block()
+          jobs        thread count (default: CPU count)
+        """
+        self.source = source
+        self.compressor = compressor
+        self.jobs = jobs or os.cpu_count() or 1
+        self.size = None
+        self._map = None
+        self._data = memoryview(b'')
+        members = None
+        try:
+            self._map = mmap.mmap(source, 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Not mappable, e.g. a pipe or an empty file.
+            pass
+        if self._map is not None:
+            members = compressor.split_members(memoryview(self._map))
+        if members and not [member for member, size in members
+                            if size > MAX_PARALLEL_MEMBER_SIZE
+                            or len(member) > MAX_PARALLEL_MEMBER_SIZE]:
+            self.size = sum(member[1] for member in members)
+            self._blocks = self._iter_parallel(members)
+        else:
+            # Release the member views so that the unused map can close.
+            members = None
+            self._close_map()
+            self._blocks = self._iter_sequential()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #=== ParallelExpander methods.
+
+    def readinto(self, buffer):
+        """Fill buffer with uncompressed data and return the byte count."""
+        while not self._data:
+            block = next(self._blocks, None)
+            if block is None:
+                return 0
+            self._data = memoryview(block)
+        count = min(len(buffer), len(self._data))
+        buffer[:count] = self._data[:count]
+        self._data = self._data[count:]
+        return count
+
+    def close(self):
+        """Stop expanding and release the input mapping."""
+        self._blocks.close()
+        self._data = memoryview(b'')
+        self._close_map()
+
+    def _close_map(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Member views are still referenced somewhere. Let GC unmap.
+                pass
+            self._map = None
+
+    def _iter_parallel(self, members):
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            try:
+                # Drop member views as they are submitted so the map can close.
+                members = collections.deque(members)
+                while members:
+                    member = members.popleft()[0]
+                    pending.append(executor.submit(self.compressor.expand_block, member))
+                    del member
+                    if len(pending) > self.jobs * 2:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _iter_sequential(self):
+        with os.fdopen(self.source, 'rb', closefd=False) as file_object:
+            with self.compressor.open_stream(file_object) as stream:
+                while True:
+                    block = stream.read(COMPRESS_BLOCK_SIZE)
+                    if not block:
+                        break
+                    yield block
+
+
+# Bytes moved per read/write or kernel copy call.
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 5.0
+
+# Kernel copy errors meaning "not supported for these descriptors".
+_FAST_COPY_ERRORS = frozenset([errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+                               errno.EOPNOTSUPP, errno.ENOTSUP, errno.ESPIPE])
+
+
+def get_stream_size(fd):
+    """Return the size of a regular file or block device, or None for other streams."""
+    stat_result = os.fstat(fd)
+    if stat.S_ISREG(stat_result.st_mode):
+        return stat_result.st_size
+    if stat.S_ISBLK(stat_result.st_mode):
+        position = os.lseek(fd, 0, os.SEEK_CUR)
+        try:
+            return os.lseek(fd, 0, os.SEEK_END)
+        finally:
+            os.lseek(fd, position, os.SEEK_SET)
+    return None
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+class CopyProgress(object):
+    """Byte count, throughput and ETA for a running stream copy."""
+
+    def __init__(self, total=None):
+        """
+        Start timing a copy.
+
+        Keyword arguments:
+          total    expected byte count, if known, for percentage and ETA
+        """
+        self.total = total
+        self.done = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def update(self, count):
+        """Add bytes copied."""
+        self.done += count
+
+    def finish(self):
+        """Stop the clock."""
+        self.finished = time.monotonic()
+
+    @property
+    def elapsed(self):
+        """Seconds spent so far."""
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self):
+        """Bytes per second so far."""
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Estimated seconds remaining, or None if unknown."""
+        if self.finished is not None:
+            return 0.0
+        rate = self.rate
+        if not self.total or not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def __str__(self):
+        parts = [DiskVolume.format_disk_size(self.done)]
+        if self.total:
+            parts[0] += ' of %s (%d%%)' % (DiskVolume.format_disk_size(self.total),
+                                           self.done * 100 // self.total)
+        parts.append('%s/s' % DiskVolume.format_disk_size(int(self.rate)))
+        if self.finished is not None:
+            parts.append('elapsed %s' % _format_duration(self.elapsed))
+        elif self.eta is not None:
+            parts.append('ETA %s' % _format_duration(self.eta))
+        return ', '.join(parts)
+
+
+def report_progress(status):
+    """Default progress callback that displays a CopyProgress status line."""
+    console.info(str(status))
+
+
+class StreamCopier(object):
+    """
+    Copy bytes between files, block devices, pipes and file-like objects.
+
+    When both ends are file descriptors the kernel does the copying with
+    copy_file_range() or sendfile(), if supported for that pair. Otherwise the
+    data passes through one reusable page-aligned buffer.
+    """
+
+    def __init__(self, buffer_size=COPY_BUFFER_SIZE, progress=report_progress,
+                 interval=PROGRESS_INTERVAL):
+        """
+        Configure the copier.
+
+        Keyword arguments:
+          buffer_size  bytes per read/write or kernel copy call
+          progress     callable receiving a CopyProgress every interval, or None
+          interval     seconds between progress calls
+        """
+        self.buffer_size = buffer_size
+        self.progress = progress
+        self.interval = interval
+        self._buffer = None
+        self._next_report = 0.0
+
+    #=== StreamCopier methods.
+
+    def copy(self, source, target, total=None):
+        """
+        Copy from source to target until end of input and return the byte count.
+
+        Objects need readinto() (source) or write() (target). write() must
+        consume the data before returning, because the buffer is reused.
+
+        Keyword arguments:
+          source   file descriptor or readable object
+          target   file descriptor or writable object
+          total    expected byte count (default: source file or device size)
+        """
+        if total is None and isinstance(source, int):
+            total = get_stream_size(source)
+        status = CopyProgress(total)
+        self._next_report = status.started + self.interval
+        if isinstance(source, int) and isinstance(target, int):
+            if not (self._copy_file_range(source, target, status)
+                    or self._sendfile(source, target, status)):
+                self._copy_buffered(source, target, status)
+        else:
+            self._copy_buffered(source, target, status)
+        status.finish()
+        if self.progress:
+            self.progress(status)
+        return status.done
+
+    def _get_buffer(self):
+        # Anonymous mmap memory is page-aligned, which suits O_DIRECT and devices.
+        if self._buffer is None:
+            self._buffer = memoryview(mmap.mmap(-1, self.buffer_size))
+        return self._buffer
+
+    def _update(self, status, count):
+        status.update(count)
+        if self.progress and time.monotonic() >= self._next_report:
+            self.progress(status)
+            self._next_report = time.monotonic() + self.interval
+
+    def _copy_kernel(self, copy_function, status):
+        # Return False if the very first call shows the method doesn't apply.
+        while True:
+            try:
+                count = copy_function()
+            except OSError as exc:
+                if exc.errno in _FAST_COPY_ERRORS and status.done == 0:
+                    return False
+                raise
+            if not count:
+                # Some pseudo-files claim a size but report EOF to kernel copies.
+                return status.done > 0 or status.total is None or status.total == 0
+            self._update(status, count)
+
+    def _copy_file_range(self, source, target, status):
+        if not hasattr(os, 'copy_file_range'):
+            return False
+        return self._copy_kernel(
+            lambda: os.copy_file_range(source, target, self.buffer_size), status)
+
+    def _sendfile(self, source, target, status):
+        if not hasattr(os, 'sendfile') or not sys.platform.startswith('linux'):
+            return False
+        return self._copy_kernel(
+            lambda: os.sendfile(target, source, None, self.buffer_size), status)
+
+    def _copy_buffered(self, source, target, status):
+        buffer = self._get_buffer()
+        while True:
+            if isinstance(source, int):
+                count = os.readv(source, [buffer])
+            else:
+                count = source.readinto(buffer)
+            if not count:
+                break
+            if isinstance(target, int):
+                position = 0
+                while position < count:
+                    position += os.write(target, buffer[position:count])
+            else:
+                target.write(buffer[:count])
+            self._update(status, count)
+
+
+def _is_block_device(path):
+    try:
+        return stat.S_ISBLK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+
+@contextmanager
+def _open_stream(path, writing=False):
+    # Yield a raw file descriptor. Devices are written in place, not truncated.
+    if not writing:
+        flags = os.O_RDONLY
+    elif _is_block_device(path):
+        flags = os.O_WRONLY
     else:
-        msg = 'Reading from image file and writing to device with dd.'
-        cmd = ctx.format('sudo dd if="{input_path}" of={device_path} bs=1M')
-    console.info([msg, 'Press CTRL-T for status.'])
-    console.info(cmd)
-    ctx.retcode = os.system(cmd)
-    if ctx.retcode != 0:
-        console.abort(ctx.format('Image restore command failed with return code {retcode}.'))
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+    try:
+        fd = os.open(path, flags, 0o644)
+    except OSError as exc:
+        hint = ' (root access may be required)' if exc.errno == errno.EACCES else ''
+        console.abort('Unable to open "{path}": {error}{hint}',
+                      path=path, error=exc.strerror, hint=hint)
+    try:
+        yield fd
+        if writing:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def backup_device(device_path, output_path, compression=None, progress=report_progress,
+                  jobs=None):
+    """
+    Copy a device or image file to an optionally-compressed image file.
+
+    Compression runs in-process on a thread pool.
+    Return the number of bytes read from the device.
+
+    Keyword arguments:
+      compression  compressor name, e.g. "gzip" or "xz" (default: no compression)
+      progress     CopyProgress callback (default: periodic console status)
+      jobs         compression thread count (default: CPU count)
+    """
+    copier = StreamCopier(progress=progress)
+    with _open_stream(device_path) as source:
+        with _open_stream(output_path, writing=True) as target:
+            if compression:
+                compressor = Compressors.get_compressor(compression)
+                with compressor.get_writer(target, jobs=jobs) as writer:
+                    console.info('Reading "{device_path}" and writing {name} image'
+                                 ' with {jobs} threads.',
+                                 device_path=device_path, name=compressor.name,
+                                 jobs=writer.jobs)
+                    return copier.copy(source, writer)
+            console.info('Reading "{device_path}" and writing image "{output_path}".',
+                         device_path=device_path, output_path=output_path)
+            return copier.copy(source, target)
+
+
+def restore_device(device_path, input_path, compression=None, progress=report_progress,
+                   jobs=None):
+    """
+    Copy an optionally-compressed image file to a device or image file.
+
+    Expansion runs in-process, on a thread pool if the image allows it.
+    Return the number of bytes written to the device.
+
+    Keyword arguments:
+      compression  compressor name, e.g. "gzip" or "xz" (default: no compression)
+      progress     CopyProgress callback (default: periodic console status)
+      jobs         expansion thread count (default: CPU count)
+    """
+    copier = StreamCopier(progress=progress)
+    with _open_stream(input_path) as source:
+        with _open_stream(device_path, writing=True) as target:
+            if compression:
+                compressor = Compressors.get_compressor(compression)
+                with compressor.get_reader(source, jobs=jobs) as reader:
+                    console.info('Expanding {name} image and writing "{device_path}".',
+                                 name=compressor.name, device_path=device_path)
+                    return copier.copy(reader, target, total=reader.size)
+            console.info('Reading image "{input_path}" and writing "{device_path}".',
+                         input_path=input_path, device_path=device_path)
+            return copier.copy(source, target)
@@ -16,16 +16,56 @@
 
 import os
 import re
+import time
+import threading
+import functools
+import subprocess
+import concurrent.futures
+from collections import OrderedDict
 
 from . import console
 from . import utility
-from .command import Command, Runner, Batch
+from . import gitindex
+from . import gitconfig
+from . import process
+from .cache import file_stamp, ResultCache
+from .gitconfig import parse_config
+from .command import Command, Pipeline, Runner, Batch, RecordSpec
 
 
 GITHUB_ROOT_CONFIG = os.path.expanduser('~/.github_root')
-RE_SECTION = re.compile(r'^\s*\[([^\]]+)\]\s*$')
 RE_VERSION = re.compile(r'.* version ([^\s]+)', re.IGNORECASE)
-RE_SUBMODULE = re.compile(r'^(.)([0-9a-f]+)\s+(.+) \((.+)\)\s*$')
+# "git submodule" output, without a description for uninitialized submodules.
+RE_SUBMODULE = re.compile(r'^(.)([0-9a-f]+)\s+(.+?)(?: \((.+)\))?\s*$')
+# "git for-each-ref" fields, separated by NUL characters in BRANCH_FORMAT, plus "merged".
+BRANCH_FIELDS = ['branch', 'author', 'date', 'upstream', 'head', 'symref', 'refname', 'merged']
+BRANCH_FORMAT = '%00'.join(['%(refname:short)', '%(authorname)', '%(committerdate:unix)',
+                            '%(upstream:short)', '%(HEAD)', '%(symref)', '%(refname)'])
+BRANCH_SPEC = RecordSpec(BRANCH_FIELDS,
+                         separator='\0',
+                         converters=dict(date=lambda date: int(date) if date else None),
+                         name='Branch')
+# "git status --porcelain" output.
+STATUS_SPEC = RecordSpec(['flag', 'path'], name='Status')
+# iter_log() field names and "git log" format placeholders.
+LOG_FIELDS = dict(
+    commit='%H',
+    parents='%P',
+    tree='%T',
+    author='%an',
+    author_email='%ae',
+    author_date='%at',
+    committer='%cn',
+    committer_email='%ce',
+    commit_date='%ct',
+    subject='%s',
+    body='%b',
+)
+LOG_DEFAULT_FIELDS = ('commit', 'author', 'author_date', 'subject')
+# Default upstream for unmerged commit queries.
+DEFAULT_UPSTREAM = 'master'
+# Patch id cache shared by all repositories, since commit ids identify content.
+PATCH_ID_CACHE_DIRECTORY = os.path.expanduser('~/.cache/scriptbase/patch-ids')
 
 def parse_version_number_string(version_string):
     """Parse a dot-separated version string."""
@@ -59,87 +99,327 @@ def version_number_compare(version_string_1, version_string_2): #pylint: disable
 
 
 def get_info():
-    """Read ~/.gitconfig and return an object with <section>.<item> attributes."""
+    """
+    Return an object with <section>[.<subsection>].<item> attributes for user settings.
+
+    Values come from the system and global config files, including their
+    includes (see get_config_value()).
+    """
     class _Node(object):
         pass
     info = _Node()
-    with open(os.path.expanduser('~/.gitconfig')) as file_handle:
-        section = ''
-        for line in file_handle:
-            matched = RE_SECTION.match(line)
-            if matched:
-                section = matched.group(1).lower()
-                setattr(info, section, _Node())
-            else:
-                name, value = [s.strip() for s in line.split('=', 1)]
-                setattr(getattr(info, section), name.lower(), value)
+    for key, values in _USER_CONFIG.get_table().items():
+        node = info
+        section, _, rest = key.partition('.')
+        subsection, _, name = rest.rpartition('.')
+        for node_name in [section, subsection] if subsection else [section]:
+            if not hasattr(node, node_name):
+                setattr(node, node_name, _Node())
+            node = getattr(node, node_name)
+        setattr(node, name, values[-1].value)
     return info
 
 
+def get_config_value(key, default=None, directory=None):
+    """
+    Return an effective config value without running "git config".
+
+    Uses all scopes for the repository containing a directory (default=current),
+    or just the system and global scopes outside of a repository.
+    """
+    repository = get_repository(directory)
+    config = repository.get_config_engine() if repository is not None else _USER_CONFIG
+    return config.get(key, default)
+
+
+def iter_branch_records(*patterns, **kwargs):
+    """
+    Generate branch records from a single "git for-each-ref" query.
+
+    Positional arguments are ref patterns, e.g. "refs/remotes" (default="refs/heads").
+
+    Keyword arguments:
+        merged        only include branches merged into this commit (default=None)
+        unmerged      only include branches not merged into this commit (default=None)
+        merged_into   set the "merged" field relative to this commit (default=None)
+        directory     repository directory (default=None, i.e. current)
+
+    Record fields:
+        branch    short ref name, e.g. "origin/feature"
+        author    author name of the branch head commit
+        date      branch head commit time as seconds since the epoch
+        upstream  short upstream branch name or empty
+        head      "*" if checked out, otherwise blank
+        refname   full ref name, e.g. "refs/remotes/origin/feature"
+        merged    True or False with merged_into, otherwise None
+
+    Symbolic refs, e.g. "origin/HEAD", are skipped. The "merged" field needs
+    one more query.
+    """
+    merged_into = kwargs.get('merged_into')
+    merged_branches = None
+    if merged_into:
+        merged_branches = set([record.branch for record in iter_branch_records(
+            *patterns, merged=merged_into, directory=kwargs.get('directory'))])
+    cmd_args = ['git', 'for-each-ref', '--format=%s' % BRANCH_FORMAT]
+    if kwargs.get('merged'):
+        cmd_args.append('--merged=%s' % kwargs['merged'])
+    if kwargs.get('unmerged'):
+        cmd_args.append('--no-merged=%s' % kwargs['unmerged'])
+    cmd_args.extend(patterns or ['refs/heads'])
+    with Command(*cmd_args).options(cwd=kwargs.get('directory')) as cmd:
+        for record in cmd.records(BRANCH_SPEC):
+            # Skip symbolic refs and error messages.
+            if record.symref or record.author is None:
+                continue
+            record.merged = (record.branch in merged_branches
+                             if merged_branches is not None else None)
+            yield record
+    if cmd.return_code != 0:
+        console.abort('Unable to list branches. Is this a git workspace directory?',
+                      ['return code: %d' % cmd.return_code])
+
+
 def iter_branches(merged=False, unmerged=False, user=None):
-    """Generate branch iterator."""
-    cmd_args = ['git', 'branch', '-r']
-    if merged:
-        cmd_args.append('--merged')
-    elif unmerged:
-        cmd_args.append('--no-merged')
-    with Command(*cmd_args) as cmd:
-        for line in cmd:
-            args = [s.strip() for s in line.split('->') if s.strip()]
-            if len(args) == 1:
-                branch = args[0]
-                if user is None or get_branch_user(branch) == user:
-                    yield branch
+    """Generate remote branch names, optionally filtered by merge status and author."""
+    for record in iter_branch_records('refs/remotes',
+                                      merged='HEAD' if merged else None,
+                                      unmerged='HEAD' if unmerged and not merged else None):
+        if user is None or record.author == user:
+            yield record.branch
 
 
 def get_branch_user(branch):
     """Get user name for given branch."""
-    with Command('git', 'log', '--pretty=tformat:%an', '-1', branch) as cmd:
-        for line in cmd:
-            return line
+    refnames = ['refs/heads/%s' % branch, 'refs/remotes/%s' % branch]
+    for record in iter_branch_records(*refnames):
+        # Patterns also match refs below them, e.g. "refs/heads/feature/x".
+        if record.refname in refnames:
+            return record.author
+    # Fall back to log for other commit references, e.g. tags or hashes.
+    with Command('git', 'log', '--pretty=tformat:%an', '-1', branch, '--') as cmd:
+        pass
+    # Don't mistake an unknown revision error message for a user name.
+    if cmd.return_code == 0 and cmd.output_lines:
+        return cmd.output_lines[0]
+    return None
 
 
 def get_local_branch():
-    """Get the checked out branch name."""
-    branch = '(unknown)'
-    with Command('git', 'branch') as cmd:
-        for line in cmd:
-            if line.startswith('* '):
-                branch = line[2:]
-    if cmd.return_code != 0:
+    """Get the checked out branch name, or "(unknown)" if detached."""
+    repository = get_repository()
+    if repository is None:
         console.abort('You are not in a git workspace directory.')
-    return branch
+    return repository.get_branch() or '(unknown)'
 
 
 def get_tracking_branch():
     """
     Get the current tracking branch.
 
-    http://stackoverflow.com/questions/171550/find-out-which-remote-branch-a-local-branch-is-tracking
+    Reads the branch configuration directly (see Repository).
     """
-    with Command(
-        'git',
-        'for-each-ref',
-        "--format='%(upstream:short)' $(git symbolic-ref -q HEAD)"
-    ) as cmd:
-        for line in cmd:
-            return line
-        if cmd.return_code != 0:
-            console.abort('"git for-each-ref" failed with return code {return_code}',
-                          return_code=cmd.return_code)
-
-
-def iter_unmerged_commits(branch):
-    """Get unmerged commits for given branch."""
-    class _Item(object):
-        def __init__(self, identifier, comment):
-            self.identifier = identifier
-            self.comment = comment
-    with Command('git', 'cherry', '-v', 'master', branch) as cmd:
+    repository = get_repository()
+    if repository is None:
+        console.abort('You are not in a git workspace directory.')
+    return repository.get_tracking_branch()
+
+
+class UnmergedCommit(object):     #pylint: disable=too-few-public-methods
+    """Commit id and subject of a commit without an equivalent upstream patch."""
+
+    __slots__ = ('identifier', 'comment')
+
+    def __init__(self, identifier, comment):
+        """Construct with commit id and subject."""
+        self.identifier = identifier
+        self.comment = comment
+
+    def __repr__(self):
+        """Display id and subject."""
+        return 'UnmergedCommit(%s %s)' % (self.identifier, self.comment)
+
+
+def iter_unmerged_commits(branch, upstream=DEFAULT_UPSTREAM):
+    """Get unmerged commits for given branch, i.e. without equivalent upstream patches."""
+    with Command('git', 'cherry', '-v', upstream, branch) as cmd:
         for line in cmd:
             fields = line.split(None, 2)
             if len(fields) == 3 and fields[0] == '+':
-                yield _Item(fields[1], fields[2])
+                yield UnmergedCommit(fields[1], fields[2])
+
+
+def _run_git(directory, *args):
+    # Return (return code, output lines) for a git command.
+    with Command('git', *args).options(cwd=directory) as cmd:
+        pass
+    return cmd.return_code, cmd.output_lines
+
+
+def _get_patch_ids(directory, *rev_args):
+    # Return {commit: patch id} for non-merge commits with changes in a revision range.
+    with Pipeline(['git', '-C', directory or os.curdir, 'log', '-p', '--no-merges',
+                   '--format=commit %H'] + list(rev_args) + ['--'],
+                  ['git', 'patch-id', '--stable']) as pipeline:
+        lines = pipeline.read_lines()
+    if pipeline.return_code != 0:
+        console.abort('Unable to compute patch ids.', lines)
+    patch_ids = {}
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2:
+            patch_ids[fields[1]] = fields[0]
+    return patch_ids
+
+
+def _get_upstream_patch_ids(directory, upstream_commit, base_commit, cache_directory):
+    # Return {commit: patch id} for base_commit..upstream_commit, cached by the commit ids.
+    result_cache = _PATCH_ID_CACHES.get(cache_directory)
+    if result_cache is None:
+        result_cache = ResultCache(max_entries=16, directory=cache_directory)
+        _PATCH_ID_CACHES[cache_directory] = result_cache
+    # Commit ids identify content, so the key doesn't depend on the repository.
+    key = ResultCache.make_key(['patch-ids', upstream_commit, base_commit])
+    entry = result_cache.get(key)
+    if entry is not None:
+        return dict([line.split() for line in entry.output_lines])
+    patch_ids = _get_patch_ids(directory, upstream_commit, '^%s' % base_commit)
+    result_cache.put(key, 0, ['%s %s' % item for item in sorted(patch_ids.items())])
+    return patch_ids
+
+
+def unmerged_commits_for_branches(branches,      #pylint: disable=too-many-locals
+                                  upstream=DEFAULT_UPSTREAM,
+                                  jobs=None,
+                                  cache_directory=PATCH_ID_CACHE_DIRECTORY,
+                                  directory=None):
+    """
+    Return {branch: UnmergedCommit list} for many branches, like "git cherry".
+
+    Upstream patch ids are computed once for all branches, back to a common
+    ancestor of their merge bases, and saved in cache_directory, if not
+    None, keyed by the upstream and base commits. Branches are evaluated on
+    up to "jobs" threads (default=CPU count).
+
+    As with "git cherry", merge commits are ignored, and a branch commit is
+    unmerged if no upstream commit after the merge base has the same patch
+    id. Commits are listed oldest first, and the dictionary is in branch
+    order. Branches without a common history use "git cherry".
+    """
+    branches = list(branches)
+    return_code, lines = _run_git(directory, 'rev-parse', '--verify', '%s^{commit}' % upstream)
+    if return_code != 0 or not lines:
+        console.abort('Bad upstream commit: %s' % upstream, lines)
+    upstream_commit = lines[0]
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1)
+    with executor:
+        def _get_merge_base(branch):
+            return_code, lines = _run_git(directory, 'merge-base', upstream_commit, branch)
+            return lines[0] if return_code == 0 and lines else None
+        merge_bases = list(executor.map(_get_merge_base, branches))
+        bases = sorted(set([base for base in merge_bases if base]))
+        base_commit = bases[0] if bases else None
+        if len(bases) > 1:
+            return_code, lines = _run_git(directory, 'merge-base', '--octopus', *bases)
+            base_commit = lines[0] if return_code == 0 and lines else None
+        upstream_patch_ids = None
+        if base_commit:
+            upstream_patch_ids = _get_upstream_patch_ids(directory, upstream_commit,
+                                                         base_commit, cache_directory)
+        def _get_unmerged(branch, merge_base):
+            if merge_base is None or upstream_patch_ids is None:
+                return_code, lines = _run_git(directory, 'rev-parse', '--verify', '--quiet',
+                                              '%s^{commit}' % branch)
+                if return_code != 0:
+                    console.abort('Bad branch: %s' % branch, lines)
+                return [commit.identifier
+                        for commit in iter_unmerged_commits(branch, upstream=upstream_commit)]
+            return_code, lines = _run_git(directory, 'rev-list', upstream_commit,
+                                          '^%s' % merge_base)
+            if return_code != 0:
+                console.abort('Unable to list upstream commits: %s' % upstream, lines)
+            patch_ids = set([upstream_patch_ids[commit] for commit in lines
+                             if commit in upstream_patch_ids])
+            return_code, commits = _run_git(directory, 'rev-list', '--reverse', '--no-merges',
+                                            branch, '^%s' % merge_base)
+            if return_code != 0:
+                console.abort('Unable to list commits for branch: %s' % branch, commits)
+            branch_patch_ids = _get_patch_ids(directory, branch, '^%s' % merge_base)
+            # Commits without changes have no patch id and are unmerged.
+            return [commit for commit in commits if branch_patch_ids.get(commit) not in patch_ids]
+        unmerged = list(executor.map(_get_unmerged, branches, merge_bases))
+    all_commits = sorted(set([commit for commits in unmerged for commit in commits]))
+    subjects = {}
+    if all_commits:
+        reader = get_object_reader(directory)
+        for git_object in reader.read_many(all_commits):
+            if git_object is not None:
+                message = (git_object.text.split('\n\n', 1) + [''])[1]
+                subjects[git_object.object_id] = message.split('\n', 1)[0]
+    return {branch: [UnmergedCommit(commit, subjects.get(commit, '')) for commit in commits]
+            for branch, commits in zip(branches, unmerged)}
+
+
+@functools.lru_cache(maxsize=32)
+def _get_log_spec(fields):
+    # Return a RecordSpec for "git log -z" output with unit separated fields.
+    converters = dict(parents=lambda parents: parents.split(),
+                      author_date=int,
+                      commit_date=int)
+    return RecordSpec(fields, separator='\x1f', delimiter='\0', converters=converters,
+                      name='LogEntry')
+
+
+def iter_log(rev_range='HEAD', fields=LOG_DEFAULT_FIELDS, paths=None, **kwargs):
+    """
+    Stream commit records from a single "git log" query in constant memory.
+
+    Positional arguments:
+        1) revision or range, e.g. "master..feature" (default="HEAD")
+
+    Keyword arguments:
+        fields     LOG_FIELDS names (default=LOG_DEFAULT_FIELDS)
+        paths      only include commits touching these paths (default=None)
+        since      only include newer commits, as a git date or epoch seconds (default=None)
+        until      only include older commits, as a git date or epoch seconds (default=None)
+        last_seen  exclude this commit and its ancestors, e.g. to resume (default=None)
+        reverse    yield oldest commits first if True (default=False)
+        max_count  maximum number of newest commits, applied before reversing (default=None)
+        directory  repository directory (default=None, i.e. current)
+
+    Records always start with the "commit" field. Parent lists are split,
+    and dates are converted to seconds since the epoch. A "body" field, if
+    any, should be last, since it may contain anything but NUL characters.
+    """
+    fields = tuple(['commit'] + [field for field in fields if field != 'commit'])
+    bad_fields = [field for field in fields if field not in LOG_FIELDS]
+    if bad_fields:
+        raise ValueError('Bad log field(s): %s' % ' '.join(bad_fields))
+    cmd_args = ['git', 'log', '-z',
+                '--format=%s' % '%x1f'.join([LOG_FIELDS[field] for field in fields])]
+    for option in ('since', 'until'):
+        value = kwargs.get(option)
+        if value is not None:
+            if isinstance(value, (int, float)):
+                value = '@%d' % value
+            cmd_args.append('--%s=%s' % (option, value))
+    if kwargs.get('reverse'):
+        cmd_args.append('--reverse')
+    if kwargs.get('max_count') is not None:
+        cmd_args.append('--max-count=%d' % kwargs['max_count'])
+    cmd_args.append(rev_range)
+    if kwargs.get('last_seen'):
+        cmd_args.append('^%s' % kwargs['last_seen'])
+    cmd_args.append('--')
+    cmd_args.extend(paths or [])
+    with Command(*cmd_args).options(cwd=kwargs.get('directory')) as cmd:
+        for record in cmd.records(_get_log_spec(fields)):
+            # Skip error messages, which are merged with the output.
+            if len(record.commit) in (40, 64) and (len(fields) == 1
+                                                  or getattr(record, fields[-1]) is not None):
+                yield record
+    if cmd.return_code != 0:
+        console.abort('Unable to read the commit log.', ['return code: %d' % cmd.return_code])
 
 
 def _unquote_path(path):
@@ -148,38 +428,59 @@ def _unquote_path(path):
     return path[1:-1]
 
 
-def iter_changes(submodules=False):
-    """Iterate file change status."""
-    def _get_status(line, submodule):
-        class _FileStatus(object):
-            def __init__(self, flag, path, path2, modified):
-                self.flag = flag
-                self.path = path
-                self.path2 = path2
-                self.modified = modified
+def iter_changes(submodules=False, jobs=None):
+    """
+    Iterate file change status.
+
+    Submodule status, if requested, is gathered by up to "jobs" threads
+    (default=CPU count), and yielded in submodule order after the top level.
+    """
+    class _FileStatus(object):
+        def __init__(self, flag, path, path2, modified):
+            self.flag = flag
+            self.path = path
+            self.path2 = path2
+            self.modified = modified
+    def _get_status(status, submodule):
         def _get_path(base_path):
             ret_path = base_path if not submodule else os.path.join(submodule, base_path)
             return _unquote_path(ret_path)
-        flag, path = line.split(None, 1)
-        path = _get_path(path)
-        path2 = None if not flag.startswith('R') else _get_path(line.split(' -> ')[-1])
+        path = _get_path(status.path)
+        path2 = None
+        if status.flag.startswith('R'):
+            path2 = _get_path(status.path.split(' -> ')[-1])
         try:
             modified = os.stat(path2 if path2 else path).st_mtime
         except OSError:
             modified = 0.0
-        return _FileStatus(flag, path, path2, modified)
+        return _FileStatus(status.flag, path, path2, modified)
     status_cmd_args = ('git', 'status', '--porcelain', '--ignore-submodules')
-    with Command(*status_cmd_args) as cmd:
-        for line in cmd:
-            yield _get_status(line, None)
+    def _get_changes(submodule):
+        # The index-based status engine avoids a "git status" scan.
+        repository = get_repository(submodule)
+        if repository is not None and (
+                submodule is None
+                or repository.work_tree == os.path.realpath(submodule)):
+            def _get_path(path):
+                return os.path.join(submodule, path) if path and submodule else path
+            return [_FileStatus(status.flag, _get_path(status.path), _get_path(status.path2),
+                                status.modified)
+                    for status in repository.get_status()]
+        with Command(*status_cmd_args).options(cwd=submodule) as cmd:
+            return [_get_status(status, submodule) for status in cmd.records(STATUS_SPEC)]
+    for status in _get_changes(None):
+        yield status
     if submodules:
-        submodule = None
-        with Command('git', 'submodule', 'foreach', ' '.join(status_cmd_args)) as cmd:
-            for line in cmd:
-                if line.startswith('Entering'):
-                    submodule = line[10:-1]
-                else:
-                    yield _get_status(line, submodule)
+        submodule_paths = list(iter_submodules(checked_out=True))
+        if submodule_paths:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(jobs or os.cpu_count() or 1, len(submodule_paths)))
+            try:
+                for changes in executor.map(_get_changes, submodule_paths):
+                    for status in changes:
+                        yield status
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
 
 
 def get_changes():
@@ -192,32 +493,492 @@ def get_changes_by_time():
     return sorted(list(iter_changes()), key=lambda x: x.modified)
 
 
-def remote_branch_exists(url, branch, verbose=False):
-    """Return True if the remote branch name exists."""
-    args = ['git', 'ls-remote', '--heads', url, branch]
+# Seconds that a remote heads snapshot answers branch existence checks.
+REMOTE_HEADS_TTL = 60.0
+# Remote heads snapshots as (time.time() timestamp, {branch: commit}) pairs keyed by URL.
+_REMOTE_HEADS = {}
+_REMOTE_HEADS_LOCK = threading.Lock()
+
+
+def get_remote_heads(url, ttl=REMOTE_HEADS_TTL, refresh=False, verbose=False):
+    """
+    Return a {branch: commit} snapshot of remote branch heads.
+
+    One "git ls-remote --heads" listing per URL answers all queries until it
+    is older than ttl seconds or refresh is True. A failed listing returns an
+    empty snapshot that isn't kept.
+    """
+    with _REMOTE_HEADS_LOCK:
+        entry = _REMOTE_HEADS.get(url)
+    if entry is not None and not refresh and (ttl is None or time.time() - entry[0] <= ttl):
+        return entry[1]
+    args = ['git', 'ls-remote', '--heads', url]
     if verbose:
         console.verbose_info(' '.join(args))
+    heads = {}
     with Command(*args) as cmd:
         for line in cmd:
             if verbose:
                 console.verbose_info(line)
-            if line.split()[-1].split('/')[-1] == branch:
-                return True
-    return False
+            fields = line.split()
+            if len(fields) == 2 and fields[1].startswith('refs/heads/'):
+                heads[fields[1][11:]] = fields[0]
+    if cmd.return_code != 0:
+        # Like a missing branch, an unreachable remote has no heads. Try again next time.
+        return {}
+    with _REMOTE_HEADS_LOCK:
+        _REMOTE_HEADS[url] = (time.time(), heads)
+    return heads
+
+
+def add_remote_head(url, branch, commit=None):
+    """Add a pushed branch, with its commit if known, to the remote heads snapshot, if any."""
+    with _REMOTE_HEADS_LOCK:
+        entry = _REMOTE_HEADS.get(url)
+        if entry is not None:
+            heads = dict(entry[1])
+            heads[branch] = commit
+            _REMOTE_HEADS[url] = (entry[0], heads)
+
+
+def forget_remote_heads(url=None):
+    """Discard the remote heads snapshot for a URL, or all snapshots."""
+    with _REMOTE_HEADS_LOCK:
+        if url is None:
+            _REMOTE_HEADS.clear()
+        else:
+            _REMOTE_HEADS.pop(url, None)
+
+
+def remote_branch_exists(url, branch, verbose=False, ttl=REMOTE_HEADS_TTL):
+    """Return True if the remote branch name exists (see get_remote_heads())."""
+    return branch in get_remote_heads(url, ttl=ttl, verbose=verbose)
+
+
+class Repository(object):
+    """
+    Read repository state directly from files under the git directory.
+
+    Answers questions about HEAD, refs and configuration without running git.
+    Parsed files are cached and re-read when their modification time or size
+    changes. Linked worktrees and "gitdir:" files are supported. Reftables and
+    alternate ref stores are not. Configuration values come from all scopes,
+    including includes (see the gitconfig module).
+
+    Use get_repository() to share Repository objects and their caches.
+    """
+
+    def __init__(self, work_tree, git_dir):
+        """Construct with work tree and git directory paths (see find())."""
+        self.work_tree = work_tree
+        self.git_dir = git_dir
+        common_dir = self._read_text(os.path.join(git_dir, 'commondir'))
+        if common_dir:
+            self.common_dir = os.path.normpath(os.path.join(git_dir, common_dir.strip()))
+        else:
+            self.common_dir = git_dir
+        self._cache = {}
+        self._lock = threading.Lock()
+        self._status_engine = None
+        self._config_engine = None
+
+    @classmethod
+    def find_git_path(cls, directory=None):
+        """Return the nearest .git directory or file path, or None."""
+        directory = os.path.abspath(directory or os.getcwd())
+        while True:
+            git_path = os.path.join(directory, '.git')
+            if os.path.exists(git_path):
+                return git_path
+            parent_directory = os.path.dirname(directory)
+            if parent_directory == directory:
+                return None
+            directory = parent_directory
+
+    @classmethod
+    def find(cls, directory=None):
+        """Return a Repository for a directory or its nearest parent, or None."""
+        git_path = cls.find_git_path(directory)
+        if git_path is None:
+            return None
+        work_tree = os.path.dirname(git_path)
+        git_dir = git_path
+        if os.path.isfile(git_path):
+            # Worktrees and submodules have "gitdir: <path>" files.
+            text = cls._read_text(git_path) or ''
+            if not text.startswith('gitdir:'):
+                return None
+            git_dir = os.path.normpath(os.path.join(work_tree, text[7:].strip()))
+        return cls(os.path.realpath(work_tree), git_dir)
+
+    @classmethod
+    def _read_text(cls, path):
+        try:
+            with open(path) as file_handle:
+                return file_handle.read()
+        except (IOError, OSError, UnicodeDecodeError):
+            return None
+
+    def _read_cached(self, path, parser):
+        # Return parsed file data, re-reading when the file stamp changes.
+        stamp = file_stamp(path)
+        with self._lock:
+            entry = self._cache.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        text = self._read_text(path) if stamp is not None else None
+        data = parser(text)
+        with self._lock:
+            self._cache[path] = (stamp, data)
+        return data
+
+    @classmethod
+    def _parse_packed_refs(cls, text):
+        refs = {}
+        for line in (text or '').splitlines():
+            if line and line[0] not in '#^':
+                fields = line.split(' ', 1)
+                if len(fields) == 2:
+                    refs[fields[1].strip()] = fields[0]
+        return refs
+
+    def packed_refs(self):
+        """Return the {refname: sha} dictionary from packed-refs."""
+        return self._read_cached(os.path.join(self.common_dir, 'packed-refs'),
+                                 self._parse_packed_refs)
+
+    def config(self):
+        """Return the repository config dictionary (see parse_config())."""
+        return self._read_cached(os.path.join(self.common_dir, 'config'),
+                                 lambda text: parse_config(text or ''))
+
+    def get_config_engine(self):
+        """Return the gitconfig.GitConfig with all scopes for this repository."""
+        with self._lock:
+            if self._config_engine is None:
+                self._config_engine = gitconfig.GitConfig(self)
+            return self._config_engine
+
+    def get_config(self, key, default=None):
+        """Return an effective config value, from any scope, by "section[.subsection].name" key."""
+        return self.get_config_engine().get(key, default)
+
+    def read_ref(self, refname):
+        """Return the raw loose ref or HEAD content, or None."""
+        # HEAD and other pseudo refs are per-worktree, others are shared.
+        if refname.startswith('refs/') and not refname.startswith(('refs/bisect/',
+                                                                   'refs/worktree/')):
+            path = os.path.join(self.common_dir, refname)
+        else:
+            path = os.path.join(self.git_dir, refname)
+        text = self._read_cached(path, lambda text: text.strip() if text else None)
+        return text
+
+    def resolve_ref(self, refname, max_depth=5):
+        """Return the commit hash for a ref name, following symbolic refs, or None."""
+        for _ in range(max_depth):
+            text = self.read_ref(refname)
+            if text is None:
+                return self.packed_refs().get(refname)
+            if not text.startswith('ref:'):
+                return text
+            refname = text[4:].strip()
+        return None
+
+    def get_head_ref(self):
+        """Return the ref name HEAD points to, or None if detached."""
+        text = self.read_ref('HEAD')
+        if text and text.startswith('ref:'):
+            return text[4:].strip()
+        return None
+
+    def get_branch(self):
+        """Return the checked out branch name, or None if detached."""
+        head_ref = self.get_head_ref()
+        if head_ref and head_ref.startswith('refs/heads/'):
+            return head_ref[11:]
+        return head_ref
+
+    def get_tracking_branch(self, branch=None):
+        """Return the short upstream name, e.g. "origin/master", or None."""
+        branch = branch or self.get_branch()
+        if not branch:
+            return None
+        remote = self.get_config('branch.%s.remote' % branch)
+        merge = self.get_config('branch.%s.merge' % branch)
+        if not remote or not merge:
+            return None
+        if merge.startswith('refs/heads/'):
+            merge = merge[11:]
+        if remote == '.':
+            return merge
+        return '%s/%s' % (remote, merge)
+
+    def get_remote_url(self, remote='origin'):
+        """Return a remote URL, or None."""
+        return self.get_config('remote.%s.url' % remote)
+
+    def get_status(self, untracked=True):
+        """Return a gitindex.StatusEntry list for the work tree, excluding submodules."""
+        # The engine reads config through the cache lock, so construct it outside the lock.
+        status_engine = self._status_engine
+        if status_engine is None:
+            status_engine = gitindex.StatusEngine(self)
+            with self._lock:
+                if self._status_engine is None:
+                    self._status_engine = status_engine
+                status_engine = self._status_engine
+        return status_engine.status(untracked=untracked)
+
+
+# Shared configuration for the system and global scopes.
+_USER_CONFIG = gitconfig.GitConfig()
+# Shared (.git stamp, Repository) pairs keyed by .git path.
+_REPOSITORIES = {}
+
+
+def get_repository(directory=None):
+    """Return a shared Repository for a directory or its nearest parent, or None."""
+    git_path = Repository.find_git_path(directory)
+    if git_path is None:
+        return None
+    stamp = file_stamp(git_path)
+    entry = _REPOSITORIES.get(git_path)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+    repository = Repository.find(directory)
+    if repository is not None:
+        _REPOSITORIES[git_path] = (stamp, repository)
+    return repository
+
+
+class GitObject(object):     #pylint: disable=too-few-public-methods
+    """Object id, type, size and content, which is None for information queries."""
+
+    __slots__ = ('object_id', 'type', 'size', 'data')
+
+    def __init__(self, object_id, object_type, size, data=None):
+        """Construct with object id, type name, size and optional content bytes."""
+        self.object_id = object_id
+        self.type = object_type
+        self.size = size
+        self.data = data
+
+    @property
+    def text(self):
+        """Content decoded as UTF-8, or None."""
+        return self.data.decode('utf8', 'replace') if self.data is not None else None
+
+    def __repr__(self):
+        """Display id, type and size."""
+        return 'GitObject(%s %s %d)' % (self.object_id, self.type, self.size)
+
+
+class GitObjectReader(object):
+    """
+    Read objects through persistent "git cat-file --batch" coprocesses.
+
+    Contents come from a "--batch" process and types and sizes from a
+    "--batch-check" process, each started on first use, so any number of
+    lookups only spawns two processes. Requests are written in batches and
+    responses are parsed as they stream back. Objects requested by full id
+    are kept in a small LRU cache.
+
+    Names are anything "git cat-file" accepts, e.g. "HEAD", "HEAD:path" or an
+    object id. Missing or ambiguous names produce None.
+
+    A reader is thread-safe. Use get_object_reader() to share one reader per
+    repository.
+    """
+
+    #=== GitObjectReader nested classes.
+
+    class Error(RuntimeError):
+        """Exception for a failed "git cat-file" process."""
+        #pylint: disable=unnecessary-pass
+        pass
+
+    #=== GitObjectReader methods.
+
+    # Request bytes written before reading responses. Smaller than the pipe
+    # buffer so that writing never waits for git while git waits for us.
+    max_request_bytes = 32768
+
+    def __init__(self, directory=None, cache_size=256):
+        """Construct with repository directory (default=current) and LRU cache size."""
+        self.directory = directory
+        self.cache_size = cache_size
+        self.restarts = 0
+        self._processes = {}
+        self._locks = {'--batch': threading.Lock(), '--batch-check': threading.Lock()}
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def __enter__(self):
+        """Return self at the start of a "with" block."""
+        return self
+
+    def __exit__(self, exit_type, exit_value, exit_traceback):
+        """Stop the processes at the end of a "with" block."""
+        self.stop()
+
+    def stop(self):
+        """Stop the processes. They are restarted if needed."""
+        for mode, lock in self._locks.items():
+            with lock:
+                self._stop_process(mode)
+
+    def read(self, name):
+        """Return a GitObject with content, or None if missing."""
+        return next(self.read_many([name]))
+
+    def read_many(self, names):
+        """Yield a GitObject with content, or None if missing, for each name in order."""
+        return self._query('--batch', names)
+
+    def get_info(self, name):
+        """Return a GitObject without content, or None if missing."""
+        return next(self.get_info_many([name]))
+
+    def get_info_many(self, names):
+        """Yield a GitObject without content, or None if missing, for each name in order."""
+        return self._query('--batch-check', names)
+
+    def _query(self, mode, names):
+        names_batch = []
+        request_bytes = 0
+        for name in names:
+            if '\n' in name:
+                raise ValueError('Object names may not contain newlines: %r' % name)
+            names_batch.append(name)
+            request_bytes += len(name) + 1
+            if request_bytes >= self.max_request_bytes:
+                for git_object in self._query_batch(mode, names_batch):
+                    yield git_object
+                names_batch = []
+                request_bytes = 0
+        if names_batch:
+            for git_object in self._query_batch(mode, names_batch):
+                yield git_object
+
+    def _query_batch(self, mode, names):
+        # Return results for names in order, from the cache or one request batch.
+        results = [self._get_cached(name) for name in names]
+        indexes = [index for index, result in enumerate(results) if result is None]
+        if not indexes:
+            return results
+        with self._locks[mode]:
+            child = self._get_process(mode)
+            try:
+                child.stdin.write(b''.join([os.fsencode(names[index]) + b'\n'
+                                           for index in indexes]))
+                child.stdin.flush()
+                for index in indexes:
+                    results[index] = self._read_response(child, mode == '--batch')
+            except (IOError, OSError, ValueError) as exc:
+                self._stop_process(mode)
+                raise GitObjectReader.Error('git cat-file %s failed: %s' % (mode, exc))
+            except:
+                # Unread responses would be mistaken for later ones.
+                self._stop_process(mode)
+                raise
+        for result in results:
+            if result is not None and result.data is not None:
+                self._put_cached(result)
+        return results
+
+    @classmethod
+    def _read_response(cls, child, with_data):
+        line = child.stdout.readline()
+        if not line:
+            raise ValueError('process ended with return code %s' % child.poll())
+        fields = line.split()
+        if len(fields) != 3:
+            # "<name> missing" or "<name> ambiguous"
+            return None
+        size = int(fields[2])
+        data = None
+        if with_data:
+            data = child.stdout.read(size)
+            if len(data) != size or child.stdout.read(1) != b'\n':
+                raise ValueError('truncated object %s' % fields[0].decode('utf8'))
+        return GitObject(fields[0].decode('utf8'), fields[1].decode('utf8'), size, data)
+
+    def _get_process(self, mode):
+        # Start the process for a mode if needed. The caller holds the mode lock.
+        child = self._processes.get(mode)
+        if child is not None and child.poll() is None:
+            return child
+        if child is not None:
+            self._stop_process(mode)
+            self.restarts += 1
+        child = process.launch(['git', 'cat-file', mode],
+                               cwd=self.directory,
+                               stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL)
+        self._processes[mode] = child
+        return child
+
+    def _stop_process(self, mode):
+        # Stop the process for a mode, if any. The caller holds the mode lock.
+        child = self._processes.pop(mode, None)
+        if child is None:
+            return
+        try:
+            child.stdin.close()
+        except (IOError, OSError):
+            pass
+        child.stdout.close()
+        try:
+            child.wait(timeout=process.KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            child.kill()
+            child.wait()
+
+    def _get_cached(self, name):
+        with self._cache_lock:
+            git_object = self._cache.get(name)
+            if git_object is not None:
+                self._cache.move_to_end(name)
+        return git_object
+
+    def _put_cached(self, git_object):
+        with self._cache_lock:
+            self._cache[git_object.object_id] = git_object
+            self._cache.move_to_end(git_object.object_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+# Shared patch id ResultCache objects keyed by cache directory.
+_PATCH_ID_CACHES = {}
+# Shared GitObjectReader objects keyed by git directory.
+_OBJECT_READERS = {}
+_OBJECT_READERS_LOCK = threading.Lock()
+
+
+def get_object_reader(directory=None):
+    """Return a shared GitObjectReader for the repository containing a directory."""
+    repository = get_repository(directory)
+    if repository is not None:
+        key = repository.git_dir
+        directory = repository.work_tree
+    else:
+        # Bare repositories aren't found by Repository.find().
+        key = directory = os.path.abspath(directory or os.getcwd())
+    with _OBJECT_READERS_LOCK:
+        reader = _OBJECT_READERS.get(key)
+        if reader is None:
+            reader = GitObjectReader(directory)
+            _OBJECT_READERS[key] = reader
+    return reader
 
 
 def git_project_root(directory=None, optional=False):
     """Return the Git project root if inside a Git local repository."""
-    def _get_project_root():
-        with Command('git', 'rev-parse', '--show-toplevel') as cmd:
-            for line in cmd:
-                return line
-    root_directory = None
-    if directory:
-        with utility.working_directory_context(directory):
-            root_directory = _get_project_root()
-    else:
-        root_directory = _get_project_root()
+    repository = get_repository(directory)
+    root_directory = repository.work_tree if repository else None
     if not root_directory and not optional:
         console.abort('Failed to find git project root directory.')
     return root_directory
@@ -242,10 +1003,186 @@ def get_github_root(github_root):
     return github_root
 
 
+def find_repositories(root, jobs=None):
+    """
+    Return sorted work tree paths for repositories below a root directory.
+
+    Directories are scanned with os.scandir() on up to "jobs" threads
+    (default=CPU count * 2). Scanning stops at repositories, so nested
+    repositories and submodules are not included. Hidden directories and
+    symbolic links are skipped.
+    """
+    def _scan(directory):
+        # Return ([directory], []) for a repository or ([], sub-directories).
+        try:
+            with os.scandir(directory) as scanner:
+                dir_entries = list(scanner)
+        except OSError:
+            return [], []
+        if [dir_entry for dir_entry in dir_entries if dir_entry.name == '.git']:
+            return [directory], []
+        return [], [dir_entry.path for dir_entry in dir_entries
+                    if not dir_entry.name.startswith('.')
+                    and dir_entry.is_dir(follow_symlinks=False)]
+    repositories = []
+    workers = jobs or (os.cpu_count() or 1) * 2
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set([executor.submit(_scan, os.path.abspath(root))])
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                found, directories = future.result()
+                repositories.extend(found)
+                pending.update([executor.submit(_scan, directory) for directory in directories])
+    return sorted(repositories)
+
+
+class RepositoryState(object):     #pylint: disable=too-few-public-methods
+    """
+    Scanned repository state.
+
+    Members:
+        path      work tree path
+        branch    checked out branch, or None if detached
+        upstream  tracking branch, or None
+        ahead     commits not in the upstream, or None without an upstream
+        behind    upstream commits not checked out, or None without an upstream
+        changes   gitindex.StatusEntry list, or None if status wasn't requested
+        cached    True if the branch information came from the cache
+        error     error message if the repository couldn't be read, otherwise None
+    """
+
+    __slots__ = ('path', 'branch', 'upstream', 'ahead', 'behind', 'changes', 'cached', 'error')
+
+    def __init__(self, path):
+        """Construct empty state for a work tree path."""
+        self.path = path
+        self.branch = None
+        self.upstream = None
+        self.ahead = None
+        self.behind = None
+        self.changes = None
+        self.cached = False
+        self.error = None
+
+    def __repr__(self):
+        """Display path and branch information."""
+        return 'RepositoryState(%s %s...%s +%s -%s)' % (self.path, self.branch, self.upstream,
+                                                        self.ahead, self.behind)
+
+
+class RepositoryScanner(object):
+    """
+    Query branch, ahead/behind and status information for many repositories.
+
+    Repositories are found under a root directory, by default the GitHub root
+    (see get_github_root()), and queried on up to "jobs" threads (default=CPU
+    count). Results are yielded as they become available.
+
+    Branch and ahead/behind results are kept in a ResultCache keyed by the
+    stamps of HEAD, the index, the config, packed-refs and the branch and
+    upstream refs, so re-running a scan skips git queries for unchanged
+    repositories. A cache directory makes the results persistent across
+    runs. Working tree status is always refreshed, but through each
+    repository's incremental status engine, so unchanged files aren't
+    hashed again.
+    """
+
+    def __init__(self, root=None, jobs=None, cache_directory=None):
+        """Construct with root directory, thread count and optional cache directory."""
+        self.root = root or get_github_root(None)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.result_cache = ResultCache(max_entries=4096, directory=cache_directory)
+
+    def scan(self, status=True, ordered=False):
+        """Yield a RepositoryState for each repository, in path order if ordered is True."""
+        paths = find_repositories(self.root, jobs=self.jobs * 2)
+        if not paths:
+            return
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(self.jobs, len(paths)))
+        try:
+            futures = [executor.submit(self.get_state, path, status) for path in paths]
+            if not ordered:
+                futures = concurrent.futures.as_completed(futures)
+            for future in futures:
+                yield future.result()
+        finally:
+            # Skip queued repositories if the caller stops iterating early.
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def get_state(self, path, status=True):
+        """Return a RepositoryState for one work tree."""
+        state = RepositoryState(path)
+        repository = get_repository(path)
+        if repository is None:
+            state.error = 'Not a git repository.'
+            return state
+        state.branch = repository.get_branch()
+        state.upstream = repository.get_tracking_branch()
+        upstream_ref = self._get_upstream_ref(repository, state.branch)
+        key = ResultCache.make_key(
+            ['repository-state', repository.work_tree, state.branch, upstream_ref],
+            files=[os.path.join(repository.git_dir, 'HEAD'),
+                   os.path.join(repository.git_dir, 'index'),
+                   os.path.join(repository.common_dir, 'config'),
+                   os.path.join(repository.common_dir, 'packed-refs'),
+                   os.path.join(repository.common_dir, repository.get_head_ref() or 'HEAD'),
+                   os.path.join(repository.common_dir, upstream_ref or 'HEAD')])
+        entry = self.result_cache.get(key)
+        if entry is not None:
+            state.cached = True
+            counts = entry.output_lines
+        else:
+            counts = self._get_counts(repository, upstream_ref)
+            if counts is None:
+                state.error = 'Unable to compare with upstream %s.' % state.upstream
+            else:
+                self.result_cache.put(key, 0, counts)
+        if counts:
+            state.ahead, state.behind = [int(count) for count in counts]
+        if status:
+            try:
+                state.changes = repository.get_status()
+            except (IOError, OSError, ValueError) as exc:
+                state.error = 'Unable to get status: %s' % exc
+        return state
+
+    @classmethod
+    def _get_upstream_ref(cls, repository, branch):
+        # Return the full upstream ref name, or None.
+        if not branch:
+            return None
+        remote = repository.get_config('branch.%s.remote' % branch)
+        merge = repository.get_config('branch.%s.merge' % branch)
+        if not remote or not merge:
+            return None
+        if remote == '.' or not merge.startswith('refs/heads/'):
+            return merge
+        return 'refs/remotes/%s/%s' % (remote, merge[11:])
+
+    @classmethod
+    def _get_counts(cls, repository, upstream_ref):
+        # Return [ahead, behind] strings, [] without an upstream, or None on failure.
+        if not upstream_ref:
+            return []
+        head_commit = repository.resolve_ref('HEAD')
+        upstream_commit = repository.resolve_ref(upstream_ref)
+        if head_commit is None or upstream_commit is None:
+            return None
+        if head_commit == upstream_commit:
+            return ['0', '0']
+        return_code, lines = _run_git(repository.work_tree, 'rev-list', '--left-right', '--count',
+                                      '%s...%s' % (head_commit, upstream_commit))
+        if return_code != 0 or not lines or len(lines[0].split()) != 2:
+            return None
+        return lines[0].split()
+
+
 def git_version():
     """Return the git program version."""
     version = None
-    with Command('git', '--version') as cmd:
+    with Command('git', '--version').options(cache=True, cache_env=['PATH']) as cmd:
         for line in cmd:
             if version is None:
                 matched = RE_VERSION.search(line)
@@ -297,6 +1234,8 @@ def create_remote_branch(url, branch, dry_run=False, verbose=False):
     if not remote_exists:
         console.info(runner.expand('Creating remote branch {branch}...'))
         runner.shell('git push origin {branch}:{branch}')
+        if url is not None and not dry_run:
+            add_remote_head(url, branch)
     # Check out branch.
     runner.shell('git checkout {branch}')
     # Set up remote tracking.
@@ -310,18 +1249,19 @@ def create_remote_branch(url, branch, dry_run=False, verbose=False):
 
 def get_repository_url():
     """Get the URL for the remote repository."""
-    with Command('git', 'config', '--get', 'remote.origin.url') as cmd:
-        for line in cmd:
-            return line
+    repository = get_repository()
+    return repository.get_remote_url() if repository else None
 
 
-def iter_submodules():
-    """Yield submodule relative paths."""
+def iter_submodules(checked_out=False):
+    """Yield submodule relative paths, optionally only for checked out submodules."""
     with Command('git', 'submodule') as cmd:
         for line in cmd:
             matched = RE_SUBMODULE.match(line)
             if matched:
-                yield matched.group(3)
+                # A "-" flag means the submodule is not initialized.
+                if not checked_out or matched.group(1) != '-':
+                    yield matched.group(3)
             else:
                 print(line)
 
@@ -0,0 +1,375 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Git configuration reading without running "git config".
+
+GitConfig resolves the system, global, repository and worktree scopes in
+git's order of precedence, and follows "include.path" and "includeIf"
+directives with "gitdir:", "gitdir/i:" and "onbranch:" conditions. Parsed
+files are cached by path, modification time and size, and the resolved
+lookup table is rebuilt only when one of the files it came from changes.
+
+Keys are "section.name" or "section.subsection.name". Section and variable
+names are case-insensitive, and subsections are case-sensitive.
+
+Not supported: "hasconfig:" conditions, GIT_CONFIG_COUNT/KEY/VALUE
+environment variables, and command line "-c" settings.
+"""
+
+import os
+import re
+import threading
+
+from .cache import file_stamp
+
+
+RE_CONFIG_SECTION = re.compile(r'^\[\s*([-.\w]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]\s*(.*)$')
+RE_CONFIG_VARIABLE = re.compile(r'^([a-zA-Z][-\w]*)\s*(?:=\s*(.*))?$')
+# Scope names from lowest to highest precedence.
+SCOPES = ('system', 'global', 'local', 'worktree')
+# Maximum include nesting, as for git.
+MAX_INCLUDE_DEPTH = 10
+TRUE_VALUES = ('true', 'yes', 'on', '1')
+FALSE_VALUES = ('false', 'no', 'off', '0', '')
+
+
+def normalize_key(key):
+    """Return a key with lowercase section and variable names."""
+    section_name, _, rest = key.partition('.')
+    subsection, _, name = rest.rpartition('.')
+    return '.'.join([part for part in (section_name.lower(), subsection, name.lower()) if part])
+
+
+def _parse_config_value(text):
+    # Strip comments and quotes and process escapes in a config value.
+    chars = []
+    in_quotes = False
+    position = 0
+    while position < len(text):
+        char = text[position]
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == '\\' and position + 1 < len(text):
+            position += 1
+            chars.append(dict(n='\n', t='\t', b='\b').get(text[position], text[position]))
+        elif char in ';#' and not in_quotes:
+            break
+        else:
+            chars.append(char)
+        position += 1
+    return ''.join(chars).strip() if not in_quotes else ''.join(chars)
+
+
+def parse_config_items(text):
+    """
+    Parse git config file text into a (section, subsection, name, value) list.
+
+    Section and variable names are lowercase, subsection is None if there
+    isn't one, and a variable without "=" is "true". Items are in file
+    order, so multi-valued variables have one item per value.
+    """
+    items = []
+    section = subsection = None
+    lines = text.splitlines()
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        index += 1
+        # Join continuation lines.
+        while line.endswith('\\') and index < len(lines):
+            line = line[:-1] + lines[index].strip()
+            index += 1
+        if not line or line[0] in ';#':
+            continue
+        if line.startswith('['):
+            matched = RE_CONFIG_SECTION.match(line)
+            if not matched:
+                section = None
+                continue
+            name = matched.group(1)
+            if matched.group(2) is not None:
+                section = name.lower()
+                subsection = re.sub(r'\\(.)', r'\1', matched.group(2))
+            elif '.' in name:
+                # Deprecated [section.subsection] syntax.
+                section_name, subsection = name.split('.', 1)
+                section = section_name.lower()
+                subsection = subsection.lower()
+            else:
+                section = name.lower()
+                subsection = None
+            line = matched.group(3).strip()
+            if not line:
+                continue
+        if section is None:
+            continue
+        matched = RE_CONFIG_VARIABLE.match(line)
+        if matched:
+            value = matched.group(2)
+            items.append((section, subsection, matched.group(1).lower(),
+                          'true' if value is None else _parse_config_value(value)))
+    return items
+
+
+def make_key(section, subsection, name):
+    """Return a "section[.subsection].name" key."""
+    if subsection is None:
+        return '%s.%s' % (section, name)
+    return '%s.%s.%s' % (section, subsection, name)
+
+
+def parse_config(text):
+    """
+    Parse git config file text into a {key: value} dictionary.
+
+    Keys are "section.name" or "section.subsection.name" with lowercase
+    section and variable names. The last value wins, and a variable without
+    "=" is "true". Includes are not followed (see GitConfig).
+    """
+    return dict([(make_key(section, subsection, name), value)
+                 for section, subsection, name, value in parse_config_items(text)])
+
+
+def parse_bool(value, default=None):
+    """Convert a config value to True or False, or return default if it isn't boolean."""
+    if value is None:
+        return default
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return default
+
+
+def _compile_pattern(pattern, ignore_case=False):
+    # Compile a git wildmatch pattern, where "**" crosses directories.
+    parts = []
+    position = 0
+    while position < len(pattern):
+        if pattern.startswith('**/', position):
+            parts.append('(?:.*/)?')
+            position += 3
+        elif pattern.startswith('**', position):
+            parts.append('.*')
+            position += 2
+        elif pattern[position] == '*':
+            parts.append('[^/]*')
+            position += 1
+        elif pattern[position] == '?':
+            parts.append('[^/]')
+            position += 1
+        else:
+            parts.append(re.escape(pattern[position]))
+            position += 1
+    return re.compile('^%s$' % ''.join(parts), re.IGNORECASE if ignore_case else 0)
+
+
+# Parsed files as {path: (stamp, items)}, shared by all GitConfig objects.
+_PARSED_FILES = {}
+_PARSED_FILES_LOCK = threading.Lock()
+
+
+def read_config_items(path):
+    """Return parse_config_items() results for a file, cached by its stamp, or [] if missing."""
+    stamp = file_stamp(path)
+    with _PARSED_FILES_LOCK:
+        entry = _PARSED_FILES.get(path)
+    if entry is not None and entry[0] == stamp:
+        return entry[1]
+    items = []
+    if stamp is not None:
+        try:
+            with open(path) as file_handle:
+                items = parse_config_items(file_handle.read())
+        except (IOError, OSError, UnicodeDecodeError):
+            pass
+    with _PARSED_FILES_LOCK:
+        _PARSED_FILES[path] = (stamp, items)
+    return items
+
+
+class ConfigValue(object):     #pylint: disable=too-few-public-methods
+    """Resolved value with its scope and source file path."""
+
+    __slots__ = ('value', 'scope', 'path')
+
+    def __init__(self, value, scope, path):
+        """Construct with value, scope name and file path."""
+        self.value = value
+        self.scope = scope
+        self.path = path
+
+    def __repr__(self):
+        """Display value and source."""
+        return 'ConfigValue(%r %s %s)' % (self.value, self.scope, self.path)
+
+
+class GitConfig(object):
+    """
+    Resolved git configuration for a repository, or for user scopes only.
+
+    The repository, if provided, needs git.Repository members git_dir,
+    common_dir and get_branch(). Environment variables GIT_CONFIG_SYSTEM,
+    GIT_CONFIG_NOSYSTEM, GIT_CONFIG_GLOBAL, XDG_CONFIG_HOME and HOME select
+    the files, and changing them also causes a rebuild.
+    """
+
+    # Environment variables that select configuration files.
+    environment_names = ('GIT_CONFIG_SYSTEM', 'GIT_CONFIG_NOSYSTEM', 'GIT_CONFIG_GLOBAL',
+                         'XDG_CONFIG_HOME', 'HOME')
+
+    def __init__(self, repository=None):
+        """Construct for an optional repository (see git.Repository)."""
+        self.repository = repository
+        self.builds = 0
+        # {key: [ConfigValue, ...]} in precedence order.
+        self._table = None
+        # [(path, stamp), ...] for every file that was or could have been read.
+        self._sources = []
+        self._environment = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_scope_paths(cls, scope, repository=None):
+        """Return the candidate file paths for a scope."""
+        if scope == 'system':
+            if os.environ.get('GIT_CONFIG_NOSYSTEM'):
+                return []
+            return [os.environ.get('GIT_CONFIG_SYSTEM', '/etc/gitconfig')]
+        if scope == 'global':
+            if 'GIT_CONFIG_GLOBAL' in os.environ:
+                return [os.environ['GIT_CONFIG_GLOBAL']]
+            home = os.environ.get('HOME', os.path.expanduser('~'))
+            xdg_config_home = os.environ.get('XDG_CONFIG_HOME') or os.path.join(home, '.config')
+            return [os.path.join(xdg_config_home, 'git', 'config'),
+                    os.path.join(home, '.gitconfig')]
+        if repository is None:
+            return []
+        if scope == 'local':
+            return [os.path.join(repository.common_dir, 'config')]
+        if scope == 'worktree':
+            return [os.path.join(repository.git_dir, 'config.worktree')]
+        raise ValueError('Bad config scope: %s' % scope)
+
+    def get(self, key, default=None):
+        """Return the effective value for a key, or default."""
+        values = self.get_table().get(normalize_key(key))
+        return values[-1].value if values else default
+
+    def get_all(self, key):
+        """Return all values for a multi-valued key, in precedence order."""
+        return [value.value for value in self.get_table().get(normalize_key(key), [])]
+
+    def get_bool(self, key, default=None):
+        """Return the effective value for a key as True or False, or default."""
+        return parse_bool(self.get(key), default=default)
+
+    def get_value(self, key):
+        """Return the effective ConfigValue for a key, or None."""
+        values = self.get_table().get(normalize_key(key))
+        return values[-1] if values else None
+
+    def get_section(self, section, subsection=None):
+        """Return a {name: value} dictionary of effective values in a section."""
+        prefix = '%s.%s' % (section.lower(), '%s.' % subsection if subsection else '')
+        return dict([(key[len(prefix):], values[-1].value)
+                     for key, values in self.get_table().items()
+                     if key.startswith(prefix) and '.' not in key[len(prefix):]])
+
+    def get_table(self):
+        """Return the resolved {key: [ConfigValue, ...]} table, rebuilding it if needed."""
+        environment = [os.environ.get(name) for name in self.environment_names]
+        with self._lock:
+            if (self._table is None
+                    or environment != self._environment
+                    or [path for path, stamp in self._sources if file_stamp(path) != stamp]):
+                self._build()
+                self._environment = environment
+            return self._table
+
+    def _build(self):
+        # Rebuild the table. The caller holds the lock.
+        table = {}
+        self._sources = []
+        for scope in SCOPES:
+            paths = self.get_scope_paths(scope, self.repository)
+            if scope == 'worktree' and not parse_bool(self._get_built(table,
+                                                                      'extensions.worktreeconfig')):
+                paths = []
+            for path in paths:
+                self._add_file(table, scope, path, 0)
+        self._table = table
+        self.builds += 1
+
+    @classmethod
+    def _get_built(cls, table, key):
+        values = table.get(key)
+        return values[-1].value if values else None
+
+    def _add_file(self, table, scope, path, depth):
+        # Add a file's values and follow its includes.
+        self._sources.append((path, file_stamp(path)))
+        for section, subsection, name, value in read_config_items(path):
+            key = make_key(section, subsection, name)
+            table.setdefault(key, []).append(ConfigValue(value, scope, path))
+            if name != 'path' or depth >= MAX_INCLUDE_DEPTH:
+                continue
+            if section == 'include' and subsection is None:
+                include = True
+            elif section == 'includeif' and subsection is not None:
+                include = self._check_condition(subsection, path)
+            else:
+                include = False
+            if include and value:
+                self._add_file(table, scope, self._get_include_path(value, path), depth + 1)
+
+    @classmethod
+    def _get_include_path(cls, value, including_path):
+        if value.startswith('~'):
+            return os.path.expanduser(value)
+        return os.path.join(os.path.dirname(including_path), value)
+
+    def _check_condition(self, condition, including_path):
+        # Return True if an "includeIf" condition is met.
+        if self.repository is None:
+            return False
+        kind, _, pattern = condition.partition(':')
+        if kind in ('gitdir', 'gitdir/i'):
+            if pattern.startswith('./'):
+                pattern = os.path.join(os.path.dirname(including_path), pattern[2:])
+            elif pattern.startswith('~/'):
+                pattern = os.path.expanduser(pattern)
+            elif not pattern.startswith('/'):
+                pattern = '**/' + pattern
+            if pattern.endswith('/'):
+                pattern += '**'
+            ignore_case = kind == 'gitdir/i'
+            git_dir = os.path.abspath(self.repository.git_dir)
+            return bool(_compile_pattern(pattern, ignore_case).match(git_dir)
+                        or _compile_pattern(pattern, ignore_case).match(
+                            os.path.realpath(git_dir)))
+        if kind == 'onbranch':
+            # Switching branches must rebuild the table.
+            head_path = os.path.join(self.repository.git_dir, 'HEAD')
+            self._sources.append((head_path, file_stamp(head_path)))
+            branch = self.repository.get_branch()
+            if not branch:
+                return False
+            if pattern.endswith('/'):
+                pattern += '**'
+            return bool(_compile_pattern(pattern).match(branch))
+        return False
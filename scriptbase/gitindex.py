@@ -0,0 +1,459 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Working tree status from the git index without running "git status".
+
+read_index() parses .git/index versions 2 to 4. StatusEngine compares the
+index stat data with the working tree, using a thread pool, and only hashes
+files whose stat data changed, or that were modified too close to the index
+write time to trust ("racy" entries). Hash results for changed stat data are
+remembered, so that repeated checks only examine files that changed again.
+
+Staged changes come from "git diff-index --cached". Untracked files found
+while scanning tracked directories are filtered by "git check-ignore", and
+untracked directories by "git ls-files --others", which, like "git status",
+hides directories holding only ignored files. A status check needs at most
+three short git commands.
+
+Limitations: content filters and end-of-line conversion are only honored by
+re-checking mismatched files with "git hash-object" when the repository may
+use them. Submodules are not examined.
+"""
+
+import os
+import stat
+import struct
+import hashlib
+import threading
+import concurrent.futures
+
+from .cache import file_stamp
+from .command import Command, RecordSpec
+
+
+# Index entry flags.
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE_MASK = 0x3000
+FLAG_NAME_MASK = 0x0fff
+# Extended index entry flags.
+FLAG_SKIP_WORKTREE = 0x4000
+FLAG_INTENT_TO_ADD = 0x2000
+# Index entry modes.
+MODE_SYMLINK = 0o120000
+MODE_GITLINK = 0o160000
+
+_ENTRY_STRUCT = struct.Struct('>10I')
+# NUL-delimited "-z" output fields.
+_FIELD_SPEC = RecordSpec(['value'], delimiter='\0', name='Field')
+
+# Maximum paths per git command line.
+_PATHSPEC_BATCH_SIZE = 500
+
+
+class IndexFormatError(ValueError):
+    """Exception for an unreadable index file."""
+    #pylint: disable=unnecessary-pass
+    pass
+
+
+class IndexEntry(object):     #pylint: disable=too-few-public-methods
+    """Index entry with cached stat data."""
+
+    __slots__ = ('ctime', 'mtime', 'mtime_ns', 'ino', 'mode', 'uid', 'gid', 'size',
+                 'object_id', 'stage', 'flags', 'path')
+
+    def __init__(self, fields, object_id, flags, extended_flags, path):  #pylint: disable=too-many-arguments
+        """Construct from the unpacked fixed fields, object id, flags and path."""
+        self.ctime = fields[0]
+        self.mtime = fields[2]
+        self.mtime_ns = fields[3]
+        self.ino = fields[5]
+        self.mode = fields[6]
+        self.uid = fields[7]
+        self.gid = fields[8]
+        self.size = fields[9]
+        self.object_id = object_id
+        self.stage = (flags & FLAG_STAGE_MASK) >> 12
+        self.flags = extended_flags
+        self.path = path
+
+
+class Index(object):     #pylint: disable=too-few-public-methods
+    """Parsed index file."""
+
+    def __init__(self, version, entries, mtime):
+        """Construct with version, IndexEntry list and index file mtime (seconds)."""
+        self.version = version
+        self.entries = entries
+        self.mtime = mtime
+
+
+def _decode_varint(data, offset):
+    # Decode a git offset varint, returning (value, next offset).
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, offset
+
+
+def read_index(path, object_id_size=20):
+    """Read an index file and return an Index. Raises IndexFormatError or OSError."""
+    with open(path, 'rb') as file_handle:
+        data = file_handle.read()
+        mtime = os.fstat(file_handle.fileno()).st_mtime
+    if len(data) < 12 or data[:4] != b'DIRC':
+        raise IndexFormatError('Bad index file signature: %s' % path)
+    version, count = struct.unpack_from('>II', data, 4)
+    if version not in (2, 3, 4):
+        raise IndexFormatError('Unsupported index version %d: %s' % (version, path))
+    entries = []
+    offset = 12
+    previous_path = b''
+    try:
+        for _ in range(count):
+            entry_offset = offset
+            fields = _ENTRY_STRUCT.unpack_from(data, offset)
+            offset += 40
+            object_id = data[offset:offset + object_id_size].hex()
+            offset += object_id_size
+            flags = (data[offset] << 8) | data[offset + 1]
+            offset += 2
+            extended_flags = 0
+            if flags & FLAG_EXTENDED:
+                extended_flags = (data[offset] << 8) | data[offset + 1]
+                offset += 2
+            if version == 4:
+                strip_count, offset = _decode_varint(data, offset)
+                end = data.index(b'\0', offset)
+                path_bytes = previous_path[:len(previous_path) - strip_count] + data[offset:end]
+                offset = end + 1
+                previous_path = path_bytes
+            else:
+                name_length = flags & FLAG_NAME_MASK
+                if name_length < FLAG_NAME_MASK:
+                    end = offset + name_length
+                else:
+                    end = data.index(b'\0', offset)
+                path_bytes = data[offset:end]
+                # Entries are NUL padded to a multiple of 8 bytes.
+                entry_size = (end - entry_offset + 8) & ~7
+                offset = entry_offset + entry_size
+            entries.append(IndexEntry(fields, object_id, flags, extended_flags,
+                                      os.fsdecode(path_bytes)))
+    except (struct.error, ValueError, LookupError) as exc:
+        raise IndexFormatError('Corrupt index file %s: %s' % (path, exc))
+    return Index(version, entries, mtime)
+
+
+def hash_file(path, mode, object_id_size=20):
+    """Return the git blob id of a working tree file or symlink."""
+    if stat.S_ISLNK(mode):
+        content = os.fsencode(os.readlink(path))
+    else:
+        with open(path, 'rb') as file_handle:
+            content = file_handle.read()
+    hasher = hashlib.sha1() if object_id_size == 20 else hashlib.sha256()
+    hasher.update(b'blob %d\0' % len(content))
+    hasher.update(content)
+    return hasher.hexdigest()
+
+
+def _get_git_mode(stat_result):
+    # Return the index mode corresponding to a working tree stat.
+    if stat.S_ISLNK(stat_result.st_mode):
+        return MODE_SYMLINK
+    if stat_result.st_mode & 0o100:
+        return 0o100755
+    return 0o100644
+
+
+class StatusEntry(object):     #pylint: disable=too-few-public-methods
+    """
+    Status for one path, like a "git status --porcelain" line.
+
+    index_flag and worktree_flag correspond to the "X" and "Y" status
+    characters, and are "?" for untracked paths. path2 is the new path of a
+    staged rename. modified is the working tree modification time or 0.0.
+    """
+
+    __slots__ = ('index_flag', 'worktree_flag', 'path', 'path2', 'modified')
+
+    def __init__(self, index_flag, worktree_flag, path, path2=None, modified=0.0):  #pylint: disable=too-many-arguments
+        """Construct with flags, paths and modification time."""
+        self.index_flag = index_flag
+        self.worktree_flag = worktree_flag
+        self.path = path
+        self.path2 = path2
+        self.modified = modified
+
+    @property
+    def flag(self):
+        """Combined flags without blanks, e.g. "M", "AM" or "??"."""
+        return (self.index_flag + self.worktree_flag).strip()
+
+    def __repr__(self):
+        """Display like a porcelain status line."""
+        return 'StatusEntry(%s%s %s%s)' % (self.index_flag, self.worktree_flag, self.path,
+                                           ' -> %s' % self.path2 if self.path2 else '')
+
+
+class StatusEngine(object):
+    """
+    Compute working tree status for a git.Repository.
+
+    Keep the engine for repeated checks, since it remembers the parsed index
+    and the results of hashing files with changed stat data.
+    """
+
+    def __init__(self, repository, jobs=None):
+        """Construct with a git.Repository and optional thread count (default=CPU count * 2)."""
+        self.repository = repository
+        self.jobs = jobs or (os.cpu_count() or 1) * 2
+        self.hash_count = 0
+        self._index = None
+        self._index_stamp = None
+        # {path: (stat key, object id, mode)} for files hashed after stat changes.
+        self._hashed = {}
+        self._lock = threading.Lock()
+        object_format = repository.get_config('extensions.objectformat', 'sha1')
+        self.object_id_size = 32 if object_format == 'sha256' else 20
+
+    def get_index(self):
+        """Return the parsed Index, re-reading it if the file changed."""
+        path = os.path.join(self.repository.git_dir, 'index')
+        stamp = file_stamp(path)
+        if self._index is None or stamp != self._index_stamp:
+            if stamp is None:
+                self._index = Index(2, [], 0.0)
+            else:
+                self._index = read_index(path, object_id_size=self.object_id_size)
+            self._index_stamp = stamp
+            self._hashed = {}
+        return self._index
+
+    def status(self, untracked=True):
+        """Return a StatusEntry list sorted by path."""
+        index = self.get_index()
+        directories = {}
+        conflicts = set()
+        for entry in index.entries:
+            if entry.stage:
+                conflicts.add(entry.path)
+                continue
+            directory, name = os.path.split(entry.path)
+            # Submodules and skip-worktree entries are tracked, but not compared.
+            if entry.mode == MODE_GITLINK or entry.flags & FLAG_SKIP_WORKTREE:
+                entry = None
+            directories.setdefault(directory, {})[name] = entry
+        tracked_directories = set()
+        for directory in directories:
+            while directory and directory not in tracked_directories:
+                tracked_directories.add(directory)
+                directory = os.path.dirname(directory)
+        tracked_directories.add('')
+        worktree = {}
+        candidates = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            scan_directories = set(directories.keys()) | tracked_directories
+            futures = [executor.submit(self._scan_directory, directory,
+                                       directories.get(directory, {}),
+                                       tracked_directories, untracked, index.mtime)
+                       for directory in sorted(scan_directories)]
+            for future in futures:
+                changes, directory_candidates = future.result()
+                worktree.update(changes)
+                candidates.extend(directory_candidates)
+        self._confirm_filtered(worktree)
+        staged = self._get_staged_changes(index)
+        entries = {}
+        for path, (flag, modified) in worktree.items():
+            entries[path] = StatusEntry(' ', flag, path, modified=modified)
+        for path, (flag, path2) in staged.items():
+            if path in entries:
+                entries[path].index_flag = flag
+                entries[path].path2 = path2
+            else:
+                entries[path] = StatusEntry(flag, ' ', path, path2=path2,
+                                            modified=self._get_mtime(path2 or path))
+        for path in conflicts:
+            entries[path] = StatusEntry('U', 'U', path, modified=self._get_mtime(path))
+        if untracked and candidates:
+            for path in self._filter_ignored(candidates):
+                entries[path] = StatusEntry('?', '?', path, modified=self._get_mtime(path))
+        return [entries[path] for path in sorted(entries.keys())]
+
+    def _get_mtime(self, path):
+        try:
+            return os.lstat(os.path.join(self.repository.work_tree, path)).st_mtime
+        except OSError:
+            return 0.0
+
+    def _scan_directory(self, directory, tracked, tracked_directories, untracked, index_mtime):  #pylint: disable=too-many-arguments,too-many-locals
+        # Return ({path: (flag, mtime)}, untracked candidates) for one directory.
+        changes = {}
+        candidates = []
+        remaining = dict(tracked)
+        try:
+            scanner = os.scandir(os.path.join(self.repository.work_tree, directory))
+        except OSError:
+            scanner = None
+        if scanner is not None:
+            with scanner:
+                for dir_entry in scanner:
+                    name = dir_entry.name
+                    path = os.path.join(directory, name) if directory else name
+                    if name not in remaining:
+                        if untracked and name != '.git' and path not in tracked_directories:
+                            if dir_entry.is_dir(follow_symlinks=False):
+                                if not self._is_empty_directory(dir_entry.path):
+                                    candidates.append(path + '/')
+                            else:
+                                candidates.append(path)
+                        continue
+                    entry = remaining.pop(name)
+                    if entry is None:
+                        continue
+                    try:
+                        stat_result = dir_entry.stat(follow_symlinks=False)
+                    except OSError:
+                        changes[path] = ('D', 0.0)
+                        continue
+                    if stat.S_ISDIR(stat_result.st_mode):
+                        changes[path] = ('D', 0.0)
+                        continue
+                    flag = self._check_entry(entry, dir_entry.path, stat_result, index_mtime)
+                    if flag:
+                        changes[path] = (flag, stat_result.st_mtime)
+        for name, entry in remaining.items():
+            if entry is not None:
+                changes[os.path.join(directory, name) if directory else name] = ('D', 0.0)
+        return changes, candidates
+
+    @classmethod
+    def _is_empty_directory(cls, path):
+        try:
+            with os.scandir(path) as scanner:
+                for _ in scanner:
+                    return False
+        except OSError:
+            pass
+        return True
+
+    def _check_entry(self, entry, full_path, stat_result, index_mtime):
+        # Return None if unchanged, "M" if modified or "T" if the type changed.
+        mode = _get_git_mode(stat_result)
+        if entry.flags & FLAG_INTENT_TO_ADD:
+            return 'A'
+        if (mode == MODE_SYMLINK) != (entry.mode == MODE_SYMLINK):
+            return 'T'
+        if mode != entry.mode:
+            return 'M'
+        size = stat_result.st_size & 0xffffffff
+        if size != entry.size:
+            return 'M'
+        mtime_ns = stat_result.st_mtime_ns
+        stat_matches = (int(stat_result.st_mtime) & 0xffffffff == entry.mtime
+                        and (mtime_ns % 1000000000 == entry.mtime_ns or not entry.mtime_ns)
+                        and int(stat_result.st_ctime) & 0xffffffff == entry.ctime
+                        and stat_result.st_ino & 0xffffffff == entry.ino)
+        # Files modified at or after the index write time might have changed unseen.
+        if stat_matches and stat_result.st_mtime < index_mtime:
+            return None
+        stat_key = (stat_result.st_mtime_ns, stat_result.st_ctime_ns, stat_result.st_ino,
+                    stat_result.st_size)
+        remembered = self._hashed.get(entry.path)
+        if remembered is not None and remembered[0] == stat_key and stat_result.st_mtime < index_mtime:
+            object_id = remembered[1]
+        else:
+            try:
+                object_id = hash_file(full_path, stat_result.st_mode, self.object_id_size)
+            except OSError:
+                return 'D'
+            with self._lock:
+                self.hash_count += 1
+                self._hashed[entry.path] = (stat_key, object_id)
+        return None if object_id == entry.object_id else 'M'
+
+    def _may_use_filters(self):
+        # Return True if content filters or end-of-line conversion may apply.
+        if self.repository.get_config('core.autocrlf', 'false').lower() not in ('false', 'no',
+                                                                                 'off', '0'):
+            return True
+        if os.path.exists(os.path.join(self.repository.common_dir, 'info', 'attributes')):
+            return True
+        return bool([entry for entry in self.get_index().entries
+                     if os.path.basename(entry.path) == '.gitattributes'])
+
+    def _confirm_filtered(self, worktree):
+        # Re-check content mismatches with git when filters may apply.
+        paths = sorted([path for path, (flag, _mtime) in worktree.items() if flag == 'M'])
+        if not paths or not self._may_use_filters():
+            return
+        expected = {entry.path: entry for entry in self.get_index().entries}
+        with Command('git', 'hash-object', '--stdin-paths').options(
+                cwd=self.repository.work_tree).pipe_in(paths) as cmd:
+            object_ids = cmd.read_lines()
+        for path, object_id in zip(paths, object_ids):
+            entry = expected.get(path)
+            if entry is not None and entry.object_id == object_id:
+                # Only a filter or conversion difference.
+                full_path = os.path.join(self.repository.work_tree, path)
+                if _get_git_mode(os.lstat(full_path)) == entry.mode:
+                    del worktree[path]
+
+    def _get_staged_changes(self, index):
+        # Return {path: (flag, new path)} for index changes relative to HEAD.
+        if self.repository.resolve_ref('HEAD') is None:
+            # No commits yet, so everything is added.
+            return {entry.path: ('A', None) for entry in index.entries if not entry.stage}
+        staged = {}
+        with Command('git', 'diff-index', '--cached', '-z', '--name-status', '-M',
+                     '--ignore-submodules', 'HEAD').options(
+                         cwd=self.repository.work_tree) as cmd:
+            fields = [record.value for record in cmd.records(_FIELD_SPEC)]
+        position = 0
+        while position < len(fields) - 1:
+            flag = fields[position]
+            if flag.startswith(('R', 'C')):
+                staged[fields[position + 1]] = (flag[0], fields[position + 2])
+                position += 3
+            else:
+                staged[fields[position + 1]] = (flag[0], None)
+                position += 2
+        return staged
+
+    def _filter_ignored(self, candidates):
+        # Return the candidates that aren't ignored.
+        files = [path for path in candidates if not path.endswith('/')]
+        directories = [path for path in candidates if path.endswith('/')]
+        keep = set()
+        if files:
+            with Command('git', 'check-ignore', '--stdin', '--no-index').options(
+                    cwd=self.repository.work_tree).pipe_in(files) as cmd:
+                ignored = set(cmd.read_lines())
+            keep.update([path for path in files if path not in ignored])
+        # Directories count only if they hold something that isn't ignored.
+        for start in range(0, len(directories), _PATHSPEC_BATCH_SIZE):
+            with Command('git', '--literal-pathspecs', 'ls-files', '-z', '--others',
+                         '--exclude-standard', '--directory', '--no-empty-directory', '--',
+                         *directories[start:start + _PATHSPEC_BATCH_SIZE]).options(
+                             cwd=self.repository.work_tree) as cmd:
+                keep.update([record.value for record in cmd.records(_FIELD_SPEC)])
+        return [path for path in candidates if path in keep]
@@ -0,0 +1,256 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Resource accounting and timing for external commands.
+
+Every command started through a command.ExternalCommandHandler, i.e. by
+Command, Pipeline, Runner and Batch, produces a CommandRecord with wall time,
+process start-up (spawn) time, child CPU time, peak RSS, bytes read from
+stdout, exit code, and timeout or cancellation reason, when recording is
+enabled or hooks are registered.
+
+Example:
+
+from scriptbase import instrument
+
+instrument.enable()
+instrument.add_hook(lambda event, record: print(event, record.command))
+... run commands ...
+instrument.report(top=10)
+"""
+
+import sys
+import os
+import time
+import json
+import threading
+from collections import deque
+
+from . import console
+from . import process
+
+
+class CommandRecord(object):     #pylint: disable=too-many-instance-attributes
+    """
+    Timing and resource usage for one external command.
+
+    The add_*() methods are thread-safe, e.g. for pipeline stages that are
+    reaped concurrently.
+    """
+
+    def __init__(self, kind, command):
+        """Construct with handler kind and command text."""
+        self.kind = kind
+        self.command = command
+        self.thread_id = threading.get_ident()
+        self.start_time = time.time()
+        self.end_time = None
+        self.spawn_time = None
+        self.user_time = None
+        self.system_time = None
+        self.max_rss = None
+        self.bytes_read = None
+        self.return_code = None
+        self.expired = None
+        self._lock = threading.Lock()
+
+    @property
+    def wall_time(self):
+        """Elapsed seconds or None if not finished."""
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def add_rusage(self, rusage):
+        """Accumulate resource usage from os.wait4() or resource.getrusage()."""
+        # Linux reports kilobytes and MacOS reports bytes.
+        max_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        with self._lock:
+            self.user_time = (self.user_time or 0.0) + rusage.ru_utime
+            self.system_time = (self.system_time or 0.0) + rusage.ru_stime
+            self.max_rss = max(self.max_rss or 0, max_rss)
+
+    def add_spawn_time(self, seconds):
+        """Accumulate process start-up time."""
+        with self._lock:
+            self.spawn_time = (self.spawn_time or 0.0) + seconds
+
+    def add_bytes_read(self, byte_count):
+        """Accumulate bytes read from the command output."""
+        with self._lock:
+            self.bytes_read = (self.bytes_read or 0) + byte_count
+
+    def to_dict(self):
+        """Return JSON-compatible data."""
+        return dict(kind=self.kind,
+                    command=self.command,
+                    start_time=self.start_time,
+                    wall_time=self.wall_time,
+                    spawn_time=self.spawn_time,
+                    user_time=self.user_time,
+                    system_time=self.system_time,
+                    max_rss=self.max_rss,
+                    bytes_read=self.bytes_read,
+                    return_code=self.return_code,
+                    expired=self.expired)
+
+
+class Recorder(object):
+    """Collects CommandRecord objects and calls event hooks."""
+
+    def __init__(self, max_records=10000):
+        """Construct with a limit on retained records."""
+        self.enabled = False
+        self.records = deque(maxlen=max_records)
+        self.hooks = []
+        self._lock = threading.Lock()
+
+    def is_active(self):
+        """Return True if records are needed for saving or hooks."""
+        return self.enabled or bool(self.hooks)
+
+    def start(self, kind, command):
+        """Return a new CommandRecord, or None if inactive, and fire "start" hooks."""
+        if not self.is_active():
+            return None
+        record = CommandRecord(kind, command)
+        self._fire('start', record)
+        return record
+
+    def finish(self, record, return_code=None):
+        """Complete a record, save it if enabled, and fire "finish" hooks."""
+        if record is None or record.end_time is not None:
+            return
+        record.end_time = time.time()
+        if return_code is not None:
+            record.return_code = return_code
+        if self.enabled:
+            with self._lock:
+                self.records.append(record)
+        self._fire('finish', record)
+
+    def clear(self):
+        """Discard saved records."""
+        with self._lock:
+            self.records.clear()
+
+    def summary_lines(self, top=10):
+        """Return summary report lines with totals and the slowest commands."""
+        with self._lock:
+            records = list(self.records)
+        def _total(name):
+            return sum([getattr(record, name) or 0 for record in records])
+        lines = [
+            'commands: %d' % len(records),
+            'wall time: %.3f s' % _total('wall_time'),
+            'spawn overhead: %.3f s' % _total('spawn_time'),
+            'child CPU: %.3f s user, %.3f s system' % (_total('user_time'),
+                                                       _total('system_time')),
+            'bytes read: %d' % _total('bytes_read'),
+            'failures: %d' % len([record for record in records
+                                  if record.return_code not in (None, 0)]),
+            'expired: %d' % len([record for record in records if record.expired]),
+        ]
+        slowest = sorted(records, key=lambda record: record.wall_time or 0, reverse=True)[:top]
+        if slowest:
+            lines.append('slowest commands:')
+            for record in slowest:
+                lines.append('  %8.3f s  rc=%s  rss=%s  %s' % (
+                    record.wall_time or 0,
+                    record.return_code,
+                    '%.1fMB' % (record.max_rss / 1000000.0) if record.max_rss else '-',
+                    record.command))
+        return lines
+
+    def _fire(self, event, record):
+        for hook in list(self.hooks):
+            try:
+                hook(event, record)
+            except Exception as exc:    #pylint: disable=broad-except
+                console.error('Instrumentation hook failed.', exc)
+
+
+# Global recorder used by command.ExternalCommandHandler.
+RECORDER = Recorder()
+
+
+def enable(enabled=True):
+    """Enable or disable saving CommandRecord objects."""
+    RECORDER.enabled = enabled
+
+
+def add_hook(hook):
+    """Add hook(event, record) function called for "start" and "finish" events."""
+    RECORDER.hooks.append(hook)
+
+
+def remove_hook(hook):
+    """Remove a hook function."""
+    if hook in RECORDER.hooks:
+        RECORDER.hooks.remove(hook)
+
+
+def report(top=10):
+    """Display a summary report."""
+    console.info('=== Command summary ===', RECORDER.summary_lines(top=top))
+
+
+def save_records(path):
+    """Append saved records to a JSON lines history file, e.g. for plan estimates."""
+    with RECORDER._lock:     #pylint: disable=protected-access
+        records = list(RECORDER.records)
+    with open(path, 'a') as file_handle:
+        for record in records:
+            file_handle.write(json.dumps(record.to_dict()))
+            file_handle.write('\n')
+
+
+def load_records(path):
+    """Return record dictionaries from a history file, skipping bad lines."""
+    records = []
+    with open(path) as file_handle:
+        for line in file_handle:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                pass
+    return records
+
+
+def popen(record, *args, **kwargs):
+    """Start a subprocess.Popen process with process.launch(), recording the spawn time."""
+    start_time = time.time()
+    child = process.launch(*args, **kwargs)
+    if record is not None:
+        record.add_spawn_time(time.time() - start_time)
+    return child
+
+
+def wait_process(child, record=None):
+    """Wait for a process, recording its resource usage, and return the return code."""
+    if record is None or child.returncode is not None or not hasattr(os, 'wait4'):
+        return_code = child.wait()
+    else:
+        try:
+            status, rusage = os.wait4(child.pid, 0)[1:]
+            child.returncode = os.waitstatus_to_exitcode(status)
+            record.add_rusage(rusage)
+        except ChildProcessError:
+            # Someone else reaped it.
+            child.wait()
+        return_code = child.returncode
+    if record is not None:
+        record.return_code = return_code
+    return return_code
@@ -0,0 +1,292 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Dry-run execution plans with estimated cost.
+
+While recording is active, dry-run commands from command.ExternalCommandHandler
+sub-classes, i.e. Command, Pipeline, Runner and Batch, are captured as plan
+steps with expanded command text, working directory and dependencies,
+instead of only being displayed.
+
+Steps normally depend on the previous step. Runner.map() items form a
+parallel group with a "jobs" limit, where each item depends on the step
+before the group, and the next step depends on all of the items.
+
+Saved plans include estimates based on a timing history, i.e. a log of
+instrumentation records saved by instrument.save_records(): the serial
+total, the critical path with unlimited parallelism, and the time with the
+recorded (or an overridden) "jobs" limit.
+
+Example:
+
+from scriptbase import plan
+
+plan.start()
+... run commands with dry_run=True ...
+plan.save('/tmp/plan.json', history=plan.TimingHistory.load('/tmp/history.jsonl'))
+"""
+
+import os
+import json
+import heapq
+import threading
+from contextlib import contextmanager
+
+from . import instrument
+
+
+class PlanStep(object):
+    """One would-be command."""
+
+    def __init__(self, step_id, kind, command, cwd, depends_on, group):   #pylint: disable=too-many-arguments
+        """Construct with id, kind, command text, directory, dependency ids and group id."""
+        self.step_id = step_id
+        self.kind = kind
+        self.command = command
+        self.cwd = cwd
+        self.depends_on = depends_on
+        self.group = group
+
+    def to_dict(self):
+        """Return JSON-compatible data."""
+        return dict(id=self.step_id,
+                    kind=self.kind,
+                    command=self.command,
+                    cwd=self.cwd,
+                    depends_on=self.depends_on,
+                    group=self.group)
+
+
+class PlanGroup(object):
+    """Steps that may run in parallel."""
+
+    def __init__(self, group_id, jobs):
+        """Construct with id and maximum parallel jobs."""
+        self.group_id = group_id
+        self.jobs = jobs
+        self.step_ids = []
+
+    def to_dict(self):
+        """Return JSON-compatible data."""
+        return dict(id=self.group_id, jobs=self.jobs, steps=self.step_ids)
+
+
+class TimingHistory(object):
+    """Historical command wall times used for estimates."""
+
+    def __init__(self, records=None):
+        """Construct with instrumentation record dictionaries."""
+        self._by_command = {}
+        self._by_program = {}
+        for record in records or []:
+            wall_time = record.get('wall_time')
+            if wall_time is None or not record.get('command'):
+                continue
+            self._by_command.setdefault(record['command'], []).append(wall_time)
+            self._by_program.setdefault(self.get_program(record['command']), []).append(wall_time)
+
+    @classmethod
+    def load(cls, path):
+        """Load a history saved by instrument.save_records()."""
+        return cls(instrument.load_records(path))
+
+    @classmethod
+    def get_program(cls, command):
+        """Return the program name of a command line."""
+        words = command.split()
+        return os.path.basename(words[0]) if words else ''
+
+    def estimate(self, step):
+        """Return mean seconds for a step, or None if unknown."""
+        if step.kind == 'builtin':
+            return 0.0
+        times = (self._by_command.get(step.command)
+                 or self._by_program.get(self.get_program(step.command)))
+        if not times:
+            return None
+        return sum(times) / len(times)
+
+
+class PlanRecorder(object):
+    """Collects plan steps."""
+
+    def __init__(self):
+        """Construct an empty plan."""
+        self.steps = []
+        self.groups = []
+        self._frontier = []
+        self._group = None
+        self._group_frontier = None
+        self._lock = threading.Lock()
+
+    def add_step(self, kind, command, cwd=None):
+        """Add a step that depends on the preceding step or group."""
+        with self._lock:
+            step_id = len(self.steps)
+            group_id = None
+            if self._group is not None:
+                group_id = self._group.group_id
+                self._group.step_ids.append(step_id)
+                depends_on = list(self._group_frontier)
+            else:
+                depends_on = list(self._frontier)
+                self._frontier = [step_id]
+            self.steps.append(PlanStep(step_id, kind, command, cwd or os.getcwd(),
+                                       depends_on, group_id))
+
+    @contextmanager
+    def parallel(self, jobs):
+        """Add steps in a "with" block to a parallel group with a jobs limit."""
+        with self._lock:
+            # Nested groups join the outer one.
+            if self._group is not None:
+                nested = True
+            else:
+                nested = False
+                self._group = PlanGroup(len(self.groups), jobs)
+                self._group_frontier = self._frontier
+        try:
+            yield
+        finally:
+            if not nested:
+                with self._lock:
+                    if self._group.step_ids:
+                        self.groups.append(self._group)
+                        self._frontier = list(self._group.step_ids)
+                    self._group = None
+                    self._group_frontier = None
+
+    def estimate(self, history, jobs=None):
+        """
+        Return an estimate dictionary based on a TimingHistory.
+
+        Steps without history use the mean of the known estimates. The jobs
+        argument overrides parallel group limits.
+
+        Keys:
+            serial_seconds         total time without parallelism
+            critical_path_seconds  time with unlimited parallelism
+            estimated_seconds      time with the group (or overridden) jobs limits
+            critical_path          step ids on the critical path
+            unknown_steps          step ids without history
+        """
+        durations = [history.estimate(step) for step in self.steps]
+        known = [duration for duration in durations if duration is not None]
+        default_duration = sum(known) / len(known) if known else 0.0
+        unknown_steps = [step.step_id for step in self.steps if durations[step.step_id] is None]
+        durations = [default_duration if duration is None else duration
+                     for duration in durations]
+        # Steps are in dependency order, so one pass finds the longest paths.
+        finish_times = []
+        previous = []
+        for step in self.steps:
+            start_time = 0.0
+            previous_id = None
+            for dependency in step.depends_on:
+                if finish_times[dependency] >= start_time:
+                    start_time = finish_times[dependency]
+                    previous_id = dependency
+            finish_times.append(start_time + durations[step.step_id])
+            previous.append(previous_id)
+        critical_path = []
+        if finish_times:
+            step_id = max(range(len(finish_times)), key=lambda index: finish_times[index])
+            while step_id is not None:
+                critical_path.insert(0, step_id)
+                step_id = previous[step_id]
+        # Serial steps and groups run one after another.
+        estimated_seconds = 0.0
+        groups = {group.group_id: group for group in self.groups}
+        done_groups = set()
+        for step in self.steps:
+            if step.group is None:
+                estimated_seconds += durations[step.step_id]
+            elif step.group not in done_groups:
+                done_groups.add(step.group)
+                group = groups[step.group]
+                estimated_seconds += self._get_makespan(
+                    [durations[step_id] for step_id in group.step_ids],
+                    jobs or group.jobs)
+        return dict(serial_seconds=sum(durations),
+                    critical_path_seconds=max(finish_times) if finish_times else 0.0,
+                    estimated_seconds=estimated_seconds,
+                    critical_path=critical_path,
+                    unknown_steps=unknown_steps)
+
+    @classmethod
+    def _get_makespan(cls, durations, jobs):
+        # Simulate starting each item in order on the first free worker.
+        workers = [0.0] * max(min(jobs or 1, len(durations)), 1)
+        for duration in durations:
+            heapq.heappush(workers, heapq.heappop(workers) + duration)
+        return max(workers)
+
+    def to_dict(self, history=None, jobs=None):
+        """Return JSON-compatible plan data, with an estimate if history is provided."""
+        with self._lock:
+            data = dict(steps=[step.to_dict() for step in self.steps],
+                        groups=[group.to_dict() for group in self.groups])
+        if history is not None:
+            data['estimate'] = self.estimate(history, jobs=jobs)
+        return data
+
+    def save(self, path, history=None, jobs=None):
+        """Save the plan as JSON."""
+        with open(path, 'w') as file_handle:
+            json.dump(self.to_dict(history=history, jobs=jobs), file_handle, indent=2)
+
+
+# Active recorder, if recording was started.
+RECORDER = None
+
+
+def start():
+    """Start recording dry-run commands."""
+    global RECORDER     #pylint: disable=global-statement
+    if RECORDER is None:
+        RECORDER = PlanRecorder()
+    return RECORDER
+
+
+def stop():
+    """Stop recording and return the recorder, if any."""
+    global RECORDER     #pylint: disable=global-statement
+    recorder = RECORDER
+    RECORDER = None
+    return recorder
+
+
+def save(path, history=None, jobs=None):
+    """Stop recording and save the plan, if started."""
+    recorder = stop()
+    if recorder is not None:
+        recorder.save(path, history=history, jobs=jobs)
+
+
+def add_step(kind, command, cwd=None):
+    """Add a step if recording was started."""
+    if RECORDER is not None:
+        RECORDER.add_step(kind, command, cwd=cwd)
+
+
+@contextmanager
+def parallel(jobs):
+    """Group steps in a "with" block if recording was started."""
+    if RECORDER is None:
+        yield
+    else:
+        with RECORDER.parallel(jobs):
+            yield
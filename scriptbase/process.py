@@ -0,0 +1,249 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Child process launching and control, i.e. fast spawning, timeouts and cancellation.
+
+launch() is a drop-in replacement for subprocess.Popen() that avoids fork()
+where possible. Large parent processes pay for fork() page table copying on
+every spawn. Popen() uses posix_spawn() when given an absolute executable
+path, close_fds=False, and no cwd, session or preexec options, and otherwise
+vfork() on Linux when there is no preexec_fn. launch() meets the posix_spawn()
+conditions when the options allow, and runs simple shell command lines, i.e.
+without shell syntax, directly instead of through /bin/sh. Python file
+descriptors are not inheritable by default (PEP 446), so close_fds=False does
+not leak them.
+
+Processes that may need to be stopped are started in their own process group
+(session), so that killing them also kills anything they started, e.g. the
+commands run by a shell. Stopping sends SIGTERM to the group, and then
+SIGKILL if it hasn't finished after a grace period.
+
+Note that processes in their own session don't receive keyboard interrupts
+from the terminal. The command module kills them when an exception, e.g.
+KeyboardInterrupt, ends the "with" block or call that owns them.
+"""
+
+import os
+import time
+import shlex
+import shutil
+import signal
+import threading
+import subprocess
+
+
+# Seconds between SIGTERM and SIGKILL.
+KILL_GRACE = 2.0
+# Seconds between timeout and cancellation checks.
+POLL_INTERVAL = 0.05
+# Set to False to make launch() use plain subprocess.Popen() behavior.
+FAST_SPAWN = True
+# Characters that require a shell to interpret a command line.
+SHELL_CHARACTERS = frozenset('|&;<>()$`\\*?[]{}#~\n\r')
+# Commands that must run in a shell, even if an executable by that name exists.
+SHELL_BUILTINS = frozenset([
+    '.', ':', 'alias', 'break', 'cd', 'command', 'continue', 'eval', 'exec', 'exit',
+    'export', 'hash', 'local', 'read', 'readonly', 'return', 'set', 'shift', 'source',
+    'times', 'trap', 'type', 'ulimit', 'umask', 'unalias', 'unset', 'wait',
+])
+# Popen() options that rule out posix_spawn().
+_NO_SPAWN_OPTIONS = ('cwd', 'preexec_fn', 'pass_fds', 'start_new_session', 'executable',
+                     'user', 'group', 'extra_groups', 'umask', 'process_group')
+# Memoized executable paths keyed by (name, PATH).
+_EXECUTABLE_PATHS = {}
+
+
+def split_simple_command(cmd_line):
+    """Return arguments for a shell command line without shell syntax, or None."""
+    if not cmd_line or SHELL_CHARACTERS.intersection(cmd_line):
+        return None
+    try:
+        args = shlex.split(cmd_line)
+    except ValueError:
+        return None
+    if not args or args[0] in SHELL_BUILTINS or '=' in args[0]:
+        return None
+    return args
+
+
+def _find_executable(name, search_path):
+    # Return a memoized absolute executable path or None.
+    key = (name, search_path)
+    executable_path = _EXECUTABLE_PATHS.get(key)
+    if executable_path is None or not os.path.exists(executable_path):
+        executable_path = shutil.which(name, path=search_path)
+        if executable_path is None:
+            return None
+        executable_path = os.path.abspath(executable_path)
+        _EXECUTABLE_PATHS[key] = executable_path
+    return executable_path
+
+
+def _get_fast_spawn_arguments(args, kwargs):
+    # Return adjusted Popen() arguments for the fastest equivalent launch.
+    kwargs = dict(kwargs)
+    environment = kwargs.get('env') or os.environ
+    search_path = environment.get('PATH', os.defpath)
+    if kwargs.get('shell') and isinstance(args, str) and not kwargs.get('executable'):
+        simple_args = split_simple_command(args)
+        # Keep the shell if the program is missing so that it reports the error.
+        if simple_args and _find_executable(simple_args[0], search_path):
+            args = simple_args
+            kwargs['shell'] = False
+    if kwargs.get('shell') or [name for name in _NO_SPAWN_OPTIONS if kwargs.get(name)]:
+        return args, kwargs
+    program = args if isinstance(args, (str, bytes)) else args[0]
+    if not isinstance(program, str):
+        return args, kwargs
+    if os.sep not in program:
+        executable_path = _find_executable(program, search_path)
+        if executable_path is None:
+            # Let Popen() raise the usual exception.
+            return args, kwargs
+        kwargs['executable'] = executable_path
+    if 'close_fds' not in kwargs:
+        kwargs['close_fds'] = False
+    return args, kwargs
+
+
+def launch(args, **kwargs):
+    """
+    Start a process with subprocess.Popen() arguments using the fastest equivalent method.
+
+    See the module documentation for details.
+    """
+    if FAST_SPAWN:
+        args, kwargs = _get_fast_spawn_arguments(args, kwargs)
+    return subprocess.Popen(args, **kwargs)
+
+
+class CancellationToken(object):
+    """Thread-safe cancellation flag that can be shared by cooperating runners."""
+
+    def __init__(self):
+        """Construct an uncancelled token."""
+        self.reason = None
+        self._event = threading.Event()
+
+    def cancel(self, reason=None):
+        """Cancel everything watching this token."""
+        self.reason = reason
+        self._event.set()
+
+    def is_cancelled(self):
+        """Return True if cancelled."""
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """Wait for cancellation and return True if cancelled."""
+        return self._event.wait(timeout)
+
+
+class Expired(Exception):
+    """Exception for a process stopped due to a timeout or cancellation."""
+
+    def __init__(self, reason, return_code):
+        """Construct with reason text and the return code of the stopped process."""
+        Exception.__init__(self, reason)
+        self.reason = reason
+        self.return_code = return_code
+
+
+def kill_process_group(process, finished=None, grace=KILL_GRACE):
+    """
+    Stop a process and its process group with SIGTERM followed by SIGKILL.
+
+    The finished event, if provided, is set by the process owner once it has
+    reaped the process, and cuts the grace period short.
+    """
+    def _signal(signal_number):
+        try:
+            os.killpg(process.pid, signal_number)
+        except (IOError, OSError):
+            pass
+    _signal(signal.SIGTERM)
+    if finished is not None:
+        if finished.wait(grace):
+            return
+    else:
+        deadline = time.time() + grace
+        while process.poll() is None and time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+    _signal(signal.SIGKILL)
+
+
+class Watchdog(object):
+    """
+    Stop a process group when a timeout expires or a token is cancelled.
+
+    The process must have been started with start_new_session=True. Call
+    stop() after the process has been reaped and check the "reason" member,
+    which is None unless the process was stopped.
+    """
+
+    def __init__(self, process, timeout=None, cancel=None, grace=KILL_GRACE):
+        """Construct with process, timeout seconds, CancellationToken and kill grace period."""
+        self.process = process
+        self.timeout = timeout
+        self.cancel = cancel
+        self.grace = grace
+        self.reason = None
+        self._finished = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def is_needed(cls, timeout, cancel):
+        """Return True if a timeout or cancellation token requires a watchdog."""
+        return timeout is not None or cancel is not None
+
+    def start(self):
+        """Start watching. Returns self for chaining."""
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop watching after the process has been reaped and return the reason, if any."""
+        self._finished.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        return self.reason
+
+    def kill(self, reason):
+        """Stop the process now, e.g. when the owner is aborting."""
+        if not self._finished.is_set():
+            self.reason = reason
+            kill_process_group(self.process, finished=self._finished, grace=0)
+
+    def _watch(self):
+        deadline = time.time() + self.timeout if self.timeout is not None else None
+        while not self._finished.is_set():
+            if self.cancel is not None and self.cancel.is_cancelled():
+                self.reason = 'cancelled'
+                if self.cancel.reason:
+                    self.reason = 'cancelled (%s)' % self.cancel.reason
+                break
+            if deadline is not None and time.time() >= deadline:
+                self.reason = 'timed out after %g seconds' % self.timeout
+                break
+            wait_time = POLL_INTERVAL
+            if deadline is not None:
+                wait_time = min(wait_time, max(deadline - time.time(), 0))
+            self._finished.wait(wait_time)
+        else:
+            return
+        kill_process_group(self.process, finished=self._finished, grace=self.grace)
@@ -16,8 +16,16 @@
 
 import sys
 import os
+import subprocess
+import threading
+import uuid
 
 from .utility import shlex_quote, is_string
+from . import process
+
+
+# find_executable() results keyed by (PATH, names).
+_FOUND_EXECUTABLES = {}
 
 
 def quote_argument(arg):
@@ -56,12 +64,21 @@ def find_executable(*names):
     If multiple names are specified return the first one found in the path.
 
     Return path to first name found in PATH.
+
+    Found paths are remembered for the same PATH and names, as long as they
+    still exist.
     """
     env_path = os.environ['PATH']
+    cache_key = (env_path, names)
+    found_path = _FOUND_EXECUTABLES.get(cache_key)
+    if found_path and os.path.exists(found_path):
+        return found_path
     for name in names:
         path = find_in_path(env_path, name, executable=True)
         if path:
-            return os.path.realpath(path)
+            found_path = os.path.realpath(path)
+            _FOUND_EXECUTABLES[cache_key] = found_path
+            return found_path
     return None
 
 
@@ -101,3 +118,140 @@ def relative_path(from_path, to_path):
         if from_path.startswith(''.join([to_path, os.path.sep])):
             return os.path.sep.join(('..',) * (from_path[len(to_path):].count(os.path.sep)))
     return to_path
+
+
+class ShellSession(object):
+    """
+    Persistent shell coprocess for running many commands without a fork each.
+
+    Commands are written to a long-lived shell's stdin and a sentinel marker
+    line after each one provides the return code and delimits its output.
+    Working directory changes and exported variables persist across commands.
+
+    Commands are run through "eval" so that syntax errors are reported as
+    normal failures. Their stdin is /dev/null and stderr is merged with stdout.
+
+    If the shell dies, e.g. due to an "exit" command, the next command starts
+    a fresh one, without the previous state. A command stopped by a timeout or
+    cancellation kills the shell, and therefore also loses the state.
+    """
+
+    class Result(object):
+        """Command result with return code, output lines and expiration reason."""
+
+        def __init__(self, return_code, output_lines, expired=None):
+            """Construct with return code, output lines and optional expiration reason."""
+            self.return_code = return_code
+            self.output_lines = output_lines
+            self.expired = expired
+
+    def __init__(self, program='bash', directory=None, env=None):
+        """Construct with shell program and optional initial directory and environment."""
+        self.program = program
+        self.directory = directory
+        self.env = env
+        self.process = None
+        self.restarts = 0
+        self._marker = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        """Start the shell at the beginning of a "with" block."""
+        self.start()
+        return self
+
+    def __exit__(self, exit_type, exit_value, exit_traceback):
+        """Stop the shell at the end of a "with" block."""
+        self.stop()
+
+    def is_running(self):
+        """Return True if the shell process is alive."""
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Start the shell process if it isn't running."""
+        if self.is_running():
+            return
+        if self.process is not None:
+            self.restarts += 1
+        self._marker = '__scriptbase_shell_%s__' % uuid.uuid4().hex
+        self.process = subprocess.Popen(
+            [self.program],
+            cwd=self.directory,
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            # Own process group so that a timeout can stop running commands.
+            start_new_session=True,
+        )
+
+    def stop(self):
+        """Stop the shell process and return its exit code."""
+        if self.process is None:
+            return None
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.write(b'exit\n')
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+        self.process.stdout.close()
+        return_code = self.process.wait()
+        self.process = None
+        return return_code
+
+    def run(self, cmd_line, output_handler=None, timeout=None, cancel=None):
+        """
+        Run a command line in the shell and return a Result object.
+
+        Output lines are passed to output_handler, if provided, as they arrive
+        instead of being collected in the Result.
+
+        The shell is killed after timeout seconds, if specified, or when the
+        process.CancellationToken cancel, if specified, is cancelled. The
+        Result "expired" member then has the reason.
+        """
+        with self._lock:
+            self.start()
+            watchdog = None
+            if process.Watchdog.is_needed(timeout, cancel):
+                watchdog = process.Watchdog(self.process, timeout=timeout, cancel=cancel).start()
+            try:
+                result = self._run(cmd_line, output_handler)
+            except:
+                if watchdog:
+                    watchdog.kill('interrupted')
+                raise
+            finally:
+                if watchdog and watchdog.stop():
+                    self.process.wait()
+            if watchdog and watchdog.reason:
+                result.expired = watchdog.reason
+            return result
+
+    def _run(self, cmd_line, output_handler):
+        marker = self._marker.encode()
+        script = 'eval %s </dev/null 2>&1; printf \'%%s %%d\\n\' %s $?\n' % (
+            shlex_quote(cmd_line), self._marker)
+        output_lines = []
+        def _output(line):
+            if output_handler:
+                output_handler(line)
+            else:
+                output_lines.append(line)
+        try:
+            self.process.stdin.write(script.encode())
+            self.process.stdin.flush()
+        except (IOError, OSError):
+            return ShellSession.Result(self.process.wait() or 255, output_lines)
+        for line in iter(self.process.stdout.readline, b''):
+            position = line.find(marker)
+            if position >= 0:
+                if position > 0:
+                    _output(line[:position].decode('utf8', 'replace'))
+                return_code = int(line[position + len(marker):].strip())
+                return ShellSession.Result(return_code, output_lines)
+            _output(line.decode('utf8', 'replace').rstrip('\r\n'))
+        # The shell exited before writing the marker, e.g. due to "exit".
+        return ShellSession.Result(self.process.wait(), output_lines)
@@ -0,0 +1,109 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Compiled string templates for Runner.expand().
+
+Templates use both str.format() "{name}" fields and "%(name)s" directives.
+Compiling parses a template once, converting simple "{name}" fields to
+"%(name)s" directives so that rendering is a single "%" operation. Fields
+with attributes, indexes, conversions or format specifications are
+formatted individually and merged in.
+
+Unlike the format() followed by "%" sequence it replaces, substituted
+values are not expanded a second time, so values containing "%" are safe.
+"""
+
+import re
+import string
+from collections import ChainMap
+from functools import lru_cache
+
+
+# Matches "%%" or a "%(name)" mapping key.
+_PERCENT_KEY_REGEX = re.compile(r'%%|%\(([^)]*)\)')
+# Prefix for generated keys holding individually formatted fields.
+_FIELD_KEY_PREFIX = '\0field'
+
+
+class TemplateError(ValueError):
+    """Exception for a template that can't be compiled."""
+    #pylint: disable=unnecessary-pass
+    pass
+
+
+class Template(object):
+    """Compiled template."""
+
+    _formatter = string.Formatter()
+
+    def __init__(self, text):
+        """Compile template text. Raises TemplateError for bad syntax."""
+        self.text = text
+        self.symbols = set()
+        self._fields = []
+        parts = []
+        try:
+            parsed = list(self._formatter.parse(text))
+        except ValueError as exc:
+            raise TemplateError(str(exc))
+        for literal, field_name, format_spec, conversion in parsed:
+            parts.append(literal)
+            self.symbols.update([match.group(1)
+                                 for match in _PERCENT_KEY_REGEX.finditer(literal)
+                                 if match.group(1) is not None])
+            if field_name is None:
+                continue
+            symbol = re.split(r'[.\[]', field_name, 1)[0]
+            if not symbol or symbol.isdigit():
+                raise TemplateError('Positional field "{%s}" is not supported.' % field_name)
+            self.symbols.add(symbol)
+            if field_name == symbol and not format_spec and not conversion:
+                parts.append('%%(%s)s' % symbol)
+            else:
+                key = '%s%d' % (_FIELD_KEY_PREFIX, len(self._fields))
+                self._fields.append((key, field_name, format_spec, conversion))
+                parts.append('%%(%s)s' % key)
+        self._percent_template = ''.join(parts)
+        # Avoid the "%" operation for plain text.
+        self._is_constant = '%' not in self._percent_template
+
+    def render(self, symbols):
+        """
+        Render with a symbol dictionary.
+
+        Raises KeyError for unknown symbols and ValueError or TypeError for
+        bad "%" directives or values.
+        """
+        if self._is_constant:
+            return self._percent_template
+        if self._fields:
+            fields = {}
+            for key, field_name, format_spec, conversion in self._fields:
+                value = self._formatter.get_field(field_name, (), symbols)[0]
+                value = self._formatter.convert_field(value, conversion)
+                fields[key] = self._formatter.format_field(value, format_spec or '')
+            symbols = ChainMap(fields, symbols)
+        return self._percent_template % symbols
+
+    def get_missing_symbols(self, symbols):
+        """Return a sorted list of template symbols missing from a symbol dictionary."""
+        return sorted([symbol for symbol in self.symbols if symbol not in symbols])
+
+
+@lru_cache(maxsize=1024)
+def compile_template(text):
+    """Return a cached compiled Template. Raises TemplateError for bad syntax."""
+    return Template(text)
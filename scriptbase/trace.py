@@ -0,0 +1,142 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Timeline tracing in Chrome trace-event JSON format.
+
+Load saved files in chrome://tracing or https://ui.perfetto.dev to see which
+commands overlapped and where time was spent. Spans on the same thread nest
+by time.
+
+External commands are traced through instrument module hooks. Other code
+marks spans with the span() context manager, which does nothing unless
+tracing was started.
+
+Example:
+
+from scriptbase import trace
+
+trace.start()
+with trace.span('load data'):
+    ...
+trace.save('/tmp/trace.json')
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+from . import instrument
+
+
+class TraceRecorder(object):
+    """Collects trace events."""
+
+    def __init__(self):
+        """Construct an empty trace."""
+        self.events = []
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, category, start_time, end_time, thread_id=None, args=None):   #pylint: disable=too-many-arguments
+        """Add a complete ("X") event with times from time.time()."""
+        event = dict(
+            name=name,
+            cat=category,
+            ph='X',
+            ts=int(start_time * 1000000),
+            dur=int(max(end_time - start_time, 0) * 1000000),
+            pid=self.pid,
+            tid=thread_id if thread_id is not None else threading.get_ident(),
+        )
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, category='scriptbase', **args):
+        """Record a span for the duration of a "with" block."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(name, category, start_time, time.time(), args=args)
+
+    def on_command_event(self, event, record):
+        """Instrumentation hook adding spans for finished commands."""
+        if event == 'finish':
+            self.add_span(record.command,
+                          record.kind,
+                          record.start_time,
+                          record.end_time,
+                          thread_id=record.thread_id,
+                          args=dict(return_code=record.return_code,
+                                    spawn_time=record.spawn_time,
+                                    user_time=record.user_time,
+                                    system_time=record.system_time,
+                                    max_rss=record.max_rss,
+                                    bytes_read=record.bytes_read))
+
+    def save(self, path):
+        """Save the trace as JSON."""
+        with self._lock:
+            events = sorted(self.events, key=lambda event: event['ts'])
+        thread_names = [dict(name='thread_name', ph='M', pid=self.pid, tid=thread.ident,
+                             args=dict(name=thread.name))
+                        for thread in threading.enumerate()]
+        with open(path, 'w') as file_handle:
+            json.dump(dict(traceEvents=thread_names + events, displayTimeUnit='ms'), file_handle)
+
+
+# Active recorder, if tracing was started.
+RECORDER = None
+
+
+def start():
+    """Start tracing, including external commands."""
+    global RECORDER     #pylint: disable=global-statement
+    if RECORDER is None:
+        RECORDER = TraceRecorder()
+        instrument.add_hook(RECORDER.on_command_event)
+    return RECORDER
+
+
+def stop():
+    """Stop tracing and return the recorder, if any."""
+    global RECORDER     #pylint: disable=global-statement
+    recorder = RECORDER
+    if recorder is not None:
+        instrument.remove_hook(recorder.on_command_event)
+        RECORDER = None
+    return recorder
+
+
+def save(path):
+    """Stop tracing and save the trace, if started."""
+    recorder = stop()
+    if recorder is not None:
+        recorder.save(path)
+
+
+@contextmanager
+def span(name, category='scriptbase', **args):
+    """Record a span for a "with" block if tracing was started."""
+    if RECORDER is None:
+        yield
+    else:
+        with RECORDER.span(name, category=category, **args):
+            yield
@@ -232,7 +232,12 @@ def binary_search(array, search_for, pos_low=0, pos_high=None):
 
 @contextmanager
 def working_directory_context(directory):
-    """Temporarily change the working directory (in a "with" block)."""
+    """
+    Temporarily change the working directory (in a "with" block).
+
+    Note that this changes global process state and is not thread-safe. Use
+    the Command "cwd" option or an isolated command.Runner for child processes.
+    """
     save_directory = os.getcwd()
     os.chdir(directory)
     yield
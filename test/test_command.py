@@ -15,10 +15,18 @@
 """Scriptbase command.py tests."""
 
 import sys
+import os
 import tempfile
+import concurrent.futures
+import threading
+import shutil
+import time
 import unittest
 
-from scriptbase.command import Command
+from scriptbase.command import Command, Pipeline, Runner, Batch, RecordSpec
+from scriptbase.process import CancellationToken
+from scriptbase.shell import ShellSession
+from scriptbase.cache import ResultCache
 
 class TestCommand(unittest.TestCase):
     """Test suite."""
@@ -131,6 +139,404 @@ class TestCommand(unittest.TestCase):
         self.assertEqual(len(test_cmd.output_lines), 0)
         self.assertEqual(test_cmd.return_code, 0)
 
+    def test_input_generator(self):
+        """Generator input is streamed to the command."""
+        def _generate():
+            for number in range(100000):
+                yield str(number)
+        with Command('grep', '-c', '7$').pipe_in(_generate()) as test_cmd:
+            pass
+        self.assertEqual(test_cmd.output_lines, ['10000'])
+        self.assertEqual(test_cmd.return_code, 0)
+
+    def test_input_generator_overlap(self):
+        """Output arrives before generator input is exhausted."""
+        produced = []
+        def _generate():
+            for number in range(10000):
+                produced.append(number)
+                yield '%d%s' % (number, 'x' * 1000)
+        with Command('cat').pipe_in(_generate()) as test_cmd:
+            lines = iter(test_cmd)
+            self.assertTrue(next(lines).startswith('0x'))
+            self.assertLess(len(produced), 10000)
+            self.assertEqual(len(list(lines)), 9999)
+        self.assertEqual(len(produced), 10000)
+
+    def test_input_generator_error(self):
+        """A generator exception is raised at the end of the "with" block."""
+        def _generate():
+            yield 'a'
+            raise ValueError('bad input')
+        with self.assertRaises(ValueError):
+            with Command('cat').pipe_in(_generate()):
+                pass
+
+class TestRecords(unittest.TestCase):
+    """Structured output parsing test suite."""
+
+    def test_split(self):
+        """Items are split into fields, with the remainder in the last field."""
+        spec = RecordSpec(['name', 'size', 'rest'], converters=dict(size=int))
+        with Command('printf', 'a 1 x y\\nb 2\\n\\n') as cmd:
+            records = list(cmd.records(spec))
+        self.assertEqual([record.as_dict() for record in records],
+                         [dict(name='a', size=1, rest='x y'), dict(name='b', size=2, rest=None)])
+        self.assertEqual(cmd.return_code, 0)
+        with self.assertRaises(AttributeError):
+            records[0].other = 1
+
+    def test_pattern_nul(self):
+        """NUL-delimited items are parsed by a pattern, skipping unmatched ones."""
+        spec = RecordSpec(['key', 'value'], pattern=r'(?s)(?P<key>\w+)=(?P<value>.*)', delimiter='\0')
+        with Command('printf', 'a=1\\0bad\\0b=x\\ny\\0') as cmd:
+            records = list(cmd.records(spec))
+        self.assertEqual([tuple(record) for record in records], [('a', '1'), ('b', 'x\ny')])
+
+    def test_batches(self):
+        """Large output is parsed in batches across chunk boundaries."""
+        spec = RecordSpec(['number'], converters=dict(number=int))
+        with Command('seq', '1', '10000') as cmd:
+            batches = list(cmd.record_batches(spec, chunk_size=1000))
+        self.assertGreater(len(batches), 1)
+        self.assertEqual([record.number for batch in batches for record in batch],
+                         list(range(1, 10001)))
+
+class TestPipeline(unittest.TestCase):
+    """Pipeline test suite."""
+
+    def test_three_stages(self):
+        """Chain three commands."""
+        with Pipeline(['bash', '-c', 'for i in a b c d e; do echo $i; done'],
+                      ['grep', '[bde]'],
+                      ['tr', 'a-z', 'A-Z']) as pipeline:
+            lines = pipeline.read_lines()
+        self.assertEqual(lines, ['B', 'D', 'E'])
+        self.assertEqual(pipeline.return_code, 0)
+        self.assertEqual(pipeline.return_codes, [0, 0, 0])
+        for stage in pipeline.stages:
+            self.assertTrue(stage.elapsed >= 0.0)
+
+    def test_generator_input(self):
+        """Stream generator input to the first stage."""
+        def _generate():
+            for i in range(10000):
+                yield 'line%d' % i
+        with Pipeline(['grep', '99$'], ['wc', '-l']).pipe_in(_generate()) as pipeline:
+            pass
+        self.assertEqual(pipeline.output_lines, ['100'])
+        self.assertEqual(pipeline.return_code, 0)
+
+    def test_stage_failure(self):
+        """Report the rightmost failed stage return code."""
+        with Pipeline(['bash', '-c', 'echo x; exit 3'], ['cat'], Command('cat')) as pipeline:
+            pass
+        self.assertEqual(pipeline.output_lines, ['x'])
+        self.assertEqual(pipeline.return_codes, [3, 0, 0])
+        self.assertEqual(pipeline.return_code, 3)
+
+    def test_launch_failure(self):
+        """Stop started stages when a later stage fails to launch."""
+        pipeline = Pipeline(['sleep', '30'], ['scriptbase-nonexistent-program'])
+        start_time = time.time()
+        with self.assertRaises(OSError):
+            with pipeline:
+                pass
+        first_process = pipeline.stages[0].process
+        self.assertIsNotNone(first_process.returncode)
+        self.assertTrue(first_process.stdout.closed)
+        self.assertTrue(time.time() - start_time < 10)
+
+    def test_output_stream(self):
+        """Send final output directly to a file."""
+        with tempfile.TemporaryFile() as output:
+            with Pipeline(['echo', 'abc'], ['cat']).options(output=output) as pipeline:
+                self.assertEqual(pipeline.read_lines(), [])
+            output.seek(0)
+            self.assertEqual(output.read(), b'abc\n')
+        self.assertEqual(pipeline.return_code, 0)
+
+class TestShellSession(unittest.TestCase):
+    """Persistent shell session test suite."""
+
+    def test_state_persists(self):
+        """Working directory and exports persist between commands."""
+        with ShellSession() as session:
+            self.assertEqual(session.run('cd /tmp && export T_E_S_T=abc').return_code, 0)
+            result = session.run('pwd; echo $T_E_S_T; false')
+            self.assertEqual(result.output_lines, ['/tmp', 'abc'])
+            self.assertEqual(result.return_code, 1)
+            self.assertEqual(session.run('printf partial').output_lines, ['partial'])
+
+    def test_syntax_error(self):
+        """A syntax error fails the command without killing the shell."""
+        with ShellSession() as session:
+            self.assertNotEqual(session.run('echo "unterminated').return_code, 0)
+            self.assertEqual(session.run('echo ok').output_lines, ['ok'])
+            self.assertEqual(session.restarts, 0)
+
+    def test_restart_after_exit(self):
+        """A fresh shell is started after the shell exits."""
+        with ShellSession() as session:
+            self.assertEqual(session.run('exit 7').return_code, 7)
+            self.assertEqual(session.run('echo ok').output_lines, ['ok'])
+            self.assertEqual(session.restarts, 1)
+
+    def test_runner(self):
+        """Runner.shell() uses the session in a shell_session() block."""
+        runner = Runner(Runner.CommandArguments())
+        with runner.shell_session() as session:
+            runner.shell('export T_E_S_T=xyz')
+            self.assertEqual(session.run('echo $T_E_S_T').output_lines, ['xyz'])
+
+    def test_runner_restart(self):
+        """A replacement shell starts in the runner's current directory and environment."""
+        runner = Runner(Runner.CommandArguments(), cwd='/')
+        with runner.shell_session() as session:
+            runner.shell('true')
+            session.run('exit 3')
+            runner.chdir('tmp')
+            runner.setenv('T_E_S_T', 'abc')
+            runner.shell('true')
+            self.assertEqual(session.restarts, 1)
+            self.assertEqual(session.run('pwd; echo $T_E_S_T').output_lines, ['/tmp', 'abc'])
+
+class TestIsolatedRunner(unittest.TestCase):
+    """Isolated runner test suite."""
+
+    def test_chdir(self):
+        """Isolated chdir() doesn't change the process working directory."""
+        save_directory = os.getcwd()
+        runner = Runner(Runner.CommandArguments(), cwd=tempfile.gettempdir())
+        runner.chdir('/')
+        self.assertEqual(runner.getcwd(), '/')
+        with runner.chdir_context('tmp'):
+            self.assertEqual(runner.getcwd(), '/tmp')
+            with runner.command('pwd') as cmd:
+                pass
+            self.assertEqual(cmd.output_lines, ['/tmp'])
+        self.assertEqual(runner.getcwd(), '/')
+        self.assertEqual(os.getcwd(), save_directory)
+
+    def test_environment(self):
+        """Environment overrides are passed to child processes."""
+        runner = Runner(Runner.CommandArguments(), env={'T_E_S_T': 'abc'})
+        runner.setenv('HOME', None)
+        with runner.command('bash', '-c', 'echo $T_E_S_T:$HOME') as cmd:
+            pass
+        self.assertEqual(cmd.output_lines, ['abc:'])
+        self.assertTrue('T_E_S_T' not in os.environ)
+
+    def test_threads(self):
+        """Cloned runners can run commands in different directories on threads."""
+        runner = Runner(Runner.CommandArguments())
+        directories = ['/', '/tmp', '/usr', '/etc']
+        results = {}
+        def _pwd(directory):
+            with runner.clone(cwd=directory).command('pwd') as cmd:
+                pass
+            results[directory] = cmd.output_lines
+        threads = [threading.Thread(target=_pwd, args=(d,)) for d in directories]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {d: [d] for d in directories})
+
+class TestRunnerMap(unittest.TestCase):
+    """Runner.map() test suite."""
+
+    def test_ordered(self):
+        """Results are returned in input order."""
+        runner = Runner(Runner.CommandArguments(), var=dict(prefix='x'))
+        results = runner.map('sleep 0.0{item}; echo {prefix}{item}', [3, 1, 2], jobs=3)
+        self.assertEqual([result.output_lines for result in results], [['x3'], ['x1'], ['x2']])
+        self.assertEqual([result.return_code for result in results], [0, 0, 0])
+
+    def test_dictionary_items(self):
+        """Dictionary items provide symbols."""
+        runner = Runner(Runner.CommandArguments())
+        results = runner.map(['echo', '{name}={value}'], [dict(name='a', value=1)])
+        self.assertEqual(results[0].output_lines, ['a=1'])
+
+    def test_completion_order(self):
+        """Results can be yielded as they complete."""
+        runner = Runner(Runner.CommandArguments())
+        results = runner.map_iter('sleep 0.{item}; echo {item}', [3, 1], jobs=2, ordered=False)
+        self.assertEqual([result.item for result in results], [1, 3])
+
+    def test_early_stop(self):
+        """Queued commands are skipped when iteration stops early."""
+        runner = Runner(Runner.CommandArguments())
+        start_time = time.time()
+        results = runner.map_iter('sleep 0.5; exit {item}', [1, 0, 0, 0, 0, 0], jobs=1)
+        for result in results:
+            if result.failed:
+                break
+        results.close()
+        self.assertTrue(time.time() - start_time < 2.0)
+
+    def test_failures(self):
+        """Failures are reported without aborting if requested."""
+        runner = Runner(Runner.CommandArguments())
+        results = runner.map('exit {item}', [0, 2, 0], abort=False)
+        self.assertEqual([result.failed for result in results], [False, True, False])
+
+    def test_dry_run(self):
+        """Commands are not executed in dry run mode."""
+        runner = Runner(Runner.CommandArguments(DRY_RUN=True))
+        with tempfile.TemporaryFile('w+') as output:
+            save_stdout, sys.stdout = sys.stdout, output
+            try:
+                results = runner.map('exit {item}', [1, 2])
+            finally:
+                sys.stdout = save_stdout
+            output.seek(0)
+            self.assertEqual(output.read().splitlines(), ['>>> exit 1', '>>> exit 2'])
+        self.assertEqual([result.return_code for result in results], [0, 0])
+
+class TestTimeouts(unittest.TestCase):
+    """Timeout and cancellation test suite."""
+
+    def test_command_timeout(self):
+        """A timed out command and its children are stopped."""
+        start_time = time.time()
+        with Command('bash', '-c', 'sleep 30 & wait').options(timeout=0.2) as cmd:
+            pass
+        self.assertLess(time.time() - start_time, 10)
+        self.assertEqual(cmd.expired, 'timed out after 0.2 seconds')
+        self.assertLess(cmd.return_code, 0)
+
+    def test_command_no_timeout(self):
+        """A command finishing in time isn't stopped."""
+        with Command('echo', 'ok').options(timeout=10) as cmd:
+            pass
+        self.assertEqual(cmd.output_lines, ['ok'])
+        self.assertIsNone(cmd.expired)
+
+    def test_map_cancel(self):
+        """Cancellation stops running map commands and skips the rest."""
+        cancel = CancellationToken()
+        runner = Runner(Runner.CommandArguments(), cancel=cancel)
+        timer = threading.Timer(0.2, cancel.cancel, args=('test',))
+        timer.start()
+        results = runner.map('sleep 30', [1, 2, 3], jobs=1, abort=False)
+        timer.join()
+        self.assertEqual([result.expired for result in results],
+                         ['cancelled (test)', 'cancelled', 'cancelled'])
+
+    def test_map_timeout(self):
+        """Map commands can time out individually."""
+        runner = Runner(Runner.CommandArguments())
+        results = runner.map('sleep {item}', [0, 30], abort=False, timeout=0.5)
+        self.assertEqual([result.failed for result in results], [False, True])
+
+    def test_session_timeout(self):
+        """A timed out session command kills the shell."""
+        with ShellSession() as session:
+            self.assertEqual(session.run('sleep 30', timeout=0.2).expired,
+                             'timed out after 0.2 seconds')
+            self.assertEqual(session.run('echo ok').output_lines, ['ok'])
+            self.assertEqual(session.restarts, 1)
+
+    def test_batch_timeout(self):
+        """A batch timeout fails the batch with a reason."""
+        batch = Batch()
+        batch.add_command('true')
+        batch.add_command('sleep', '30')
+        with self.assertRaises(Batch.Failure) as context:
+            batch.run(timeout=0.5)
+        self.assertEqual(context.exception.reason, 'timed out after 0.5 seconds')
+
+class TestCommandCache(unittest.TestCase):
+    """Command result cache test suite."""
+
+    def setUp(self):
+        """Create a scratch directory with a counter file."""
+        self.directory = tempfile.mkdtemp()
+        self.counter = os.path.join(self.directory, 'counter')
+        self.script = 'echo x >> %s; wc -l < %s' % (self.counter, self.counter)
+
+    def tearDown(self):
+        """Remove the scratch directory."""
+        shutil.rmtree(self.directory)
+
+    def _run(self, result_cache, **options):
+        with Command('bash', '-c', self.script).options(cache=result_cache, **options) as cmd:
+            pass
+        return cmd.output_lines
+
+    def test_memory(self):
+        """Identical commands run once."""
+        result_cache = ResultCache()
+        self.assertEqual(self._run(result_cache), ['1'])
+        self.assertEqual(self._run(result_cache), ['1'])
+        self.assertEqual((result_cache.hits, result_cache.misses), (1, 1))
+
+    def test_file_invalidation(self):
+        """Modified files invalidate results."""
+        result_cache = ResultCache()
+        trigger = os.path.join(self.directory, 'trigger')
+        self.assertEqual(self._run(result_cache, cache_files=[trigger]), ['1'])
+        with open(trigger, 'w') as file_handle:
+            file_handle.write('changed')
+        self.assertEqual(self._run(result_cache, cache_files=[trigger]), ['2'])
+        self.assertEqual(self._run(result_cache, cache_files=[trigger]), ['2'])
+
+    def test_ttl(self):
+        """Expired results are not used."""
+        result_cache = ResultCache()
+        self.assertEqual(self._run(result_cache), ['1'])
+        self.assertEqual(self._run(result_cache, ttl=-1), ['2'])
+
+    def test_input(self):
+        """Input data is part of the key."""
+        result_cache = ResultCache()
+        for input_str, expected in (('a', ['a']), ('b', ['b']), ('a', ['a'])):
+            with Command('cat').options(cache=result_cache).pipe_in(input_str) as cmd:
+                pass
+            self.assertEqual(cmd.output_lines, expected)
+        self.assertEqual(result_cache.hits, 1)
+
+    def test_partial_output(self):
+        """Partially read output is not cached."""
+        result_cache = ResultCache()
+        with Command('bash', '-c', 'echo 1; echo 2').options(cache=result_cache) as cmd:
+            for line in cmd:
+                break
+        with Command('bash', '-c', 'echo 1; echo 2').options(cache=result_cache) as cmd:
+            pass
+        self.assertEqual(cmd.output_lines, ['1', '2'])
+        self.assertEqual(result_cache.hits, 0)
+
+    def test_pipe_out(self):
+        """Cached output can be piped to another command."""
+        result_cache = ResultCache()
+        with Command('bash', '-c', 'echo b; echo a').options(cache=result_cache) as cmd:
+            pass
+        for _ in range(2):
+            with Command('bash', '-c', 'echo b; echo a').options(cache=result_cache) as cmd:
+                with cmd.pipe_out('sort') as sort_cmd:
+                    pass
+            self.assertEqual(sort_cmd.output_lines, ['a', 'b'])
+        self.assertEqual(result_cache.hits, 2)
+
+    def test_concurrent_counters(self):
+        """Hit and miss counts are exact when threads share a cache."""
+        result_cache = ResultCache()
+        result_cache.put('key', 0, ['x'])
+        def _lookup(index):
+            return result_cache.get('key' if index % 2 else 'missing')
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(_lookup, range(4000)))
+        self.assertEqual((result_cache.hits, result_cache.misses), (2000, 2000))
+
+    def test_disk(self):
+        """Results are shared through a cache directory."""
+        cache_directory = os.path.join(self.directory, 'cache')
+        self.assertEqual(self._run(ResultCache(directory=cache_directory)), ['1'])
+        self.assertEqual(self._run(ResultCache(directory=cache_directory)), ['1'])
+
 def demo_realtime():
     """Demonstrate real-time output from sub-process."""
     with Command('bash', '-c', 'for i in 111 222 333; do echo $i; sleep 1; done') as test_cmd:
@@ -0,0 +1,204 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Scriptbase disk.py tests."""
+
+import os
+import io
+import bz2
+import gzip
+import lzma
+import tempfile
+import unittest
+
+from scriptbase import disk
+
+
+def _write_image(path, size):
+    data = os.urandom(size // 2) + bytes(size - size // 2)
+    with open(path, 'wb') as image_file:
+        image_file.write(data)
+    return data
+
+
+def _read_file(path):
+    with open(path, 'rb') as image_file:
+        return image_file.read()
+
+
+class TestStreamCopy(unittest.TestCase):
+    """Streaming device/image copy test suite."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.temp_dir.name, 'device.img')
+        self.data = _write_image(self.image_path, 5 * 1024 * 1024 + 123)
+        self.reports = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_backup_restore(self):
+        """Uncompressed images round-trip and a final progress report is made."""
+        backup_path = os.path.join(self.temp_dir.name, 'backup.img')
+        restore_path = os.path.join(self.temp_dir.name, 'restore.img')
+        self.assertEqual(disk.backup_device(self.image_path, backup_path,
+                                            progress=self.reports.append), len(self.data))
+        self.assertEqual(_read_file(backup_path), self.data)
+        self.assertEqual(disk.restore_device(restore_path, backup_path,
+                                             progress=self.reports.append), len(self.data))
+        self.assertEqual(_read_file(restore_path), self.data)
+        status = self.reports[-1]
+        self.assertEqual(status.done, len(self.data))
+        self.assertEqual(status.total, len(self.data))
+        self.assertEqual(status.eta, 0.0)
+        self.assertIn('(100%)', str(status))
+
+    def test_buffered_objects(self):
+        """File-like objects and pipes go through the reusable buffer."""
+        target = io.BytesIO()
+        copier = disk.StreamCopier(buffer_size=65536, progress=None)
+        self.assertEqual(copier.copy(io.BytesIO(self.data), target), len(self.data))
+        self.assertEqual(target.getvalue(), self.data)
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, self.data[:4096])
+        os.close(write_fd)
+        output_path = os.path.join(self.temp_dir.name, 'pipe.img')
+        with open(output_path, 'wb') as output_file:
+            self.assertEqual(copier.copy(read_fd, output_file.fileno()), 4096)
+        os.close(read_fd)
+        self.assertEqual(_read_file(output_path), self.data[:4096])
+
+    def test_compressed_backup(self):
+        """Compressed backups produce standard compressed images."""
+        backup_path = os.path.join(self.temp_dir.name, 'backup.img.gz')
+        disk.backup_device(self.image_path, backup_path, compression='gzip',
+                           progress=self.reports.append)
+        self.assertEqual(gzip.decompress(_read_file(backup_path)), self.data)
+        self.assertEqual(self.reports[-1].done, len(self.data))
+
+    def test_progress(self):
+        """Progress reports throughput and ETA while running."""
+        status = disk.CopyProgress(total=4000000)
+        status.started -= 2.0
+        status.update(1000000)
+        self.assertAlmostEqual(status.eta, 6.0, delta=0.5)
+        text = str(status)
+        self.assertTrue(text.startswith('1.00 MB of 4.00 MB (25%), '))
+        self.assertIn('KB/s', text)
+        self.assertIn('ETA 0:00:0', text)
+        self.assertIsNone(disk.CopyProgress().eta)
+
+
+class TestParallelCompression(unittest.TestCase):
+    """In-process parallel compression test suite."""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.image_path = os.path.join(self.temp_dir.name, 'device.img')
+        self.data = _write_image(self.image_path, 1024 * 1024 + 77)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _compress(self, name, data, block_size=65536):
+        compressed_path = os.path.join(self.temp_dir.name, 'image.' + name)
+        compressor = disk.Compressors.get_compressor(name)
+        with open(compressed_path, 'wb') as compressed_file:
+            with compressor.get_writer(compressed_file, jobs=4,
+                                       block_size=block_size) as writer:
+                for offset in range(0, len(data), 100000):
+                    writer.write(data[offset:offset + 100000])
+        return compressed_path
+
+    def _expand(self, name, compressed_path):
+        compressor = disk.Compressors.get_compressor(name)
+        target = io.BytesIO()
+        with open(compressed_path, 'rb') as compressed_file:
+            with compressor.get_reader(compressed_file.fileno(), jobs=4) as reader:
+                disk.StreamCopier(progress=None).copy(reader, target)
+                size = reader.size
+        return target.getvalue(), size
+
+    def test_standard_members(self):
+        """Blocks are standard members in order, and split back into parallel members."""
+        for name, module in (('gzip', gzip), ('xz', lzma), ('bzip2', bz2)):
+            compressed_path = self._compress(name, self.data)
+            compressed = _read_file(compressed_path)
+            self.assertEqual(module.decompress(compressed), self.data)
+            compressor = disk.Compressors.get_compressor(name)
+            members = compressor.split_members(memoryview(compressed))
+            if name == 'bzip2':
+                self.assertIsNone(members)
+            else:
+                self.assertEqual([size for _member, size in members],
+                                 [65536] * 16 + [77])
+            self.assertEqual(self._expand(name, compressed_path),
+                             (self.data, None if name == 'bzip2' else len(self.data)))
+
+    def test_sequential_expansion(self):
+        """Foreign files, pipes and empty input expand sequentially."""
+        foreign_path = os.path.join(self.temp_dir.name, 'foreign.gz')
+        with open(foreign_path, 'wb') as foreign_file:
+            foreign_file.write(gzip.compress(self.data[:1000]) + gzip.compress(b'more'))
+        self.assertEqual(self._expand('gzip', foreign_path), (self.data[:1000] + b'more', None))
+        empty_path = self._compress('xz', b'')
+        self.assertEqual(lzma.decompress(_read_file(empty_path)), b'')
+        self.assertEqual(self._expand('xz', empty_path), (b'', 0))
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, _read_file(self._compress('gzip', self.data[:5000], 1000)))
+        os.close(write_fd)
+        compressor = disk.Compressors.get_compressor('gzip')
+        target = io.BytesIO()
+        with compressor.get_reader(read_fd) as reader:
+            disk.StreamCopier(progress=None).copy(reader, target)
+        os.close(read_fd)
+        self.assertEqual(target.getvalue(), self.data[:5000])
+
+    def test_large_foreign_stream(self):
+        """A single large xz stream from another tool expands sequentially."""
+        data = bytes(disk.MAX_PARALLEL_MEMBER_SIZE) + self.data
+        foreign_path = os.path.join(self.temp_dir.name, 'foreign.xz')
+        with open(foreign_path, 'wb') as foreign_file:
+            foreign_file.write(lzma.compress(data, preset=0))
+        compressor = disk.Compressors.get_compressor('xz')
+        members = compressor.split_members(memoryview(_read_file(foreign_path)))
+        self.assertEqual([size for _member, size in members], [len(data)])
+        self.assertEqual(self._expand('xz', foreign_path), (data, None))
+
+    def test_backup_restore(self):
+        """Compressed backups and restores work without external programs."""
+        saved_path = os.environ['PATH']
+        os.environ['PATH'] = ''
+        try:
+            for name in ('gzip', 'xz', 'bzip2'):
+                backup_path = os.path.join(self.temp_dir.name, 'backup.' + name)
+                restore_path = os.path.join(self.temp_dir.name, 'restore.img')
+                reports = []
+                self.assertEqual(disk.backup_device(self.image_path, backup_path,
+                                                    compression=name, progress=None),
+                                 len(self.data))
+                self.assertEqual(disk.restore_device(restore_path, backup_path,
+                                                     compression=name,
+                                                     progress=reports.append),
+                                 len(self.data))
+                self.assertEqual(_read_file(restore_path), self.data)
+                self.assertEqual(reports[-1].done, len(self.data))
+        finally:
+            os.environ['PATH'] = saved_path
+
+
+if __name__ == '__main__':
+    unittest.main()
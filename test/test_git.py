@@ -0,0 +1,533 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Scriptbase git.py tests."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scriptbase import git
+from scriptbase import gitindex
+from scriptbase import instrument
+
+
+def _git(directory, *args, **env):
+    """Run a git command in a directory with a fixed identity."""
+    environment = dict(os.environ,
+                       GIT_AUTHOR_NAME=env.get('author', 'Alice'),
+                       GIT_AUTHOR_EMAIL='alice@example.com',
+                       GIT_COMMITTER_NAME='Alice',
+                       GIT_COMMITTER_EMAIL='alice@example.com')
+    return subprocess.check_output(['git', '-C', directory] + list(args),
+                                   env=environment, stderr=subprocess.STDOUT).decode('utf8')
+
+
+class GitTestCase(unittest.TestCase):
+    """Base class providing a repository with an "origin" remote."""
+
+    def setUp(self):
+        """Create "origin" and a clone with branches by different authors."""
+        self.root = tempfile.mkdtemp()
+        self.origin = os.path.join(self.root, 'origin')
+        self.work = os.path.join(self.root, 'work')
+        os.mkdir(self.origin)
+        _git(self.origin, 'init', '-q', '-b', 'master')
+        with open(os.path.join(self.origin, 'a.txt'), 'w') as file_handle:
+            file_handle.write('a\n')
+        _git(self.origin, 'add', 'a.txt')
+        _git(self.origin, 'commit', '-q', '-m', 'first')
+        _git(self.origin, 'branch', 'merged-feature')
+        _git(self.origin, 'checkout', '-q', '-b', 'bob-feature')
+        with open(os.path.join(self.origin, 'b.txt'), 'w') as file_handle:
+            file_handle.write('b\n')
+        _git(self.origin, 'add', 'b.txt')
+        _git(self.origin, 'commit', '-q', '-m', 'second', author='Bob')
+        _git(self.origin, 'checkout', '-q', 'master')
+        _git(self.root, 'clone', '-q', self.origin, self.work)
+        self.save_directory = os.getcwd()
+        os.chdir(self.work)
+
+    def tearDown(self):
+        """Remove the repositories."""
+        os.chdir(self.save_directory)
+        shutil.rmtree(self.root)
+
+
+class TestBranches(GitTestCase):
+    """Branch listing test suite."""
+
+    def test_records(self):
+        """Branch records have authors, dates and upstreams."""
+        records = {record.branch: record for record in git.iter_branch_records('refs/remotes')}
+        self.assertEqual(sorted(records.keys()),
+                         ['origin/bob-feature', 'origin/master', 'origin/merged-feature'])
+        self.assertEqual(records['origin/bob-feature'].author, 'Bob')
+        self.assertTrue(records['origin/master'].date > 0)
+        local = list(git.iter_branch_records())
+        self.assertEqual([(record.branch, record.upstream, record.head) for record in local],
+                         [('master', 'origin/master', '*')])
+
+    def test_merged(self):
+        """Merge status is available as a filter and a field."""
+        self.assertEqual(sorted(git.iter_branches(merged=True)),
+                         ['origin/master', 'origin/merged-feature'])
+        self.assertEqual(list(git.iter_branches(unmerged=True)), ['origin/bob-feature'])
+        merged = {record.branch: record.merged
+                  for record in git.iter_branch_records('refs/remotes', merged_into='master')}
+        self.assertEqual(merged['origin/bob-feature'], False)
+        self.assertEqual(merged['origin/merged-feature'], True)
+
+    def test_users(self):
+        """Branches are filtered by author without a query per branch."""
+        self.assertEqual(list(git.iter_branches(user='Bob')), ['origin/bob-feature'])
+        self.assertEqual(git.get_branch_user('origin/bob-feature'), 'Bob')
+        self.assertEqual(git.get_branch_user('master'), 'Alice')
+        _git(self.work, 'branch', 'foo/x', 'origin/bob-feature')
+        self.assertEqual(git.get_branch_user('foo/x'), 'Bob')
+        self.assertIsNone(git.get_branch_user('foo'))
+
+    def test_local_branch(self):
+        """The checked out branch is found."""
+        self.assertEqual(git.get_local_branch(), 'master')
+        _git(self.work, 'checkout', '-q', 'bob-feature')
+        self.assertEqual(git.get_local_branch(), 'bob-feature')
+
+class TestRepository(GitTestCase):
+    """Direct repository file reader test suite."""
+
+    def test_head_and_config(self):
+        """HEAD, upstream and remote URL are read from files."""
+        repository = git.get_repository()
+        self.assertEqual(repository.work_tree, os.path.realpath(self.work))
+        self.assertEqual(repository.get_branch(), 'master')
+        self.assertEqual(repository.get_tracking_branch(), 'origin/master')
+        self.assertEqual(repository.get_remote_url(), self.origin)
+        self.assertEqual(git.get_tracking_branch(), 'origin/master')
+        self.assertEqual(git.get_repository_url(), self.origin)
+        self.assertEqual(git.git_project_root(), os.path.realpath(self.work))
+        self.assertIs(git.get_repository(os.path.join(self.work, '.git')), repository)
+
+    def test_refs(self):
+        """Loose and packed refs resolve like "git rev-parse"."""
+        repository = git.get_repository()
+        expected = _git(self.work, 'rev-parse', 'origin/bob-feature').strip()
+        self.assertEqual(repository.resolve_ref('refs/remotes/origin/bob-feature'), expected)
+        _git(self.work, 'pack-refs', '--all')
+        self.assertEqual(repository.resolve_ref('refs/remotes/origin/bob-feature'), expected)
+        self.assertEqual(repository.resolve_ref('HEAD'),
+                         _git(self.work, 'rev-parse', 'HEAD').strip())
+        self.assertIsNone(repository.resolve_ref('refs/heads/missing'))
+
+    def test_invalidation(self):
+        """Cached results change when files change."""
+        repository = git.get_repository()
+        self.assertEqual(git.get_local_branch(), 'master')
+        _git(self.work, 'checkout', '-q', 'bob-feature')
+        self.assertEqual(repository.get_branch(), 'bob-feature')
+        _git(self.work, 'checkout', '-q', '--detach')
+        self.assertIsNone(repository.get_branch())
+        self.assertEqual(git.get_local_branch(), '(unknown)')
+
+    def test_worktree(self):
+        """Linked worktrees share refs and config but not HEAD."""
+        worktree = os.path.join(self.root, 'tree')
+        _git(self.work, 'worktree', 'add', '-q', worktree, 'bob-feature')
+        repository = git.get_repository(os.path.join(worktree, 'subdirectory'))
+        self.assertEqual(repository.work_tree, os.path.realpath(worktree))
+        self.assertEqual(repository.get_branch(), 'bob-feature')
+        self.assertEqual(repository.get_tracking_branch(), 'origin/bob-feature')
+        self.assertEqual(repository.resolve_ref('refs/heads/master'),
+                         _git(self.work, 'rev-parse', 'master').strip())
+
+    def test_worktree_url_invalidation(self):
+        """A linked worktree sees remote URL changes in the shared config."""
+        worktree = os.path.join(self.root, 'tree')
+        _git(self.work, 'worktree', 'add', '-q', worktree, 'bob-feature')
+        os.chdir(worktree)
+        self.assertEqual(git.get_repository_url(), self.origin)
+        _git(worktree, 'remote', 'set-url', 'origin', 'https://example.com/changed.git')
+        self.assertEqual(git.get_repository_url(), 'https://example.com/changed.git')
+
+    def test_parse_config(self):
+        """Config syntax variations are parsed."""
+        self.assertEqual(git.parse_config('\n'.join([
+            '[core]',
+            '\tbare = false ; comment',
+            '[remote "origin"]',
+            '\turl = "a;b" # comment',
+            '[Section.Sub] flag',
+            '\tvalue = a \\',
+            '\t\tb',
+        ])), {
+            'core.bare': 'false',
+            'remote.origin.url': 'a;b',
+            'section.sub.flag': 'true',
+            'section.sub.value': 'a b',
+        })
+
+
+class TestSubmodules(GitTestCase):
+    """Submodule status test suite."""
+
+    def setUp(self):
+        """Add submodules "sub1" to "sub3" and leave "sub3" uninitialized."""
+        GitTestCase.setUp(self)
+        for name in ('sub1', 'sub2', 'sub3'):
+            _git(self.work, '-c', 'protocol.file.allow=always',
+                 'submodule', 'add', '-q', self.origin, name)
+        _git(self.work, 'commit', '-q', '-m', 'submodules')
+        _git(self.work, 'submodule', 'deinit', '-q', 'sub3')
+
+    def test_changes(self):
+        """Submodule changes follow the top level in submodule order."""
+        with open(os.path.join(self.work, 'a.txt'), 'w') as file_handle:
+            file_handle.write('top\n')
+        for path in ('sub2/a.txt', 'sub1/new.txt', 'sub1/a.txt'):
+            with open(os.path.join(self.work, path), 'w') as file_handle:
+                file_handle.write('changed\n')
+        self.assertEqual(list(git.iter_submodules()), ['sub1', 'sub2', 'sub3'])
+        self.assertEqual(list(git.iter_submodules(checked_out=True)), ['sub1', 'sub2'])
+        for jobs in (1, 4):
+            changes = [(change.flag, change.path)
+                       for change in git.iter_changes(submodules=True, jobs=jobs)]
+            self.assertEqual(changes, [('M', 'a.txt'), ('M', 'sub1/a.txt'),
+                                       ('??', 'sub1/new.txt'), ('M', 'sub2/a.txt')])
+
+
+class TestLog(GitTestCase):
+    """Commit log iterator test suite."""
+
+    def _commit(self, path, seconds):
+        with open(os.path.join(self.work, path), 'w') as file_handle:
+            file_handle.write('%d\n' % seconds)
+        _git(self.work, 'add', path)
+        subprocess.check_output(['git', '-C', self.work, '-c', 'user.name=Carol',
+                                 '-c', 'user.email=carol@example.com', 'commit', '-q',
+                                 '-m', 'change %s' % path, '-m', 'Body\nlines.'],
+                                env=dict(os.environ, GIT_COMMITTER_DATE='@%d +0000' % seconds))
+
+    def test_fields(self):
+        """Records have the requested fields and converted values."""
+        self._commit('c.txt', 2000000000)
+        entries = list(git.iter_log(fields=['subject', 'parents', 'commit_date', 'body']))
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0].commit, _git(self.work, 'rev-parse', 'HEAD').strip())
+        self.assertEqual(entries[0].subject, 'change c.txt')
+        self.assertEqual(entries[0].parents, [entries[1].commit])
+        self.assertEqual(entries[0].commit_date, 2000000000)
+        self.assertEqual(entries[0].body, 'Body\nlines.\n')
+        self.assertEqual(entries[1].parents, [])
+        self.assertEqual([entry.author for entry in git.iter_log('origin/bob-feature')],
+                         ['Bob', 'Alice'])
+        with self.assertRaises(ValueError):
+            list(git.iter_log(fields=['bogus']))
+
+    def test_filters(self):
+        """Paths, dates and a last seen commit limit the log."""
+        for path, seconds in (('c.txt', 2000000000), ('d.txt', 2000000100),
+                              ('c.txt', 2000000200)):
+            self._commit(path, seconds)
+        def _subjects(**kwargs):
+            return [entry.subject for entry in git.iter_log(**kwargs)]
+        self.assertEqual(_subjects(paths=['d.txt']), ['change d.txt'])
+        self.assertEqual(_subjects(since=2000000050), ['change c.txt', 'change d.txt'])
+        self.assertEqual(_subjects(since=2000000050, until=2000000150), ['change d.txt'])
+        last_seen = list(git.iter_log(max_count=1))[0].commit
+        self._commit('d.txt', 2000000300)
+        self.assertEqual(_subjects(last_seen=last_seen), ['change d.txt'])
+        # The newest commits are selected before reversing.
+        self.assertEqual(_subjects(reverse=True, max_count=2), ['change c.txt', 'change d.txt'])
+
+
+class TestUnmerged(GitTestCase):
+    """Unmerged commit analysis test suite."""
+
+    def _commit(self, path, text):
+        with open(os.path.join(self.work, path), 'w') as file_handle:
+            file_handle.write(text)
+        _git(self.work, 'add', path)
+        _git(self.work, 'commit', '-q', '-m', 'change %s' % path)
+        return _git(self.work, 'rev-parse', 'HEAD').strip()
+
+    def test_branches(self):
+        """Results match "git cherry" and upstream patch ids are cached."""
+        _git(self.work, 'checkout', '-q', '-b', 'feature')
+        picked = self._commit('c.txt', 'c\n')
+        self._commit('d.txt', 'd\n')
+        _git(self.work, 'checkout', '-q', '-b', 'empty', 'master')
+        _git(self.work, 'commit', '-q', '--allow-empty', '-m', 'nothing')
+        _git(self.work, 'checkout', '-q', 'master')
+        _git(self.work, 'cherry-pick', picked)
+        self._commit('e.txt', 'e\n')
+        branches = ['feature', 'origin/bob-feature', 'empty', 'master']
+        cache_directory = os.path.join(self.root, 'cache')
+        for _ in range(2):
+            results = git.unmerged_commits_for_branches(branches, jobs=2,
+                                                        cache_directory=cache_directory)
+            self.assertEqual(list(results.keys()), branches)
+            for branch in branches:
+                self.assertEqual([(commit.identifier, commit.comment)
+                                  for commit in results[branch]],
+                                 [(commit.identifier, commit.comment)
+                                  for commit in git.iter_unmerged_commits(branch)])
+        self.assertEqual([commit.comment for commit in results['feature']], ['change d.txt'])
+        self.assertEqual([commit.comment for commit in results['empty']], ['nothing'])
+        self.assertEqual(len(os.listdir(cache_directory)), 1)
+        results = git.unmerged_commits_for_branches(['master'], upstream='feature',
+                                                    cache_directory=None)
+        self.assertEqual([commit.comment for commit in results['master']], ['change e.txt'])
+
+    def test_bad_branch(self):
+        """Bad branch names are errors rather than branches without unmerged commits."""
+        for branches in (['no-such-branch'], ['master', 'no-such-branch']):
+            with self.assertRaises(SystemExit):
+                git.unmerged_commits_for_branches(branches, cache_directory=None)
+
+
+class TestScanner(GitTestCase):
+    """Multi-repository scanner test suite."""
+
+    def test_scan(self):
+        """Repositories are found and queried, and unchanged ones use the cache."""
+        os.makedirs(os.path.join(self.root, 'group', '.hidden'))
+        _git(self.root, 'clone', '-q', self.origin, os.path.join(self.root, 'group', 'third'))
+        _git(self.root, 'init', '-q', os.path.join(self.root, 'group', '.hidden', 'skipped'))
+        self.assertEqual(git.find_repositories(self.root),
+                         [os.path.join(self.root, name)
+                          for name in ('group/third', 'origin', 'work')])
+        with open(os.path.join(self.work, 'c.txt'), 'w') as file_handle:
+            file_handle.write('c\n')
+        _git(self.work, 'add', 'c.txt')
+        _git(self.work, 'commit', '-q', '-m', 'third')
+        with open(os.path.join(self.work, 'a.txt'), 'w') as file_handle:
+            file_handle.write('changed\n')
+        scanner = git.RepositoryScanner(self.root, jobs=2)
+        states = {os.path.basename(state.path): state for state in scanner.scan()}
+        self.assertEqual(sorted(states.keys()), ['origin', 'third', 'work'])
+        work = states['work']
+        self.assertEqual((work.branch, work.upstream, work.ahead, work.behind, work.cached),
+                         ('master', 'origin/master', 1, 0, False))
+        self.assertEqual([(change.flag, change.path) for change in work.changes],
+                         [('M', 'a.txt')])
+        self.assertEqual((states['origin'].upstream, states['origin'].ahead), (None, None))
+        self.assertEqual((states['third'].ahead, states['third'].behind), (0, 0))
+        _git(os.path.join(self.root, 'group', 'third'), 'reset', '-q', '--hard', 'HEAD')
+        _git(self.work, 'reset', '-q', '--soft', 'HEAD~1')
+        states = list(scanner.scan(status=False, ordered=True))
+        self.assertEqual([os.path.basename(state.path) for state in states],
+                         ['third', 'origin', 'work'])
+        self.assertEqual([state.cached for state in states], [False, True, False])
+        self.assertEqual((states[2].ahead, states[2].behind, states[2].changes), (0, 0, None))
+
+
+class TestRemoteHeads(GitTestCase):
+    """Remote heads snapshot test suite."""
+
+    def setUp(self):
+        """Use a bare repository as the remote and count "git ls-remote" commands."""
+        GitTestCase.setUp(self)
+        self.remote = os.path.join(self.root, 'remote.git')
+        _git(self.root, 'clone', '-q', '--bare', self.origin, self.remote)
+        _git(self.work, 'remote', 'set-url', 'origin', self.remote)
+        _git(self.work, 'fetch', '-q')
+        git.forget_remote_heads()
+        instrument.RECORDER.clear()
+        instrument.enable()
+
+    def tearDown(self):
+        """Stop counting commands."""
+        instrument.enable(False)
+        instrument.RECORDER.clear()
+        git.forget_remote_heads()
+        GitTestCase.tearDown(self)
+
+    def _count_listings(self):
+        return len([record for record in instrument.RECORDER.records
+                    if 'ls-remote' in record.command])
+
+    def test_snapshot(self):
+        """One listing answers many checks and pushes update it."""
+        self.assertEqual(sorted(git.get_remote_heads(self.remote).keys()),
+                         ['bob-feature', 'master', 'merged-feature'])
+        for branch in ('master', 'bob-feature', 'feature', 'merged-feature'):
+            self.assertEqual(git.remote_branch_exists(self.remote, branch),
+                             branch != 'feature')
+        self.assertEqual(self._count_listings(), 1)
+        _git(self.work, 'branch', 'feature')
+        git.create_remote_branch(self.remote, 'feature')
+        self.assertTrue(git.remote_branch_exists(self.remote, 'feature'))
+        self.assertEqual(self._count_listings(), 1)
+        self.assertIn('refs/heads/feature', _git(self.remote, 'show-ref'))
+        self.assertTrue(git.remote_branch_exists(self.remote, 'feature', ttl=0))
+        self.assertEqual(self._count_listings(), 2)
+        _git(self.work, 'push', '-q', 'origin', 'master:other')
+        self.assertFalse(git.remote_branch_exists(self.remote, 'other'))
+        self.assertIn('other', git.get_remote_heads(self.remote, refresh=True))
+
+    def test_failure(self):
+        """An unreachable remote has no branches and isn't remembered."""
+        missing = os.path.join(self.root, 'missing.git')
+        self.assertEqual(git.get_remote_heads(missing), {})
+        self.assertFalse(git.remote_branch_exists(missing, 'master'))
+        self.assertEqual(self._count_listings(), 2)
+
+
+class TestObjectReader(GitTestCase):
+    """Persistent "git cat-file" reader test suite."""
+
+    def test_read(self):
+        """Contents, types and sizes come back in request order."""
+        blob_id = _git(self.work, 'rev-parse', 'HEAD:a.txt').strip()
+        with git.GitObjectReader() as reader:
+            blob = reader.read('HEAD:a.txt')
+            self.assertEqual((blob.object_id, blob.type, blob.size, blob.data),
+                             (blob_id, 'blob', 2, b'a\n'))
+            results = list(reader.read_many(['HEAD', 'missing-ref', blob_id]))
+            self.assertEqual(results[0].type, 'commit')
+            self.assertTrue(results[0].text.startswith('tree '))
+            self.assertIsNone(results[1])
+            self.assertIs(results[2], blob)
+            info = reader.get_info('origin/bob-feature:b.txt')
+            self.assertEqual((info.type, info.size, info.data), ('blob', 2, None))
+            self.assertIsNone(reader.get_info('HEAD:missing.txt'))
+
+    def test_one_process(self):
+        """Many lookups, including large objects, share one process."""
+        with open(os.path.join(self.work, 'big.bin'), 'wb') as file_handle:
+            file_handle.write(os.urandom(300000))
+        _git(self.work, 'add', 'big.bin')
+        _git(self.work, 'commit', '-q', '-m', 'big')
+        reader = git.get_object_reader()
+        self.assertIs(git.get_object_reader(os.path.join(self.work, '.git')), reader)
+        try:
+            names = ['HEAD:big.bin', 'HEAD:a.txt', 'HEAD~1'] * 1000
+            results = list(reader.read_many(names))
+            self.assertEqual([result.type for result in results[:3]], ['blob', 'blob', 'commit'])
+            self.assertEqual(results[0].size, 300000)
+            self.assertEqual(len(results), 3000)
+            self.assertEqual(len(list(reader.get_info_many(names))), 3000)
+            self.assertEqual(reader.restarts, 0)
+        finally:
+            reader.stop()
+
+
+class TestStatus(GitTestCase):
+    """Index-based status test suite."""
+
+    def _write(self, path, text):
+        with open(os.path.join(self.work, path), 'w') as file_handle:
+            file_handle.write(text)
+
+    def _get_status(self, engine=None):
+        engine = engine or gitindex.StatusEngine(git.Repository.find(self.work))
+        return [(entry.flag, entry.path) for entry in engine.status()]
+
+    def test_clean(self):
+        """A fresh clone has no changes."""
+        self.assertEqual(self._get_status(), [])
+
+    def test_changes(self):
+        """Status matches "git status" for modified, deleted, added and untracked files."""
+        self._write('a.txt', 'b\n')
+        self._write('.gitignore', '*.log\nbuild/\n')
+        self._write('new.txt', 'new\n')
+        self._write('skip.log', 'log\n')
+        os.makedirs(os.path.join(self.work, 'sub', 'deep'))
+        self._write('sub/deep/c.txt', 'c\n')
+        os.mkdir(os.path.join(self.work, 'empty'))
+        os.mkdir(os.path.join(self.work, 'build'))
+        self._write('build/out.txt', 'out\n')
+        self._write('staged.txt', 'staged\n')
+        _git(self.work, 'add', 'staged.txt')
+        self._write('staged.txt', 'staged and modified\n')
+        expected = sorted([(line[:2].strip(), line[3:])
+                           for line in _git(self.work, 'status', '--porcelain').splitlines()],
+                          key=lambda item: item[1])
+        self.assertEqual(self._get_status(), expected)
+        self.assertEqual(self._get_status(),
+                         [('??', '.gitignore'), ('M', 'a.txt'), ('??', 'new.txt'),
+                          ('AM', 'staged.txt'), ('??', 'sub/')])
+        os.remove(os.path.join(self.work, 'a.txt'))
+        _git(self.work, 'reset', '-q', 'staged.txt')
+        self.assertEqual(self._get_status()[:2], [('??', '.gitignore'), ('D', 'a.txt')])
+
+    def test_ignored_directories(self):
+        """Untracked directories holding only ignored or no files are hidden."""
+        self._write('.gitignore', '*.pyc\n')
+        _git(self.work, 'add', '.gitignore')
+        os.makedirs(os.path.join(self.work, 'src', 'pkg', '__pycache__'))
+        self._write('src/pkg/__pycache__/a.pyc', 'pyc\n')
+        os.makedirs(os.path.join(self.work, 'nested', 'empty'))
+        os.makedirs(os.path.join(self.work, 'mixed', 'deep'))
+        self._write('mixed/deep/b.pyc', 'pyc\n')
+        self._write('mixed/deep/b.py', 'py\n')
+        self.assertEqual(_git(self.work, 'status', '--porcelain').splitlines(),
+                         ['A  .gitignore', '?? mixed/'])
+        self.assertEqual(self._get_status(), [('A', '.gitignore'), ('??', 'mixed/')])
+        self.assertEqual([(change.flag, change.path) for change in git.iter_changes()],
+                         [('A', '.gitignore'), ('??', 'mixed/')])
+
+    def test_incremental(self):
+        """Unchanged content with new stat data is hashed once."""
+        repository = git.Repository.find(self.work)
+        index_mtime = os.stat(os.path.join(repository.git_dir, 'index')).st_mtime
+        # Checked out files aren't older than the index, so backdate and refresh them.
+        os.utime(os.path.join(self.work, 'a.txt'), (index_mtime - 20, index_mtime - 20))
+        _git(self.work, 'update-index', '--refresh')
+        os.utime(os.path.join(repository.git_dir, 'index'), (index_mtime, index_mtime))
+        engine = gitindex.StatusEngine(repository)
+        self.assertEqual(self._get_status(engine), [])
+        self.assertEqual(engine.hash_count, 0)
+        os.utime(os.path.join(self.work, 'a.txt'), (index_mtime - 10, index_mtime - 10))
+        self.assertEqual(self._get_status(engine), [])
+        self.assertEqual(engine.hash_count, 1)
+        self.assertEqual(self._get_status(engine), [])
+        self.assertEqual(engine.hash_count, 1)
+
+    def test_index_versions(self):
+        """Versions 2 to 4 have the same entries."""
+        os.makedirs(os.path.join(self.work, 'dir', 'sub'))
+        for path in ('dir/x.txt', 'dir/sub/y.txt', 'dir/sub/z.txt'):
+            self._write(path, path)
+        _git(self.work, 'add', 'dir')
+        index_path = os.path.join(self.work, '.git', 'index')
+        expected = _git(self.work, 'ls-files', '-s').splitlines()
+        for version in (2, 3, 4):
+            if version == 3:
+                # Version 3 is only written when an entry has extended flags.
+                _git(self.work, 'update-index', '--skip-worktree', 'dir/x.txt')
+            _git(self.work, 'update-index', '--index-version', str(version))
+            index = gitindex.read_index(index_path)
+            self.assertEqual(index.version, version)
+            self.assertEqual(['%o %s %d\t%s' % (entry.mode, entry.object_id, entry.stage,
+                                                entry.path)
+                              for entry in index.entries],
+                             expected)
+        self.assertEqual(self._get_status(), [('A', 'dir/sub/y.txt'), ('A', 'dir/sub/z.txt'),
+                                              ('A', 'dir/x.txt')])
+
+    def test_iter_changes(self):
+        """iter_changes() uses the status engine."""
+        self._write('a.txt', 'changed\n')
+        changes = list(git.iter_changes())
+        self.assertEqual([(change.flag, change.path) for change in changes], [('M', 'a.txt')])
+        self.assertTrue(changes[0].modified > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+
+"""Scriptbase gitconfig.py tests."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from scriptbase import git
+from scriptbase import gitconfig
+
+
+class TestGitConfig(unittest.TestCase):
+    """Config engine test suite."""
+
+    def setUp(self):
+        """Create a repository and global config with includes."""
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.save_environment = dict(os.environ)
+        self.save_directory = os.getcwd()
+        self.global_path = os.path.join(self.root, 'global.gitconfig')
+        os.environ['GIT_CONFIG_GLOBAL'] = self.global_path
+        os.environ['GIT_CONFIG_NOSYSTEM'] = '1'
+        self.work = os.path.join(self.root, 'projects', 'work')
+        os.makedirs(self.work)
+        subprocess.check_output(['git', 'init', '-q', '-b', 'master', self.work])
+        self._write(self.global_path, '\n'.join([
+            '[user]',
+            '\tname = Global User',
+            '\temail = global@example.com',
+            '[include]',
+            '\tpath = included.gitconfig',
+            '[includeIf "gitdir:projects/"]',
+            '\tpath = projects.gitconfig',
+            '[includeIf "gitdir:elsewhere/"]',
+            '\tpath = elsewhere.gitconfig',
+            '[includeIf "onbranch:feature/"]',
+            '\tpath = feature.gitconfig',
+            '[remote "origin"]',
+            '\tfetch = +refs/heads/*:refs/remotes/origin/*',
+        ]))
+        self._write(os.path.join(self.root, 'included.gitconfig'), '[alias]\n\tst = status\n')
+        self._write(os.path.join(self.root, 'projects.gitconfig'), '[user]\n\temail = work@example.com\n')
+        self._write(os.path.join(self.root, 'elsewhere.gitconfig'), '[user]\n\tname = Wrong\n')
+        self._write(os.path.join(self.root, 'feature.gitconfig'), '[core]\n\tfeature = yes\n')
+        self._git('remote', 'add', 'origin', 'https://example.com/Repo.git')
+        self._git('config', '--add', 'remote.origin.fetch', '+refs/tags/*:refs/tags/*')
+        os.chdir(self.work)
+
+    def tearDown(self):
+        """Restore the environment and remove files."""
+        os.chdir(self.save_directory)
+        os.environ.clear()
+        os.environ.update(self.save_environment)
+        shutil.rmtree(self.root)
+
+    @classmethod
+    def _write(cls, path, text):
+        with open(path, 'w') as file_handle:
+            file_handle.write(text)
+
+    def _git(self, *args):
+        return subprocess.check_output(['git', '-C', self.work] + list(args)).decode('utf8')
+
+    def test_parse_items(self):
+        """Items keep file order, multiple values and subsection case."""
+        self.assertEqual(gitconfig.parse_config_items('\n'.join([
+            '[Remote "Origin"]',
+            '\tFetch = a',
+            '\tfetch = b',
+            '[bad',
+            '\tignored = x',
+        ])), [('remote', 'Origin', 'fetch', 'a'), ('remote', 'Origin', 'fetch', 'b')])
+        self.assertEqual(gitconfig.normalize_key('Remote.Origin.URL'), 'remote.Origin.url')
+
+    def test_scopes_and_includes(self):
+        """Resolved values match "git config"."""
+        config = git.get_repository().get_config_engine()
+        for key in ('user.name', 'user.email', 'alias.st', 'remote.origin.url'):
+            self.assertEqual(config.get(key), self._git('config', '--get', key).strip())
+        self.assertEqual(config.get_all('remote.origin.fetch'),
+                         self._git('config', '--get-all', 'remote.origin.fetch').splitlines())
+        self.assertEqual(config.get_value('user.email').scope, 'global')
+        self.assertEqual(config.get_value('remote.origin.url').scope, 'local')
+        self.assertEqual(config.get_section('remote', 'origin')['url'],
+                         'https://example.com/Repo.git')
+        self.assertIsNone(config.get('core.feature'))
+        self.assertEqual(git.get_config_value('user.email'), 'work@example.com')
+        self._git('checkout', '-q', '-b', 'feature/x')
+        self.assertTrue(config.get_bool('core.feature'))
+        self.assertEqual(self._git('config', '--get', 'core.feature').strip(), 'yes')
+
+    def test_cache(self):
+        """The table is only rebuilt when a source file changes."""
+        config = gitconfig.GitConfig(git.get_repository())
+        self.assertEqual(config.get('user.name'), 'Global User')
+        self.assertEqual(config.get('alias.st'), 'status')
+        self.assertEqual(config.builds, 1)
+        self._write(os.path.join(self.root, 'included.gitconfig'), '[alias]\n\tst = status -sb\n')
+        self.assertEqual(config.get('alias.st'), 'status -sb')
+        self.assertEqual(config.builds, 2)
+        self._git('config', 'user.name', 'Local User')
+        self.assertEqual(config.get('user.name'), 'Local User')
+        self.assertEqual(config.builds, 3)
+
+    def test_get_info(self):
+        """User settings are available as attributes, including subsections."""
+        info = git.get_info()
+        self.assertEqual(info.user.name, 'Global User')
+        self.assertEqual(info.alias.st, 'status')
+        self.assertEqual(info.remote.origin.fetch, '+refs/heads/*:refs/remotes/origin/*')
+        # Conditional includes need a repository.
+        self.assertEqual(info.user.email, 'global@example.com')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scriptbase instrument.py tests."""
+
+import threading
+import unittest
+
+from scriptbase import instrument
+from scriptbase.command import Command, Pipeline, Runner
+
+class TestInstrument(unittest.TestCase):
+    """Test suite."""
+
+    def setUp(self):
+        """Start recording."""
+        instrument.RECORDER.clear()
+        instrument.enable()
+
+    def tearDown(self):
+        """Stop recording."""
+        instrument.enable(False)
+        instrument.RECORDER.clear()
+
+    def test_command(self):
+        """Record a Command invocation."""
+        with Command('bash', '-c', 'echo abc; exit 3') as cmd:
+            pass
+        self.assertEqual(cmd.return_code, 3)
+        record = instrument.RECORDER.records[-1]
+        self.assertEqual(record.kind, 'command')
+        self.assertEqual(record.return_code, 3)
+        self.assertEqual(record.bytes_read, 4)
+        self.assertTrue(record.wall_time >= 0.0)
+        self.assertTrue(record.spawn_time >= 0.0)
+        self.assertTrue(record.user_time is not None and record.max_rss > 0)
+
+    def test_hooks(self):
+        """Hooks receive start and finish events."""
+        events = []
+        def _hook(event, record):
+            events.append((event, record.kind, record.command))
+        instrument.add_hook(_hook)
+        try:
+            Runner(Runner.CommandArguments()).map('true {item}', [1])
+        finally:
+            instrument.remove_hook(_hook)
+        self.assertEqual(events, [('start', 'map', 'true 1'), ('finish', 'map', 'true 1')])
+
+    def test_summary(self):
+        """Summarize slowest commands."""
+        for seconds in ('0', '0.05'):
+            with Command('sleep', seconds):
+                pass
+        lines = instrument.RECORDER.summary_lines(top=1)
+        self.assertEqual(lines[0], 'commands: 2')
+        self.assertEqual(lines[-1].split()[-2:], ['sleep', '0.05'])
+
+    def test_concurrent_rusage(self):
+        """Pipeline stages reaped on separate threads all add resource usage."""
+        class _Usage(object):
+            ru_utime = 0.001
+            ru_stime = 0.002
+            ru_maxrss = 1
+        record = instrument.CommandRecord('pipeline', 'test')
+        def _add():
+            for _ in range(1000):
+                record.add_rusage(_Usage)
+        threads = [threading.Thread(target=_add) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertAlmostEqual(record.user_time, 8.0)
+        self.assertAlmostEqual(record.system_time, 16.0)
+        with Pipeline(['true'], ['true'], ['true']):
+            pass
+        self.assertEqual(instrument.RECORDER.records[-1].kind, 'pipeline')
+        self.assertTrue(instrument.RECORDER.records[-1].user_time is not None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Scriptbase plan.py tests."""
+
+import sys
+import os
+import json
+import tempfile
+import unittest
+
+from scriptbase import plan
+from scriptbase import instrument
+from scriptbase.command import Runner
+
+class TestPlan(unittest.TestCase):
+    """Test suite."""
+
+    def setUp(self):
+        """Start recording with console output suppressed."""
+        plan.start()
+        self.save_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+
+    def tearDown(self):
+        """Stop recording and restore console output."""
+        sys.stdout.close()
+        sys.stdout = self.save_stdout
+        plan.stop()
+
+    def _run(self):
+        runner = Runner(Runner.CommandArguments(DRY_RUN=True), cwd='/tmp')
+        runner.shell('make prepare')
+        runner.map('compress {item}', ['a', 'b', 'c'], jobs=2)
+        runner.shell('make finish')
+        return plan.RECORDER
+
+    def test_steps(self):
+        """Steps are recorded with directories and dependencies."""
+        recorder = self._run()
+        data = recorder.to_dict()
+        self.assertEqual([step['command'] for step in data['steps']],
+                         ['make prepare', 'compress a', 'compress b', 'compress c', 'make finish'])
+        self.assertEqual(set([step['cwd'] for step in data['steps']]), set(['/tmp']))
+        self.assertEqual([step['depends_on'] for step in data['steps']],
+                         [[], [0], [0], [0], [1, 2, 3]])
+        self.assertEqual(data['groups'], [dict(id=0, jobs=2, steps=[1, 2, 3])])
+
+    def test_estimate(self):
+        """Estimates use historical timing."""
+        recorder = self._run()
+        history = plan.TimingHistory([
+            dict(command='make prepare', wall_time=1.0),
+            dict(command='make other', wall_time=3.0),
+            dict(command='compress x', wall_time=2.0),
+        ])
+        estimate = recorder.estimate(history)
+        # "make finish" uses the mean "make" time.
+        self.assertEqual(estimate['serial_seconds'], 1.0 + 6.0 + 2.0)
+        self.assertEqual(estimate['critical_path_seconds'], 1.0 + 2.0 + 2.0)
+        self.assertEqual(estimate['estimated_seconds'], 1.0 + 4.0 + 2.0)
+        self.assertEqual(estimate['critical_path'][0], 0)
+        self.assertEqual(estimate['critical_path'][-1], 4)
+        self.assertEqual(recorder.estimate(history, jobs=1)['estimated_seconds'], 9.0)
+        self.assertEqual(recorder.estimate(plan.TimingHistory())['unknown_steps'],
+                         [0, 1, 2, 3, 4])
+
+    def test_history_file(self):
+        """Instrumentation records are saved and loaded as history."""
+        instrument.RECORDER.clear()
+        instrument.enable()
+        try:
+            Runner(Runner.CommandArguments()).shell('true')
+            with tempfile.NamedTemporaryFile('w', suffix='.jsonl') as history_file:
+                instrument.save_records(history_file.name)
+                history = plan.TimingHistory.load(history_file.name)
+        finally:
+            instrument.enable(False)
+            instrument.RECORDER.clear()
+        self.assertIsNotNone(history.estimate(plan.PlanStep(0, 'shell', 'true', '/', [], None)))
+
+    def test_save(self):
+        """Plans are saved as JSON with an estimate."""
+        self._run()
+        with tempfile.NamedTemporaryFile('r', suffix='.json') as plan_file:
+            plan.save(plan_file.name, history=plan.TimingHistory())
+            data = json.load(plan_file)
+        self.assertEqual(len(data['steps']), 5)
+        self.assertTrue('estimate' in data)
+        self.assertIsNone(plan.RECORDER)
+
+if __name__ == '__main__':
+    unittest.main()
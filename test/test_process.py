@@ -0,0 +1,65 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Scriptbase process.py tests."""
+
+import os
+import subprocess
+import unittest
+
+from scriptbase import process
+
+class TestLaunch(unittest.TestCase):
+    """Fast launch test suite."""
+
+    def test_split_simple_command(self):
+        """Only command lines without shell syntax are split."""
+        self.assertEqual(process.split_simple_command('ls -l "a b"'), ['ls', '-l', 'a b'])
+        self.assertEqual(process.split_simple_command('git log --format=%H'),
+                         ['git', 'log', '--format=%H'])
+        self.assertIsNone(process.split_simple_command('ls | wc'))
+        self.assertIsNone(process.split_simple_command('echo $HOME'))
+        self.assertIsNone(process.split_simple_command('ls *.py'))
+        self.assertIsNone(process.split_simple_command('cd /tmp'))
+        self.assertIsNone(process.split_simple_command('A=1 env'))
+        self.assertIsNone(process.split_simple_command('echo "unterminated'))
+
+    def test_spawn_arguments(self):
+        """Launch arguments allow posix_spawn() when possible."""
+        #pylint: disable=protected-access
+        args, kwargs = process._get_fast_spawn_arguments('true', dict(shell=True))
+        self.assertEqual(args, ['true'])
+        self.assertFalse(kwargs['shell'])
+        self.assertTrue(os.path.isabs(kwargs['executable']))
+        self.assertFalse(kwargs['close_fds'])
+        args, kwargs = process._get_fast_spawn_arguments(['true'], dict(cwd='/'))
+        self.assertEqual(kwargs, dict(cwd='/'))
+        args, kwargs = process._get_fast_spawn_arguments('exit 3', dict(shell=True))
+        self.assertEqual(kwargs, dict(shell=True))
+
+    def test_launch(self):
+        """Launched processes behave like Popen() processes."""
+        child = process.launch('echo a  b', shell=True, stdout=subprocess.PIPE)
+        self.assertEqual(child.communicate()[0], b'a b\n')
+        self.assertEqual(child.wait(), 0)
+        child = process.launch('exit 3', shell=True)
+        self.assertEqual(child.wait(), 3)
+        child = process.launch('no_such_program_xyz', shell=True, stderr=subprocess.DEVNULL)
+        self.assertEqual(child.wait(), 127)
+        with self.assertRaises(OSError):
+            process.launch(['no_such_program_xyz'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Scriptbase template.py tests."""
+
+import unittest
+
+from scriptbase.template import Template, TemplateError, compile_template
+from scriptbase.command import Runner
+
+class TestTemplate(unittest.TestCase):
+    """Test suite."""
+
+    def test_render(self):
+        """Format fields and percent directives are both expanded."""
+        symbols = dict(name='abc', items=[1, 2], percent='50%')
+        self.assertEqual(Template('x{name}y %(name)s').render(symbols), 'xabcy abc')
+        self.assertEqual(Template('{items[1]} {name!r:>6}').render(symbols), "2  'abc'")
+        self.assertEqual(Template('{{x}} %% {percent}').render(symbols), '{x} % 50%')
+        self.assertEqual(Template('plain text').render(symbols), 'plain text')
+
+    def test_symbols(self):
+        """Referenced symbols are known after compiling."""
+        compiled = Template('{a} %(b)s {c.d} %%(e)s')
+        self.assertEqual(compiled.symbols, set(['a', 'b', 'c']))
+        self.assertEqual(compiled.get_missing_symbols(dict(b=1)), ['a', 'c'])
+        with self.assertRaises(KeyError):
+            compiled.render(dict(b=1))
+
+    def test_errors(self):
+        """Bad templates fail to compile."""
+        with self.assertRaises(TemplateError):
+            Template('{unterminated')
+        with self.assertRaises(TemplateError):
+            Template('{0}')
+
+    def test_cache(self):
+        """Compiled templates are cached."""
+        self.assertIs(compile_template('{x}'), compile_template('{x}'))
+
+    def test_runner_expand(self):
+        """Runner.expand() uses compiled templates."""
+        runner = Runner(Runner.CommandArguments(), var=dict(x='1', y='2%'))
+        self.assertEqual(runner.expand('{x}-%(x)s-{y}'), '1-1-2%')
+        self.assertEqual(runner.expand('{z}', var=dict(z='3')), '3')
+
+if __name__ == '__main__':
+    unittest.main()
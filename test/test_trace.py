@@ -0,0 +1,60 @@
+# Copyright 2016-19 Steven Cooper
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Scriptbase trace.py tests."""
+
+import os
+import json
+import tempfile
+import unittest
+
+from scriptbase import trace
+from scriptbase.command import Command
+
+class TestTrace(unittest.TestCase):
+    """Test suite."""
+
+    def test_spans(self):
+        """Record nested spans and commands and save them as JSON."""
+        trace.start()
+        try:
+            with trace.span('outer', size=1):
+                with Command('true'):
+                    pass
+        finally:
+            file_descriptor, path = tempfile.mkstemp()
+            os.close(file_descriptor)
+            trace.save(path)
+        try:
+            with open(path) as file_handle:
+                events = json.load(file_handle)['traceEvents']
+        finally:
+            os.remove(path)
+        spans = {event['name']: event for event in events if event['ph'] == 'X'}
+        self.assertEqual(sorted(spans.keys()), ['outer', 'true'])
+        outer, command = spans['outer'], spans['true']
+        self.assertEqual(outer['args'], {'size': 1})
+        self.assertEqual(command['cat'], 'command')
+        self.assertEqual(command['tid'], outer['tid'])
+        self.assertTrue(outer['ts'] <= command['ts'])
+        self.assertTrue(command['ts'] + command['dur'] <= outer['ts'] + outer['dur'])
+
+    def test_inactive(self):
+        """Spans do nothing when tracing is not started."""
+        with trace.span('nothing'):
+            pass
+        self.assertEqual(trace.RECORDER, None)
+
+if __name__ == '__main__':
+    unittest.main()